@@ -4,18 +4,69 @@ __maintainer__ = "Nazariy Vavryk"
 __email__ = "nazariy@inbox.ru"
 __status__ = "Protorype"
 
+from logging.handlers import QueueHandler, QueueListener
 import logging
+import atexit
+import queue
 import sys
+import os
+
+# * what gets logged. DEBUG adds the diagnostics of every file that is checked
+DEFAULT_LOG_LEVEL = "INFO"
+
+# * records are written to stdout from a thread of their own. Set LOG_QUEUE=0 to
+# * write them from the thread that logs them instead, e.g. to see the last ones
+# * before a crash
+DEFAULT_LOG_QUEUE = "1"
+
+
+def log_level() -> int:
+    name = os.getenv("LOG_LEVEL", DEFAULT_LOG_LEVEL).strip().upper()
+    if name.isdigit():
+        return int(name)
+    level = logging.getLevelName(name)
+    return level if isinstance(level, int) else logging.INFO
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Puts the records on the queue as they are. The message is only formatted by
+    the logging thread, when it writes the record out, rather than by the thread
+    that logged it
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _log_synchronously() -> None:
+    # * a forked process (e.g. a worker of the runner) does not get the logging
+    # * thread, and exits without running atexit. It writes its records itself
+    if queue_handler is not None:
+        root.removeHandler(queue_handler)
+        root.addHandler(stdout_handler)
+
 
 root = logging.getLogger()
 if root.hasHandlers():
     root.handlers = []
-root.setLevel(logging.DEBUG)
+root.setLevel(log_level())
 stdout_handler = logging.StreamHandler(sys.stdout)
 formatter = logging.Formatter(
     "%(asctime)s - %(name)s - %(levelname)s - %(message)s |"
     " [%(filename)s:%(lineno)s - %(funcName)s()]"
 )
 stdout_handler.setFormatter(formatter)
-root.addHandler(stdout_handler)
+
+queue_handler = None
+if os.getenv("LOG_QUEUE", DEFAULT_LOG_QUEUE) != "0":
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    listener = QueueListener(records, stdout_handler)
+    listener.start()
+    # * writes out whatever is still queued when the filter is done
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=_log_synchronously)
+    root.addHandler(queue_handler)
+else:
+    root.addHandler(stdout_handler)
 l = root
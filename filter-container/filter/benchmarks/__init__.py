@@ -0,0 +1,28 @@
+"""Micro-benchmarks of the hot paths of the conditions, on synthetic inputs of
+1MB, 100MB and 1GB, with baselines to compare against:
+
+    python -m filter.benchmarks run --sizes 1MB,100MB --output current.json
+    python -m filter.benchmarks compare filter/benchmarks/baselines/baseline.json \\
+        current.json --tolerance 0.1
+
+and of the filter as a whole, over generated jobs that leak (or do not leak) the
+way the algos in algos/ do:
+
+    python -m filter.benchmarks scenarios --sizes 100MB,1GB --output jobs.json
+"""
+
+from .scenarios import SCENARIOS, make_job, run_job, run_scenarios
+from .suite import BENCHMARKS, compare, make_input, parse_size, run_one, run_suite
+
+__all__ = [
+    "BENCHMARKS",
+    "SCENARIOS",
+    "compare",
+    "make_input",
+    "make_job",
+    "parse_size",
+    "run_job",
+    "run_one",
+    "run_scenarios",
+    "run_suite",
+]
@@ -0,0 +1,82 @@
+from typing import List, Optional
+import argparse
+import json
+import sys
+
+from .suite import (
+    BENCHMARKS,
+    DEFAULT_DATA_DIR,
+    DEFAULT_REPEAT,
+    DEFAULT_SIZES,
+    compare,
+    run_suite,
+)
+from .scenarios import DEFAULT_SCENARIO_SIZES, SCENARIOS, run_scenarios
+
+DEFAULT_TOLERANCE = 0.1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m filter.benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--sizes", default=",".join(DEFAULT_SIZES))
+    run.add_argument(
+        "--only", default="", help=f"comma separated, of {', '.join(BENCHMARKS)}"
+    )
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run.add_argument("--data", default=DEFAULT_DATA_DIR, help="where inputs are kept")
+    run.add_argument("--output", help="json file for the results, else stdout")
+
+    jobs = commands.add_parser(
+        "scenarios", help="run the filter end to end over generated jobs"
+    )
+    jobs.add_argument(
+        "--sizes",
+        default=",".join(DEFAULT_SCENARIO_SIZES),
+        help="of the input of the jobs",
+    )
+    jobs.add_argument(
+        "--only", default="", help=f"comma separated, of {', '.join(SCENARIOS)}"
+    )
+    jobs.add_argument("--data", default=DEFAULT_DATA_DIR, help="where jobs are kept")
+    jobs.add_argument("--output", help="json file for the results, else stdout")
+
+    diff = commands.add_parser("compare", help="compare results with a baseline")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+    args = parser.parse_args(argv)
+
+    if args.command in ("run", "scenarios"):
+        sizes = [s for s in args.sizes.split(",") if s]
+        names = [n for n in args.only.split(",") if n] or None
+        if args.command == "run":
+            results = run_suite(sizes, names, args.data, args.repeat)
+        else:
+            results = run_scenarios(sizes, names, args.data)
+        report = json.dumps(results, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(report + "\n")
+        else:
+            print(report)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    lines, regressions = compare(baseline, current, args.tolerance)
+    print("\n".join(lines))
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
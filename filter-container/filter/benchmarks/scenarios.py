@@ -0,0 +1,344 @@
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+import subprocess
+import shutil
+import random
+import json
+import time
+import sys
+import os
+
+from .suite import (
+    CHUNK_SIZE,
+    DEFAULT_DATA_DIR,
+    DEFAULT_SEED,
+    ROOT,
+    _write,
+    make_input,
+    parse_size,
+)
+
+DEFAULT_SCENARIO_SIZES = ["100MB"]
+
+# * what a job that has not leaked anything writes, relative to its input. Well
+# * under the 10% of SmallSize
+SUMMARY_FRACTION = 0.02
+
+DIDS = ["did"]
+DATA_CATEGORIES = ["Mathematics"]
+
+# * a keyword of the mathematics category of the development environment
+KEYWORD = "fractals"
+
+# * marks the line of the job (on stderr) that carries the verdicts
+RESULT_MARKER = "BENCHMARK-RESULT "
+
+# * code points of the 1, 2, 3 and 4 byte utf-8 characters, weighted so that
+# * every byte value turns up about as often as the others
+CIPHERTEXT_RANGES = [
+    ((0x01, 0x7F), 124),
+    ((0x80, 0x7FF), 30),
+    ((0x800, 0xFFFF), 16),
+    ((0x10000, 0x10FFFF), 5),
+]
+
+# * characters that would structure the csv. Surrogates are left out too, they
+# * are not utf-8
+CIPHERTEXT_EXCLUDED = {ord(","), ord('"'), ord("\n"), ord("\r")}
+
+
+def _summary_chunks(size: int, seed: int) -> Iterable[bytes]:
+    """Aggregates, the kind of csv a job that does not leak writes: a few
+    numeric columns per group
+    """
+    rng = random.Random(seed)
+    yield b"group,count,mean,std\n"
+    written = 21
+    group = 0
+    while written < size:
+        rows = []
+        length = 0
+        while length < min(CHUNK_SIZE, size - written):
+            row = (
+                f"{group},{rng.randrange(1, 10 ** 5)},"
+                f"{rng.gauss(50, 10):.4f},{abs(rng.gauss(5, 2)):.4f}\n"
+            )
+            rows.append(row)
+            length += len(row)
+            group += 1
+        yield "".join(rows).encode()
+        written += length
+
+
+def _ciphertext_chunks(size: int, seed: int) -> Iterable[bytes]:
+    """Ciphertext written out as csv text, like encrypts.py does: valid utf-8 that
+    the keywords condition parses (and lets through), with about as much entropy
+    as the raw ciphertext
+    """
+    rng = random.Random(seed)
+    spans = [span for span, _ in CIPHERTEXT_RANGES]
+    weights = [weight for _, weight in CIPHERTEXT_RANGES]
+
+    def cell() -> str:
+        chars = []
+        for low, high in rng.choices(spans, weights, k=64):
+            code = rng.randint(low, high)
+            while code in CIPHERTEXT_EXCLUDED or 0xD800 <= code < 0xE000:
+                code = rng.randint(low, high)
+            chars.append(chr(code))
+        return "".join(chars)
+
+    written = 0
+    while written < size:
+        row = (",".join(cell() for _ in range(16)) + "\n").encode()
+        yield row
+        written += len(row)
+
+
+def _head(path: str, size: int) -> Iterable[bytes]:
+    """The first size bytes of a file, cut after the last whole line"""
+    with open(path, "rb") as f:
+        while size > CHUNK_SIZE:
+            data = f.read(CHUNK_SIZE)
+            size -= len(data)
+            yield data
+        data = f.read(size)
+    yield data[: data.rfind(b"\n") + 1] or data
+
+
+def _with_keyword(chunks: Iterable[bytes]) -> Iterable[bytes]:
+    """The chunks, with a row that has the keyword at the very end, so that the
+    whole file is read before it is found
+    """
+    yield from chunks
+    yield f"-1,0,{KEYWORD},0\n".encode()
+
+
+class Scenario(NamedTuple):
+    # * the algo in algos/ that it mirrors
+    algo: str
+    # * names of the conditions that may catch it, any one of them will do (the
+    # * others are cancelled once it does). Empty if nothing should be caught
+    violates: Tuple[str, ...]
+    # * writes the outputs of the job, given its input, the output directory and
+    # * the size of the input
+    outputs: Callable[[str, str, int], None]
+
+
+def _summary_output(input_file: str, outputs: str, size: int) -> None:
+    target = max(1, int(size * SUMMARY_FRACTION))
+    _write(os.path.join(outputs, "output1.csv"), _summary_chunks(target, DEFAULT_SEED))
+
+
+def _encrypted_output(input_file: str, outputs: str, size: int) -> None:
+    target = max(1, int(size * SUMMARY_FRACTION))
+    chunks = _ciphertext_chunks(target, DEFAULT_SEED)
+    _write(os.path.join(outputs, "output1.csv"), chunks)
+
+
+def _correlated_output(input_file: str, outputs: str, size: int) -> None:
+    # * rows of the input as they are, small enough to get past SmallSize
+    target = max(1, int(size * SUMMARY_FRACTION))
+    _write(os.path.join(outputs, "output1.csv"), _head(input_file, target))
+
+
+def _too_large_output(input_file: str, outputs: str, size: int) -> None:
+    _write(os.path.join(outputs, "output1.csv"), _head(input_file, size // 5))
+
+
+def _keyword_output(input_file: str, outputs: str, size: int) -> None:
+    target = max(1, int(size * SUMMARY_FRACTION))
+    chunks = _with_keyword(_summary_chunks(target, DEFAULT_SEED))
+    _write(os.path.join(outputs, "output1.csv"), chunks)
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "non_violating": Scenario("non-violating/algo.py", (), _summary_output),
+    "encrypts": Scenario("violating/encrypts.py", ("NotEncrypted",), _encrypted_output),
+    "correlated": Scenario(
+        "violating/correlated.py", ("Correlation",), _correlated_output
+    ),
+    "too_large": Scenario("violating/too_large.py", ("SmallSize",), _too_large_output),
+    "contains_keywords": Scenario(
+        "violating/contains_keywords.py", ("Keywords",), _keyword_output
+    ),
+}
+
+
+def make_job(name: str, size: int, data_dir: str) -> Dict[str, str]:
+    """Directories of a job of the scenario, written once and reused afterwards.
+    The filter wipes the outputs of a job that fails, so they have to be copied
+    (see fresh_outputs) before every run.
+
+    Args:
+        name (str): one of SCENARIOS
+        size (int): bytes of the input
+        data_dir (str): where the jobs are kept
+
+    Returns:
+        Dict[str, str]: INPUTS and the pristine OUTPUTS of the job
+    """
+    root = os.path.join(data_dir, f"job-{name}-{size}")
+    inputs, outputs = os.path.join(root, "inputs"), os.path.join(root, "outputs")
+    input_file = os.path.join(inputs, DIDS[0], "0")
+
+    if not os.path.exists(input_file):
+        os.makedirs(os.path.dirname(input_file), exist_ok=True)
+        # * a hard link, the sizes of symlinks are not counted by SmallSize
+        os.link(make_input("csv", size, data_dir), input_file)
+
+    done = os.path.join(root, ".done")
+    if not os.path.exists(done):
+        shutil.rmtree(outputs, ignore_errors=True)
+        os.makedirs(outputs)
+        SCENARIOS[name].outputs(input_file, outputs, size)
+        _write(done, [b""])
+
+    return {"INPUTS": inputs, "OUTPUTS": outputs}
+
+
+def fresh_outputs(job: Dict[str, str], run_dir: str) -> str:
+    """Copy of the pristine outputs of a job, for the filter to check (and wipe)"""
+    shutil.rmtree(run_dir, ignore_errors=True)
+    shutil.copytree(job["OUTPUTS"], run_dir)
+    return run_dir
+
+
+def _size_of(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def run_job(
+    job: Dict[str, str], outputs: str, env: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """Runs the filter (filter.main) over a job, in a fresh interpreter, the way
+    the pod runs it
+
+    Args:
+        job (Dict[str, str]): INPUTS of the job
+        outputs (str): OUTPUTS of the job, wiped if a condition is not met
+        env (Optional[Dict[str, str]], optional): on top of os.environ, e.g. to
+        try out CONDITION_POOL=process. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: verdicts and metrics of the conditions, wall time
+        (interpreter start included), time spent in main and peak RSS of the filter
+    """
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "from filter.main import main\n"
+        "verdicts = main()\n"
+        "seconds = time.perf_counter() - start\n"
+        "from filter.conditions.utils.metrics import peak_rss_mb\n"
+        "peak = peak_rss_mb()\n"
+        f"print({RESULT_MARKER!r} + json.dumps("
+        "{'verdicts': verdicts, 'main_seconds': seconds, 'peak_rss_mb': peak}),"
+        " file=sys.stderr)"
+    )
+    report = os.path.join(os.path.dirname(job["INPUTS"]), "metrics.json")
+    environment = {
+        **os.environ,
+        "METRICS_REPORT": report,
+        "INPUTS": job["INPUTS"],
+        "OUTPUTS": outputs,
+        "DIDS": json.dumps(DIDS),
+        "DATA_CATEGORIES": json.dumps(DATA_CATEGORIES),
+        **(env or {}),
+    }
+
+    start = time.perf_counter()
+    done = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=environment,
+    )
+    wall = time.perf_counter() - start
+
+    # * on stderr, the logging thread may be writing to stdout at the same time
+    lines = [s for s in done.stderr.splitlines() if s.startswith(RESULT_MARKER)]
+    if done.returncode != 0 or not lines:
+        raise RuntimeError(f"the filter failed on {job['INPUTS']}: {done.stderr}")
+
+    measured: Dict[str, Any] = json.loads(lines[-1][len(RESULT_MARKER) :])
+    measured["wall_seconds"] = wall
+    # * what every condition cost, see filter.main.report_metrics
+    with open(report) as f:
+        metrics = json.load(f)
+    measured.update(scan=metrics["scan"], conditions=metrics["conditions"])
+    return measured
+
+
+def is_correct(verdicts: Dict[str, Optional[bool]], violates: Tuple[str, ...]) -> bool:
+    """Whether the filter caught what the scenario leaks, and nothing else: a
+    job that leaks is failed by (only) the conditions it violates, one that does not
+    passes all of them. Conditions that were cancelled (None) do not count.
+    """
+    failed = {name for name, verdict in verdicts.items() if verdict is False}
+    if not violates:
+        return not failed and all(verdicts.values())
+    return bool(failed) and failed <= set(violates)
+
+
+def run_scenarios(
+    sizes: Iterable[str] = DEFAULT_SCENARIO_SIZES,
+    names: Optional[Iterable[str]] = None,
+    data_dir: str = DEFAULT_DATA_DIR,
+    env: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Generates a job for every scenario at every size (of the input) and runs the
+    filter over it
+
+    Args:
+        sizes (Iterable[str], optional): Defaults to DEFAULT_SCENARIO_SIZES.
+        names (Optional[Iterable[str]], optional): scenarios to run. Defaults to
+        all of SCENARIOS.
+        data_dir (str, optional): where the jobs are kept. Defaults to
+        DEFAULT_DATA_DIR.
+        env (Optional[Dict[str, str]], optional): for the filter. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: keyed by "name@size": the verdicts, whether they are
+        correct, wall time, MB/s (of inputs and outputs together) and peak RSS
+    """
+    results: Dict[str, Any] = {}
+
+    for size in sizes:
+        for name in names or SCENARIOS:
+            if name not in SCENARIOS:
+                raise ValueError(f"unknown scenario: {name}")
+            scenario = SCENARIOS[name]
+
+            job = make_job(name, parse_size(size), data_dir)
+            outputs = fresh_outputs(job, os.path.join(data_dir, "run-outputs"))
+            total = _size_of(job["INPUTS"]) + _size_of(outputs)
+
+            measured = run_job(job, outputs, env)
+            measured.update(
+                algo=scenario.algo,
+                violates=scenario.violates,
+                correct=is_correct(measured["verdicts"], scenario.violates),
+                bytes=total,
+                mb_per_s=total / max(measured["wall_seconds"], 1e-9) / (1 << 20),
+            )
+            results[f"{name}@{size}"] = measured
+
+    return {
+        "machine": {"python": sys.version.split()[0], "cpus": os.cpu_count()},
+        "results": results,
+    }
+
+
+__all__ = [
+    "SCENARIOS",
+    "fresh_outputs",
+    "is_correct",
+    "make_job",
+    "run_job",
+    "run_scenarios",
+]
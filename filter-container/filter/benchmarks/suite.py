@@ -0,0 +1,360 @@
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import subprocess
+import tempfile
+import random
+import json
+import mmap
+import time
+import sys
+import os
+
+from filter.conditions.utils.lazy import timed_import
+from filter.conditions.utils.metrics import peak_rss_mb
+
+# * every input is made from this seed, so runs on different machines (and days)
+# * look at the same bytes
+DEFAULT_SEED = 20201
+DEFAULT_SIZES = ["1MB", "100MB", "1GB"]
+DEFAULT_REPEAT = 3
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "filter-benchmarks")
+
+# * inputs are written in chunks of this size, the text ones by repeating a chunk
+CHUNK_SIZE = 1 << 20
+
+# * size of the files of the directory that get_size_of_dir walks
+DIR_FILE_SIZE = 1 << 16
+
+# * peak RSS may grow by this much on top of the tolerance, a small run's RSS is
+# * mostly the interpreter and numpy, and moves by a few MB from run to run
+RSS_SLACK_MB = 16.0
+
+# * the directory filter is in, the benchmarks run from there
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+UNITS = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+
+WORDS = [
+    "alpha",
+    "beta",
+    "gamma",
+    "delta",
+    "ocean",
+    "protocol",
+    "privacy",
+    "filter",
+    "entropy",
+    "keyword",
+    "output",
+    "input",
+]
+
+
+def parse_size(size: str) -> int:
+    """Bytes of a size like 1MB or 64KB (binary units)"""
+    size = size.strip().upper()
+    for unit, factor in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * factor)
+    return int(size)
+
+
+def _random_chunks(size: int, seed: int) -> Iterable[bytes]:
+    rng = random.Random(seed)
+    for start in range(0, size, CHUNK_SIZE):
+        n = min(CHUNK_SIZE, size - start)
+        # * the same bytes as rng.randbytes(n), which is 3.9+
+        yield rng.getrandbits(8 * n).to_bytes(n, "little")
+
+
+def _csv_chunks(size: int, seed: int) -> Iterable[bytes]:
+    """A low cardinality csv, like most outputs, without any of the keywords"""
+    rng = random.Random(seed)
+    rows = ["id,name,category,value,score"]
+    length = len(rows[0]) + 1
+    while length < CHUNK_SIZE:
+        row = (
+            f"{rng.randrange(10 ** 6)},{rng.choice(WORDS)} {rng.choice(WORDS)},"
+            f"{rng.choice(WORDS)},{rng.random():.6f},{rng.randrange(100)}"
+        )
+        rows.append(row)
+        length += len(row) + 1
+    header, body = rows[0] + "\n", "\n".join(rows[1:]) + "\n"
+    chunk = body.encode()
+
+    yield header.encode()
+    written = len(header)
+    while written < size:
+        # * whole rows only, the file may end up a little short of size
+        part = chunk[: size - written]
+        part = part[: part.rfind(b"\n") + 1] or part
+        yield part
+        written += len(part)
+
+
+def _write(path: str, chunks: Iterable[bytes]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+def make_input(kind: str, size: int, data_dir: str, seed: int = DEFAULT_SEED) -> str:
+    """Path of a synthetic input, written once and reused afterwards
+
+    Args:
+        kind (str): "random" (incompressible bytes), "csv", or "dir" (a directory
+        of random files of DIR_FILE_SIZE bytes)
+        size (int): bytes, in total for "dir"
+        data_dir (str): where the inputs are kept
+        seed (int, optional): Defaults to DEFAULT_SEED.
+
+    Returns:
+        str: path of the file or directory
+    """
+    path: str = os.path.join(data_dir, f"{kind}-{size}-{seed}")
+    if kind == "csv":
+        path += ".csv"
+
+    if kind == "dir":
+        done = os.path.join(path, ".done")
+        if not os.path.exists(done):
+            for i, start in enumerate(range(0, size, DIR_FILE_SIZE)):
+                file_size = min(DIR_FILE_SIZE, size - start)
+                name = os.path.join(path, f"{i // 256:04d}", f"{i:06d}")
+                _write(name, _random_chunks(file_size, seed + i))
+            _write(done, [b""])
+        return path
+
+    if not os.path.exists(path):
+        chunks = _csv_chunks if kind == "csv" else _random_chunks
+        _write(path, chunks(size, seed))
+    return path
+
+
+class Workload(NamedTuple):
+    # * what one run does
+    run: Callable[[], Any]
+    # * bytes that one run processes, and operations (calls, files)
+    bytes: int
+    ops: int
+
+
+def _shannon(size: int, data_dir: str) -> Workload:
+    from filter.conditions.utils import EntropyAlgos
+
+    path = make_input("random", size, data_dir)
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return Workload(lambda: EntropyAlgos.shannon(data), size, 1)
+
+
+def _not_encrypted(size: int, data_dir: str) -> Workload:
+    from filter.conditions.not_encrypted import NotEncrypted
+    from filter.conditions.utils.pyramid import clear_pyramids
+
+    path = make_input("random", size, data_dir)
+    condition = NotEncrypted()
+
+    def run() -> Any:
+        # * the pyramids would be served from the cache after the first run
+        clear_pyramids()
+        return condition._file_entropies(path)
+
+    return Workload(run, size, 1)
+
+
+def _not_correlated(size: int, data_dir: str) -> Workload:
+    from filter.conditions import DEFAULT_FILENAME
+    from filter.conditions.not_correlated import NotCorrelated
+    from filter.conditions.utils.pyramid import clear_pyramids
+
+    root = os.path.join(data_dir, f"correlation-{size}")
+    inputs, outputs, did = (
+        os.path.join(root, "inputs"),
+        os.path.join(root, "outputs"),
+        "did",
+    )
+    input_file = os.path.join(inputs, did, DEFAULT_FILENAME)
+    output_file = os.path.join(outputs, "out")
+    for path, source in ((input_file, size), (output_file, max(1, size // 10))):
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.symlink(make_input("random", source, data_dir), path)
+
+    os.environ.update(INPUTS=inputs, OUTPUTS=outputs, DIDS=json.dumps([did]))
+    condition = NotCorrelated()
+
+    def run() -> Any:
+        clear_pyramids()
+        return condition._calc_correlation()
+
+    return Workload(run, size + max(1, size // 10), 1)
+
+
+def _check_csv(size: int, data_dir: str) -> Workload:
+    from filter.conditions.no_keywords import NoKeywords
+
+    path = make_input("csv", size, data_dir)
+    os.environ.update(
+        DIDS='["did"]', DATA_CATEGORIES='["Mathematics", "Computer Technology"]'
+    )
+    condition = NoKeywords()
+
+    return Workload(lambda: condition.check_csv(path), os.path.getsize(path), 1)
+
+
+def _get_size_of_dir(size: int, data_dir: str) -> Workload:
+    from filter.conditions.utils import get_size_of_dir
+
+    path = make_input("dir", size, data_dir)
+    files = -(-size // DIR_FILE_SIZE)
+
+    return Workload(lambda: get_size_of_dir(path), size, files)
+
+
+# * name -> builds the workload for a size
+BENCHMARKS: Dict[str, Callable[[int, str], Workload]] = {
+    "shannon": _shannon,
+    "not_encrypted": _not_encrypted,
+    "not_correlated": _not_correlated,
+    "check_csv": _check_csv,
+    "get_size_of_dir": _get_size_of_dir,
+}
+
+
+def run_one(name: str, size: int, data_dir: str, repeat: int) -> Dict[str, Any]:
+    """Runs a benchmark in this process, repeat times, and measures the best run
+
+    Returns:
+        Dict[str, Any]: MB/s and ops/s of the best run, peak RSS of the process
+    """
+    # * numpy is imported on first use, which is not what is measured
+    timed_import("numpy")
+    workload = BENCHMARKS[name](size, data_dir)
+    timings: List[float] = []
+
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        workload.run()
+        timings.append(time.perf_counter() - start)
+
+    best = max(min(timings), 1e-9)
+    return {
+        "seconds": best,
+        "mb_per_s": workload.bytes / best / (1 << 20),
+        "ops_per_s": workload.ops / best,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_suite(
+    sizes: Iterable[str] = DEFAULT_SIZES,
+    names: Optional[Iterable[str]] = None,
+    data_dir: str = DEFAULT_DATA_DIR,
+    repeat: int = DEFAULT_REPEAT,
+) -> Dict[str, Any]:
+    """Runs every benchmark at every size, each in a fresh interpreter, so that
+    the peak RSS is that of the benchmark alone and no cache carries over
+
+    Args:
+        sizes (Iterable[str], optional): Defaults to DEFAULT_SIZES.
+        names (Optional[Iterable[str]], optional): benchmarks to run. Defaults to
+        all of BENCHMARKS.
+        data_dir (str, optional): where the inputs are kept. Defaults to
+        DEFAULT_DATA_DIR.
+        repeat (int, optional): runs per benchmark, the best one counts. Defaults
+        to DEFAULT_REPEAT.
+
+    Returns:
+        Dict[str, Any]: results, keyed by "name@size", with what they ran on
+    """
+    results: Dict[str, Any] = {}
+
+    for size in sizes:
+        for name in names or BENCHMARKS:
+            if name not in BENCHMARKS:
+                raise ValueError(f"unknown benchmark: {name}")
+            # * the result goes to stderr, the logging thread may be writing to stdout
+            code = (
+                "import json, logging, sys\n"
+                "from filter.benchmarks.suite import run_one\n"
+                "logging.getLogger().setLevel(logging.WARNING)\n"
+                "print(json.dumps(run_one(sys.argv[1], int(sys.argv[2]), sys.argv[3],"
+                " int(sys.argv[4]))), file=sys.stderr)"
+            )
+            args = [name, str(parse_size(size)), data_dir, str(repeat)]
+            done = subprocess.run(
+                [sys.executable, "-c", code, *args],
+                capture_output=True,
+                text=True,
+                cwd=ROOT,
+            )
+            if done.returncode != 0:
+                raise RuntimeError(f"{name}@{size} failed: {done.stderr}")
+            results[f"{name}@{size}"] = json.loads(done.stderr.strip().splitlines()[-1])
+
+    return {
+        "machine": {"python": sys.version.split()[0], "cpus": os.cpu_count()},
+        "results": results,
+    }
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float
+) -> Tuple[List[str], List[str]]:
+    """Compares the results of two runs
+
+    Args:
+        baseline (Dict[str, Any]): results of run_suite to compare against
+        current (Dict[str, Any]): results of run_suite
+        tolerance (float): relative slack, e.g. 0.1 lets throughput drop (and peak
+        RSS grow, by RSS_SLACK_MB more) by 10% before it is a regression
+
+    Returns:
+        Tuple[List[str], List[str]]: a line per benchmark that both have, and the
+        regressions among them
+    """
+    lines: List[str] = []
+    regressions: List[str] = []
+
+    for key, before in sorted(baseline["results"].items()):
+        after = current["results"].get(key)
+        if after is None:
+            continue
+
+        problems = []
+        if after["mb_per_s"] < before["mb_per_s"] * (1 - tolerance):
+            problems.append("throughput")
+        if (
+            after["peak_rss_mb"]
+            > before["peak_rss_mb"] * (1 + tolerance) + RSS_SLACK_MB
+        ):
+            problems.append("peak rss")
+        # * the end to end runs (see scenarios) also say whether the verdicts held
+        if before.get("correct") and after.get("correct") is False:
+            problems.append("verdict")
+
+        line = (
+            f"{key:<28} {before['mb_per_s']:>10.1f} -> {after['mb_per_s']:>10.1f} MB/s"
+            f" {before['peak_rss_mb']:>8.1f} -> {after['peak_rss_mb']:>8.1f} MB RSS"
+        )
+        if problems:
+            line += f"  REGRESSION ({', '.join(problems)})"
+            regressions.append(line)
+        lines.append(line)
+
+    return lines, regressions
+
+
+__all__ = [
+    "BENCHMARKS",
+    "compare",
+    "make_input",
+    "parse_size",
+    "peak_rss_mb",
+    "run_one",
+    "run_suite",
+]
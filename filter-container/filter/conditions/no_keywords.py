@@ -1,17 +1,561 @@
+import io
 import os
+import re
+import csv
 import json
-import yaml
+import codecs
 import logging
-import confuse
-import pandas as pd
-from typing import List
-
-from filter.conditions.utils import validate_inputs_outputs, dataCategory
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from filter.conditions.utils import Buffer, validate_inputs_outputs, dataCategory
+from filter.conditions.utils.scan import ScanObserver
+from filter.conditions.utils.blocks import BlockReader, read_buffer_size
+from filter.conditions.utils.cancel import raise_if_cancelled
+from filter.conditions.utils.csv_shards import ShardPool, iter_range
+from filter.conditions.utils.keyword_index import (
+    DEFAULT_KEYWORD_INDEX,
+    KeywordIndex,
+    load_keyword_index,
+)
+from filter.conditions.utils.json_stream import (
+    JsonError,
+    iter_json_events,
+    iter_strings,
+    loads,
+)
+from filter.conditions.utils.keywords import (
+    WORD_CHARS,
+    KeywordAutomaton,
+    keyword_automaton,
+)
+from filter.conditions.utils.parallel import file_workers, ordered_map
+from filter.conditions.utils.shared import open_file
 
 l = logging.getLogger("[no_keywords]")
 
 SUPPORTED_FILES = ["csv", "txt", "json"]
 
+# * characters that structure csv text rather than being part of a cell
+CSV_SYNTAX = ',"\r\n'
+
+# * joins the cells of a row for a single search. Keywords never contain it, so
+# * there are no matches across cells
+CELL_SEPARATOR = "\x00"
+
+# * cells that are numbers. A keyword can only be in one if it is made of the
+# * characters of numbers itself, see DistinctCells
+CSV_NUMBER = re.compile(r"\s*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\s*")
+NUMBER_CHARS = "0123456789+-.eE \t"
+
+# * how many distinct values of a column DistinctCells remembers
+DISTINCT_CELLS_MAX = 1 << 16
+
+# * .csv outputs at least this large are split into shards that are checked in
+# * parallel, see check_csv
+DEFAULT_CSV_SHARD_MIN_SIZE = 1 << 26
+
+# * newline delimited .json outputs at least this large are checked in parallel
+DEFAULT_NDJSON_SHARD_MIN_SIZE = 1 << 26
+
+# * a .json output is only taken for newline delimited json when its first line
+# * is a json document of at most this many bytes
+NDJSON_MAX_LINE = 1 << 24
+
+# * json strings are searched for keywords this many at a time
+JSON_STRING_BATCH = 1 << 12
+
+
+def file_extension(file_loc: str) -> str:
+    extension: str = os.path.split(file_loc)[-1].split(".")[-1].lower()
+    return extension
+
+
+def find_keyword_in_csv(
+    automaton: KeywordAutomaton, text: str, cells: Optional["DistinctCells"] = None
+) -> Optional[str]:
+    """Finds a keyword in any cell (or column name) of complete csv records. When
+    the text has no quotes and no keyword contains a delimiter, quote or newline,
+    the cells are the text between the delimiters, so a keyword occurs in the raw
+    text exactly when it occurs in a cell. The text is then searched in one go
+    without parsing it, which is faster than looking at the cells in python.
+
+    Otherwise the records are parsed, and only the cells that are new to their
+    column (see DistinctCells) are searched, in a single batch. Quotes may split a
+    keyword in the text that is whole in the cell: 0,"agr"i1 is the cell agri1.
+
+    Args:
+        automaton (KeywordAutomaton): keywords to look for
+        text (str): complete csv records
+        cells (Optional[DistinctCells], optional): values of the earlier records of
+        the file. Defaults to None, i.e. text is all there is.
+
+    Returns:
+        Optional[str]: first keyword found, None if there is none
+    """
+    if '"' not in text and not automaton.contains_any(CSV_SYNTAX):
+        return automaton.search(text)
+
+    if cells is None:
+        cells = DistinctCells(automaton)
+    new = cells.new_cells(csv.reader(io.StringIO(text)))
+    return automaton.search(CELL_SEPARATOR.join(new)) if new else None
+
+
+class DistinctCells:
+    """Keeps the distinct values of every column of a csv file, so that a value is
+    searched for keywords once, not once per row: outputs are often millions of
+    rows of a few hundred distinct values. Cells that are numbers are skipped
+    altogether, unless a keyword could be found in a number. A column remembers
+    up to DISTINCT_CELLS_MAX values, and starts over when it has seen more.
+
+    It sees the records that find_keyword_in_csv parses, i.e. those of quoted csv
+    text. Text without quotes is searched as it is, in a single pass.
+    """
+
+    def __init__(self, automaton: KeywordAutomaton) -> None:
+        self.skip_numbers = not automaton.may_occur_in(NUMBER_CHARS)
+        self.columns: List[Set[str]] = []
+
+    def new_cells(self, rows: Iterable[List[str]]) -> List[str]:
+        """Cells of the rows that were not seen in their column before, and that
+        may hold a keyword
+
+        Args:
+            rows (Iterable[List[str]]): parsed csv records
+
+        Returns:
+            List[str]: the cells, in the order of the rows
+        """
+        columns = self.columns
+        is_number = CSV_NUMBER.fullmatch if self.skip_numbers else None
+        new: List[str] = []
+
+        for row in rows:
+            if len(row) > len(columns):
+                columns.extend(set() for _ in range(len(row) - len(columns)))
+            for seen, cell in zip(columns, row):
+                if cell in seen:
+                    continue
+                if len(seen) >= DISTINCT_CELLS_MAX:
+                    seen.clear()
+                seen.add(cell)
+                if is_number is None or is_number(cell) is None:
+                    new.append(cell)
+
+        return new
+
+
+def find_keyword_in_blocks(
+    automaton: KeywordAutomaton, blocks: Iterable[Buffer]
+) -> Optional[str]:
+    """Finds a keyword in a stream of raw utf-8 blocks, e.g. those of a BlockReader,
+    without decoding or joining them. Every block is searched in place. A keyword
+    that straddles two blocks is found in the seam: the last max_length - 1 bytes
+    of a block followed by the first max_length - 1 bytes of the next one. Since
+    the keywords are matched as bytes, a character that is split between blocks
+    needs no special care either. When the automaton is canonical, every block is
+    canonicalized once, before any of this.
+
+    Args:
+        automaton (KeywordAutomaton): keywords to look for
+        blocks (Iterable[Buffer]): consecutive blocks, each only valid until the
+        next one is requested
+
+    Returns:
+        Optional[str]: first keyword found, None if there is none
+    """
+    if automaton.canonical:
+        blocks = map(automaton.canonicalize, blocks)
+
+    if automaton.fuzzy:
+        return _find_fuzzy_keyword_in_blocks(automaton, blocks)
+
+    overlap = automaton.max_length - 1
+    tail = b""
+
+    for block in blocks:
+        if overlap and tail:
+            keyword = automaton.search(tail + bytes(block[:overlap]), True)
+            if keyword is not None:
+                return keyword
+
+        keyword = automaton.search(block, True)
+        if keyword is not None:
+            return keyword
+
+        if overlap:
+            # * a short block may not cover the whole overlap on its own
+            tail = (tail + bytes(block[-overlap:]))[-overlap:]
+
+    return None
+
+
+def _find_fuzzy_keyword_in_blocks(
+    automaton: KeywordAutomaton, blocks: Iterable[Buffer]
+) -> Optional[str]:
+    """Fuzzy matching looks at whole tokens, so a block is only searched up to the
+    token that it cuts, which is carried over to the next block along with the
+    bytes in front of it that an exact match may need. A token that is too long to
+    be close to any keyword is searched right away. What is carried is put behind
+    padding, so that a token it cuts does not look like a whole one. The padding
+    is never part of utf-8 text, or of a keyword.
+    """
+    limit = automaton.max_token_length
+    padding = b"\xff" * (limit + 1)
+    overlap = automaton.max_length - 1
+    carry = b""
+
+    for block in blocks:
+        text = carry + bytes(block)
+        partial = len(text) - len(text.rstrip(WORD_CHARS))
+        cut = len(text) - partial if partial <= limit else len(text)
+
+        keyword = automaton.search(text[:cut], True) if cut else None
+        if keyword is not None:
+            return keyword
+
+        start = cut - overlap
+        carry = padding + text[start:] if start > 0 else text
+
+    return automaton.search(carry, True) if carry else None
+
+
+def find_keyword_in_json(
+    automaton: KeywordAutomaton, blocks: Iterable[Buffer]
+) -> Optional[str]:
+    """Finds a keyword in the keys and string values of a json document, streaming
+    it through iter_json_events. The strings are searched in batches, joined like
+    the cells of a csv row.
+
+    Walking the strings is what takes the time, so the raw blocks are searched
+    first, like check_txt does. As long as none of them (nor the seams between
+    them) has a keyword or an escape in it, no string has a keyword either, and
+    the document is only parsed to be sure it is json.
+
+    Args:
+        automaton (KeywordAutomaton): keywords to look for
+        blocks (Iterable[Buffer]): consecutive blocks of the document
+
+    Raises:
+        JsonError: if the document is not valid json
+
+    Returns:
+        Optional[str]: first keyword found, None if there is none
+    """
+    # * a keyword with a quote or a backslash is never in the raw text as it is
+    walk = automaton.contains_any('"\\')
+
+    def watched(blocks: Iterable[Buffer]) -> Iterator[bytes]:
+        nonlocal walk
+        previous = b""
+
+        for block in blocks:
+            data = bytes(block)
+            if not walk:
+                text = bytes(automaton.canonicalize(data))
+                # * the seam is the previous block's tail and this one's head
+                seam = previous[-automaton.max_length :] + text[: automaton.max_length]
+                walk = (
+                    b"\\" in data
+                    or automaton.search(seam, True) is not None
+                    or automaton.search(text, True) is not None
+                )
+                previous = text
+            yield data
+
+    strings: List[str] = []
+
+    # * everything that comes before the first dirty block is fetched was in
+    # * clean blocks, since blocks are only fetched once their events are out
+    for event, value in iter_json_events(watched(blocks), expand=False):
+        if not walk:
+            continue
+        if event == "container":
+            strings.extend(iter_strings(value))
+        elif event == "string" or event == "map_key":
+            strings.append(value)
+        else:
+            continue
+        if len(strings) >= JSON_STRING_BATCH:
+            keyword = automaton.search(CELL_SEPARATOR.join(strings))
+            if keyword is not None:
+                return keyword
+            strings = []
+
+    return automaton.search(CELL_SEPARATOR.join(strings)) if strings else None
+
+
+def is_ndjson(file_loc: str) -> bool:
+    """Whether the file is newline delimited json, i.e. its first line is a json
+    document on its own. A single json document spread over several lines never
+    is, and one on a single line is a single record.
+    """
+    with open_file(file_loc) as f:
+        line = f.readline(NDJSON_MAX_LINE + 1)
+
+    if not line.strip() or len(line) > NDJSON_MAX_LINE:
+        return False
+
+    try:
+        loads(line.decode("utf-8"))
+    except ValueError:
+        return False
+
+    return True
+
+
+def check_ndjson_range(
+    file_loc: str, start: int, end: int, keywords: Iterable[str]
+) -> Optional[str]:
+    """Looks for keywords in the keys and string values of the json records in the
+    [start, end) byte range of a newline delimited json file. The range has to
+    start and end on line boundaries. Every record is parsed, with the C decoder,
+    to be sure the file is valid, but is only walked when the raw text of its
+    block holds a keyword (or an escape that might hide one): without escapes,
+    every string is in the raw text as it is.
+
+    Raises:
+        JsonError: if a line is not a json document
+
+    Returns:
+        Optional[str]: first keyword found, None if there is none
+    """
+    automaton = keyword_automaton(keywords)
+    # * a keyword with a quote or a backslash is never in the raw text as it is
+    always_walk = automaton.contains_any('"\\')
+    carry = b""
+
+    with BlockReader(file_loc, read_buffer_size()) as reader:
+        blocks = iter_range(reader, start, end)
+
+        while True:
+            block = next(blocks, None)
+            if block is None:
+                text, carry = carry, b""
+            else:
+                text = carry + bytes(block)
+                cut = text.rfind(b"\n") + 1
+                text, carry = text[:cut], text[cut:]
+
+            walk = always_walk or b"\\" in text or automaton.search(text) is not None
+            strings: List[str] = []
+
+            try:
+                lines = text.decode("utf-8").split("\n")
+            except UnicodeDecodeError as e:
+                raise JsonError(f"not utf-8: {e}")
+
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = loads(line)
+                if walk:
+                    strings.extend(iter_strings(record))
+
+            if strings:
+                keyword = automaton.search(CELL_SEPARATOR.join(strings))
+                if keyword is not None:
+                    l.error(f"{keyword} keyword found in file {file_loc}")
+                    return keyword
+
+            if block is None:
+                return None
+
+
+def _shards(file_loc: str, env: str, default: int) -> bool:
+    min_size = int(os.getenv(env, default))
+    try:
+        return file_workers() > 1 and os.path.getsize(file_loc) >= min_size
+    except OSError:
+        return False
+
+
+def shards_csv(file_loc: str) -> bool:
+    """Whether check_csv splits the file into shards (set CSV_SHARD_MIN_SIZE to
+    change the threshold). These files are left out of the streaming scan.
+    """
+    return _shards(file_loc, "CSV_SHARD_MIN_SIZE", DEFAULT_CSV_SHARD_MIN_SIZE)
+
+
+def shards_ndjson(file_loc: str) -> bool:
+    """Whether check_json splits a newline delimited json file into shards (set
+    NDJSON_SHARD_MIN_SIZE to change the threshold)
+    """
+    return _shards(file_loc, "NDJSON_SHARD_MIN_SIZE", DEFAULT_NDJSON_SHARD_MIN_SIZE)
+
+
+class CsvKeywordObserver(ScanObserver):
+    """Checks the .csv outputs for keywords while the scan engine streams them,
+    instead of check_csv reading them again afterwards. Every cell (and every
+    column name) is searched for the keywords like check_csv does. Only complete
+    records are checked: the tail of a block that ends in the middle of a record,
+    possibly inside a quoted field that spans several lines, is carried over to the
+    next block.
+
+    The observer only records a verdict when it is sure that pandas would have
+    parsed the file the same way. For empty, non utf-8 or ragged files it records
+    nothing and check_csv deals with them.
+    """
+
+    def __init__(self, file_locs: Iterable[str], keywords: Iterable[str]) -> None:
+        super().__init__()
+        self.file_locs = {os.path.abspath(f) for f in file_locs}
+        self.automaton = keyword_automaton(keywords)
+        # * True if the file has no keywords, False if it has
+        self.verdicts: Dict[str, bool] = {}
+        self._files: Dict[str, "_CsvState"] = {}
+
+    def wants(self, file_loc: str) -> bool:
+        return os.path.abspath(file_loc) in self.file_locs
+
+    def start_file(self, file_loc: str, stat: os.stat_result) -> None:
+        if stat.st_size > 0:
+            self._files[file_loc] = _CsvState(self.automaton)
+
+    def feed(self, file_loc: str, offset: int, data: Buffer) -> None:
+        state = self._files.get(file_loc)
+        if state is None or state.done:
+            return
+
+        try:
+            text = state.carry + state.decoder.decode(data)
+        except UnicodeDecodeError as e:
+            l.debug(f"not scanning {file_loc} while streaming: {e}")
+            del self._files[file_loc]
+            return
+
+        end = _last_record_end(text)
+        state.carry = text[end:]
+        self._check_records(file_loc, state, text[:end])
+
+    def end_file(self, file_loc: str) -> None:
+        state = self._files.pop(file_loc, None)
+        if state is None:
+            return
+
+        if not state.done:
+            try:
+                rest = state.carry + state.decoder.decode(b"", final=True)
+            except UnicodeDecodeError:
+                return
+            self._check_records(file_loc, state, rest)
+
+        if state.ragged:
+            return
+
+        self.verdicts[file_loc] = state.keyword is None
+
+    def _check_records(self, file_loc: str, state: "_CsvState", text: str) -> None:
+        keyword = find_keyword_in_csv(self.automaton, text, state.cells)
+        if keyword is not None:
+            l.error(f"{keyword} keyword found in file {file_loc}")
+            state.keyword = keyword
+            state.done = True
+            return
+
+        # * the records are still parsed, to be sure pandas would accept them
+        for row in csv.reader(io.StringIO(text)):
+            if state.columns is None:
+                state.columns = len(row)
+            elif len(row) > state.columns:
+                state.ragged = True
+                state.done = True
+                return
+
+
+class _CsvState:
+    def __init__(self, automaton: KeywordAutomaton) -> None:
+        self.cells = DistinctCells(automaton)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.carry = ""
+        self.columns: Optional[int] = None
+        self.keyword: Optional[str] = None
+        self.ragged = False
+        self.done = False
+
+
+def _last_record_end(text: str) -> int:
+    """Finds the end of the last complete record in text, i.e. the position right
+    after the last newline that is not inside a quoted field. text has to start at
+    the beginning of a record.
+
+    Args:
+        text (str): csv text
+
+    Returns:
+        int: position after the last complete record, 0 if there is none
+    """
+    pos = text.rfind("\n")
+    quotes = text.count('"', 0, pos) if pos != -1 else 0
+
+    while pos != -1 and quotes % 2:
+        prev = text.rfind("\n", 0, pos)
+        quotes -= text.count('"', max(prev, 0), pos)
+        pos = prev
+
+    return pos + 1
+
+
+class CsvRangeVerdict(NamedTuple):
+    # * the first keyword found in the range, if any
+    keyword: Optional[str]
+    # * number of fields of the first record of the range, the header for the
+    # * first range
+    first_columns: Optional[int]
+    # * largest number of fields of any record of the range
+    max_columns: int
+
+
+def check_csv_range(
+    file_loc: str, start: int, end: int, keywords: Iterable[str]
+) -> CsvRangeVerdict:
+    """Looks for keywords in the cells (and column names) of the records in the
+    [start, end) byte range of a csv file, the same way CsvKeywordObserver does.
+    The range has to start and end on record boundaries.
+
+    Raises:
+        UnicodeDecodeError: if the range is not valid utf-8
+
+    Returns:
+        CsvRangeVerdict: whether there was a keyword, and the shape of the records
+    """
+    automaton = keyword_automaton(keywords)
+    cells = DistinctCells(automaton)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    carry = ""
+    first_columns: Optional[int] = None
+    max_columns = 0
+
+    with BlockReader(file_loc, read_buffer_size()) as reader:
+        blocks = iter_range(reader, start, end)
+
+        while True:
+            block = next(blocks, None)
+            if block is None:
+                text = carry + decoder.decode(b"", final=True)
+                carry = ""
+            else:
+                text = carry + decoder.decode(block)
+                cut = _last_record_end(text)
+                text, carry = text[:cut], text[cut:]
+
+            keyword = find_keyword_in_csv(automaton, text, cells)
+            if keyword is not None:
+                l.error(f"{keyword} keyword found in file {file_loc}")
+                return CsvRangeVerdict(keyword, first_columns, max_columns)
+
+            for row in csv.reader(io.StringIO(text)):
+                if not row:
+                    # * pandas skips blank lines
+                    continue
+                if first_columns is None:
+                    first_columns = len(row)
+                if len(row) > max_columns:
+                    max_columns = len(row)
+
+            if block is None:
+                return CsvRangeVerdict(None, first_columns, max_columns)
+
 
 class NoKeywords:
     """
@@ -26,15 +570,18 @@ class NoKeywords:
         be O(N * M). This might give hints about how to better implement it:
         https://link.springer.com/chapter/10.1007/978-981-13-0755-3_6
 
-        This is a very computationally expensive condition. For every value in each file
-        we need to compare it to the pre-specified keywords. The time complexity of such
-        an algorithm is O(X * Y * Z) where X is the number of words in the text file, Y is
-        the average number of keywords for a given file type and Z is the number of files
+        Keywords are found anywhere in a value, not only as the whole value (so
+        "fractals123" has "fractals" in it), with an Aho-Corasick automaton built once
+        from the keywords (see utils.keywords). That makes the condition linear in the
+        size of the outputs, no matter how many keywords a category has. Set
+        KEYWORD_MAX_EDITS to also catch words that are that many edits away from a
+        keyword (fr4ctals), see FuzzyKeywordIndex. Set KEYWORD_CANONICALIZE=1 to match
+        the keywords regardless of case, leet speak, separators slipped into them
+        (f.r.4.c.t.a.l.s) and lookalike letters of other scripts, see utils.canonical.
     """
 
     def __init__(self, hostname: str = None) -> None:
         self.name = "Keywords"
-        self.config = confuse.Configuration(__name__)
 
         config_path = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), "config", "no_keywords.yaml"
@@ -43,10 +590,23 @@ class NoKeywords:
         if not os.path.exists(config_path):
             raise ValueError(f"could not find config path in {config_path}")
 
-        with open(config_path, "r",) as f:
-            # ! this is not safe, add loader
-            y = yaml.load(f)
-            self.config.add(y)
+        # * the keywords compiled when the image was built (see utils.keyword_index),
+        # * the config itself is only parsed when they are missing or stale
+        self.index: Optional[KeywordIndex] = load_keyword_index(
+            DEFAULT_KEYWORD_INDEX, config_path
+        )
+        self.config: Any = None
+
+        if self.index is None:
+            import confuse
+            import yaml
+
+            self.config = confuse.Configuration(__name__)
+
+            with open(config_path, "r",) as f:
+                # ! this is not safe, add loader
+                y = yaml.load(f)
+                self.config.add(y)
 
         self.dids = json.loads(os.getenv("DIDS", "[]"))
         # ! you need to add an environment variable called ENVIRONMENT in kuberneted, that will tell
@@ -54,6 +614,8 @@ class NoKeywords:
         # ! no_keywords.yaml. This is only necessary if we will have different keywords for different
         # ! environments
         self.environment = os.getenv("ENVIRONMENT", "development")
+        # * set if the outputs are checked while the scan engine streams them
+        self._observer: Optional[CsvKeywordObserver] = None
 
     def __call__(self) -> bool:
         """Wrapper for private _check_no_keywords. You can extra stuff here if necessary.
@@ -75,6 +637,36 @@ class NoKeywords:
         is_valid = self._check_no_keywords()
         return is_valid
 
+    def observers(self) -> List[ScanObserver]:
+        """Lets the scan engine check the .csv outputs for keywords while it streams
+        them. Returns no observers if there is not enough information to get the
+        keywords, then __call__ reports the problem.
+
+        Returns:
+            List[ScanObserver]: observers to register with the scan engine
+        """
+        self._observer = None
+        self.dids = json.loads(os.getenv("DIDS", "[]"))
+        outputs_loc = os.getenv("OUTPUTS")
+
+        if len(self.dids) < 1 or not outputs_loc or not os.path.isdir(outputs_loc):
+            return []
+
+        keywords = self._get_keywords()
+        if keywords is None:
+            return []
+
+        # * the large ones are sharded by check_csv instead
+        csv_files = [
+            os.path.join(outputs_loc, f)
+            for f in os.listdir(outputs_loc)
+            if file_extension(f) == "csv"
+            and not shards_csv(os.path.join(outputs_loc, f))
+        ]
+
+        self._observer = CsvKeywordObserver(csv_files, keywords)
+        return [self._observer]
+
     def _check_no_keywords(self) -> bool:
         """We define functions to handle different file types here. We get the list
         of all of the files in the outputs mount and loop through them, determining
@@ -95,14 +687,32 @@ class NoKeywords:
         output_files = os.listdir(outputs_loc)
 
         # * poor mypy linting again
-        if not all(
-            self.check_no_keywords_in_file(os.path.join(outputs_loc, f))  # type: ignore
-            for f in output_files
+        file_locs = [os.path.join(outputs_loc, f) for f in output_files]  # type: ignore
+
+        # * the files are checked in parallel, the first file with keywords stops it
+        for file_loc, is_valid in ordered_map(
+            self._checked_by_scan, file_locs, lambda is_valid: not is_valid
         ):
-            return False
+            if not is_valid:
+                l.error(f"{file_loc} contains keywords, condition not met")
+                return False
 
         return True
 
+    def _checked_by_scan(self, full_path: str) -> bool:
+        """Uses the verdict of the scan engine's observer if the file was checked
+        while it was streamed, otherwise reads and checks the file here.
+        """
+        raise_if_cancelled()
+        observer = self._observer
+
+        if observer is not None and not observer.failed:
+            verdict = observer.verdicts.get(os.path.abspath(full_path))
+            if verdict is not None:
+                return verdict
+
+        return self.check_no_keywords_in_file(full_path)
+
     def check_no_keywords_in_file(self, full_path: str) -> bool:
         parts = os.path.split(full_path)
 
@@ -145,6 +755,15 @@ class NoKeywords:
         """Loops through every column name and cell value. If anything contains the
         keyword, returns False, i.e. no keyword condition is not met
 
+        The file is streamed in blocks of read_buffer_size() bytes and only the
+        complete records of a block are parsed, so the memory this takes depends on
+        the block size (and the longest record), never on the size of the file.
+        The first keyword stops the reading. Large files are split into shards that
+        are checked in parallel.
+
+        Files that pandas refuses to load are not valid either: empty files, files
+        that are not utf-8 and files with rows longer than the header.
+
         Args:
             file_path (str): path of the .csv file to read
 
@@ -152,24 +771,171 @@ class NoKeywords:
             bool: think of this as is_valid. If True, then everything is OK, and there
             are no keywords in the file.
         """
-        l.debug(f"checking the csv file for keywords: {file_path}")
+        l.debug("checking the csv file for keywords: %s", file_path)
+
+        keywords = self._get_keywords()
+        if keywords is None:
+            return False
+
+        try:
+            if shards_csv(file_path):
+                verdicts = self._check_csv_sharded(file_path, keywords)
+            else:
+                size = os.path.getsize(file_path)
+                verdicts = [check_csv_range(file_path, 0, size, keywords)]
+        except (OSError, UnicodeDecodeError) as e:
+            l.error(f"could not read {file_path}: {e}")
+            return False
+
+        if any(v is not None and v.keyword is not None for v in verdicts):
+            return False
+
+        header = verdicts[0].first_columns if verdicts and verdicts[0] else None
+        if header is None:
+            l.error(f"{file_path} has no columns")
+            return False
+        if any(v is None or v.max_columns > header for v in verdicts):
+            l.error(f"{file_path} has rows that are longer than the header")
+            return False
+
+        return True
+
+    def _check_csv_sharded(
+        self, file_path: str, keywords: List[str]
+    ) -> List[Optional[CsvRangeVerdict]]:
+        """Splits a large csv file into byte ranges that start on record boundaries
+        and checks them in parallel processes. A keyword in any range cancels the
+        others.
+
+        Args:
+            file_path (str): path of the .csv file to read
+            keywords (List[str]): keywords to look for
+
+        Returns:
+            List[Optional[CsvRangeVerdict]]: verdicts of the ranges, in order. None
+            for the ranges that were cancelled because another one had a keyword
+        """
+        with ShardPool(file_workers()) as pool:
+            shards = pool.record_shards(file_path)
+            l.info(f"checking {file_path} in {len(shards)} shards")
+
+            return pool.map(
+                check_csv_range,
+                [(file_path, start, end, keywords) for start, end in shards],
+                lambda v: v.keyword is not None,
+            )
+
+    def check_txt(self, file_path: str) -> bool:
+        """Looks for the keywords anywhere in the text, in a single pass over the raw
+        blocks of the file (see find_keyword_in_blocks). The file is never decoded
+        or held in memory as a whole.
+
+        Args:
+            file_path (str): path of the .txt file to read
+
+        Returns:
+            bool: is_valid, True if there are no keywords in the file
+        """
+        l.debug("checking the txt file for keywords: %s", file_path)
+
+        keywords = self._get_keywords()
+        if keywords is None:
+            return False
 
-        f = pd.DataFrame()
+        automaton = keyword_automaton(keywords)
 
         try:
-            f = pd.read_csv(file_path)
-        except Exception as e:
-            l.error(str(e))
+            with BlockReader(file_path, read_buffer_size()) as reader:
+                keyword = find_keyword_in_blocks(automaton, reader)
+        except OSError as e:
+            l.error(f"could not read {file_path}: {e}")
+            return False
+
+        if keyword is not None:
+            l.error(f"{keyword} keyword found in file {file_path}")
             return False
 
+        return True
+
+    def check_json(self, file_path: str) -> bool:
+        """Looks for the keywords in every key and string value of the json. The
+        document is parsed incrementally (see utils.json_stream) and never loaded
+        as a whole, so the memory this takes does not grow with the size of the
+        file. Newline delimited json is parsed record by record instead, and large
+        files are split into shards of lines that are checked in parallel.
+
+        Files that are not valid json are not valid either.
+
+        Args:
+            file_path (str): path of the .json file to read
+
+        Returns:
+            bool: is_valid, True if there are no keywords in the file
+        """
+        l.debug("checking the json file for keywords: %s", file_path)
+
+        keywords = self._get_keywords()
+        if keywords is None:
+            return False
+
+        try:
+            if is_ndjson(file_path):
+                if shards_ndjson(file_path):
+                    found = self._check_ndjson_sharded(file_path, keywords)
+                else:
+                    size = os.path.getsize(file_path)
+                    found = [check_ndjson_range(file_path, 0, size, keywords)]
+                keyword = next((k for k in found if k is not None), None)
+            else:
+                with BlockReader(file_path, read_buffer_size()) as reader:
+                    keyword = find_keyword_in_json(keyword_automaton(keywords), reader)
+        except (OSError, JsonError) as e:
+            l.error(f"could not read {file_path}: {e}")
+            return False
+
+        if keyword is not None:
+            l.error(f"{keyword} keyword found in file {file_path}")
+            return False
+
+        return True
+
+    def _check_ndjson_sharded(
+        self, file_path: str, keywords: List[str]
+    ) -> List[Optional[str]]:
+        """Checks the lines of a large newline delimited json file in parallel
+        processes, a keyword in any shard cancels the others
+        """
+        with ShardPool(file_workers()) as pool:
+            shards = pool.line_shards(file_path)
+            l.info(f"checking {file_path} in {len(shards)} shards")
+
+            return pool.map(
+                check_ndjson_range,
+                [(file_path, start, end, keywords) for start, end in shards],
+                lambda keyword: keyword is not None,
+            )
+
+    def _get_keywords(self) -> Optional[List[str]]:
+        """Keywords of all the data categories of the (first) did
+
+        Returns:
+            Optional[List[str]]: keywords, None if the categories could not be pulled
+        """
         # ! all dids other than the first one are ignored
         data_categories = self._get_did_categories(self.dids[0])
-        if data_categories[0] == "":
+        if len(data_categories) < 1 or data_categories[0] == "":
             l.error("could not pull data categories from the meta db")
-            return False
+            return None
 
         keywords: List[str] = []
 
+        if self.index is not None:
+            for data_category in data_categories:
+                keywords.extend(self.index.keywords(self.environment, data_category))
+            if len(data_categories) == 1:
+                self.index.use_automaton(self.environment, data_categories[0])
+            return keywords
+
         for data_category in data_categories:
             keywords.extend(
                 self.config["environments"][self.environment]["keywords"][
@@ -177,28 +943,7 @@ class NoKeywords:
                 ].get(list)
             )
 
-        for k, v in f.iteritems():
-            if k in keywords:
-                l.error(f"{k} column from file {file_path} is in keywords: {keywords}")
-                return False
-            for _v in v:
-                if _v in keywords:
-                    l.error(
-                        f"{_v} value from file {file_path} is in keywords: {keywords}"
-                    )
-                    return False
-
-        return True
-
-    def check_txt(self, file_path: str) -> bool:
-        # ! to be implemented
-        raise NotImplementedError("this should be implemented")
-        return False
-
-    def check_json(self, file_path: str) -> bool:
-        # ! to be implemented
-        raise NotImplementedError("this should be implemented")
-        return False
+        return keywords
 
     def _get_did_categories(self, did: str) -> List[str]:
         """Brizo pulls the meta for us and gives it to us in the workflow stages input dict.
@@ -5,6 +5,8 @@ import os
 
 from . import DEFAULT_FILENAME
 from .utils import EntropyAlgos, validate_inputs_outputs
+from .utils.pyramid import get_pyramid
+from .utils.scan import ScanObserver, PyramidObserver
 
 shannon = EntropyAlgos.shannon
 
@@ -103,6 +105,35 @@ class NotCorrelated:
         is_valid = self._calc_correlation()
         return is_valid
 
+    def observers(self) -> List[ScanObserver]:
+        """The correlation profile of the input file and the entropy of the output
+        file are built by the scan engine while it streams them. _calc_correlation
+        then finds them in the pyramid cache and does not read the files again.
+
+        Returns:
+            List[ScanObserver]: observers to register with the scan engine
+        """
+        inputs = os.getenv("INPUTS")
+        outputs = os.getenv("OUTPUTS")
+        did = json.loads(os.getenv("DIDS", "[]"))
+
+        if not inputs or not outputs or not os.path.isdir(outputs) or len(did) < 1:
+            return []
+
+        output_files = os.listdir(outputs)
+
+        if len(output_files) == 0:
+            return []
+
+        return [
+            PyramidObserver(
+                [
+                    os.path.join(inputs, did[0], DEFAULT_FILENAME),
+                    os.path.join(outputs, output_files[0]),
+                ]
+            )
+        ]
+
     def _validate_env_vars(self) -> bool:
         """Validates if there CORRELATION_ENTROPY_THRESH, if set
         is in the range [0, 1]. 0 meaning that the epsilon is zero and so the input
@@ -146,11 +177,16 @@ class NotCorrelated:
         self.inputs = os.getenv("INPUTS")
         self.outputs = os.getenv("OUTPUTS")
 
-        l.debug(f"{self.epsilon=}")
-        l.debug(f"{self.inputs=}")
-        l.debug(f"{self.outputs=}")
-        l.debug(f"{os.listdir(self.inputs)=}")
-        l.debug(f"{os.listdir(self.outputs)=}")
+        if l.isEnabledFor(logging.DEBUG):
+            # * listing the directories is not free, only when it is logged
+            l.debug(
+                "epsilon=%s, inputs=%s %s, outputs=%s %s",
+                self.epsilon,
+                self.inputs,
+                os.listdir(self.inputs),
+                self.outputs,
+                os.listdir(self.outputs),
+            )
 
         did = json.loads(os.getenv("DIDS", "[]"))
 
@@ -180,31 +216,33 @@ class NotCorrelated:
 
         output_file_size = os.path.getsize(output_file)
 
-        input_file_entropy: List[float] = []
-        output_file_entropy: List[float] = []
-
         # * to avoid having very small blocks
         if output_file_size < DEFAULT_BLOCK_SIZE:
             output_file_size = DEFAULT_BLOCK_SIZE
 
-        with open(input_file, "rb") as f:
-            input_data = f.read(output_file_size)
+        # * both files are histogrammed once at a fine base block size. The entropy of
+        # * the blocks of size of the output is then derived from those histograms. This
+        # * means the block size is rounded up to a multiple of both of the bases
+        input_pyramid = get_pyramid(input_file)
+        output_pyramid = get_pyramid(output_file)
 
-            while input_data:
-                input_block_entropy = shannon(input_data)
-                input_file_entropy.append(input_block_entropy)
-                input_data = f.read(output_file_size)
+        block_size = output_file_size
+        for pyramid in (input_pyramid, output_pyramid):
+            block_size = pyramid.block_size_for(block_size)
 
-        with open(output_file, "rb") as f:
-            output_data = f.read(output_file_size)
+        input_file_entropy = input_pyramid.entropies(block_size)
+        output_file_entropy = output_pyramid.entropies(block_size)
 
-            while output_data:
-                output_block_entropy = shannon(output_data)
-                output_file_entropy.append(output_block_entropy)
-                output_data = f.read(output_file_size)
+        if len(input_file_entropy) == 0:
+            l.error(f"input file is empty: {input_file}")
+            return False
+
+        # * an empty output cannot be correlated with anything
+        if len(output_file_entropy) == 0:
+            return True
 
-        input_entropy = sum(input_file_entropy) / len(input_file_entropy)
-        output_entropy = sum(output_file_entropy) / len(output_file_entropy)
+        input_entropy = float(input_file_entropy.mean())
+        output_entropy = float(output_file_entropy.mean())
 
         if (
             output_entropy - self.epsilon
@@ -1,12 +1,20 @@
-from typing import Optional, ClassVar, List
+from typing import Dict, Optional, ClassVar, List
 from collections import namedtuple
-from math import log, e, ceil
+from math import log, e, ceil, sqrt
+from statistics import NormalDist
 from enum import Enum
 import logging
+import random
 import json
 import os
 
 from .utils import EntropyAlgos
+from .utils.blocks import BlockReader
+from .utils.cancel import raise_if_cancelled
+from .utils.metrics import get_metrics
+from .utils.parallel import ordered_map
+from .utils.pyramid import cached_pyramid, get_pyramid
+from .utils.scan import ScanObserver, PyramidObserver
 
 shannon = EntropyAlgos.shannon
 
@@ -16,6 +24,56 @@ EntropyOfBlock = namedtuple(
     "EntropyOfBlock", ["offset", "file", "entropy", "description"]
 )
 
+# * "exact" scores every block of every file. "statistical" stops scoring a file
+# * as soon as the blocks scored so far put its mean entropy on one side of the
+# * threshold, see NotEncrypted._sampled_entropies
+DEFAULT_ENTROPY_MODE = "exact"
+ENTROPY_MODES = ("exact", "statistical")
+
+# * how sure the statistical mode has to be of the side of the threshold
+DEFAULT_ENTROPY_CONFIDENCE = 0.999
+
+# * most blocks of a file the statistical mode scores. Files with more blocks are
+# * sampled: one block out of each of this many strata of consecutive blocks
+DEFAULT_ENTROPY_SAMPLE_BUDGET = 512
+
+# * blocks scored before the confidence bound is trusted
+MIN_SEQUENTIAL_BLOCKS = 64
+
+
+class RunningMean:
+    """Mean and variance of the entropies scored so far, updated one at a time
+    (Welford's algorithm)
+    """
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def half_width(self, z: float, population: int) -> float:
+        """Half width of the confidence interval of the mean of all population
+        blocks, z standard errors wide. Shrinks to 0 as the last blocks are scored
+        (finite population correction)
+        """
+        if self.n == 0:
+            return float("inf")
+        if population <= 1 or self.n >= population:
+            return 0.0
+        correction = (population - self.n) / (population - 1)
+        half_width: float = z * sqrt(self.variance / self.n * correction)
+        return half_width
+
 
 # taken from: https://github.com/ReFirmLabs/binwalk/blob/c0365350af70ac537286fabcb08a793078e60241/src/binwalk/modules/entropy.py
 # with some modifications
@@ -37,6 +95,8 @@ class NotEncrypted:
         self.algorithm = shannon
         self.results: List[EntropyOfBlock] = []
         self.block_size = None
+        # * file -> the mode that decided it, see _record_mode
+        self.modes: Dict[str, str] = {}
 
     def __call__(self) -> bool:
         """The intended usage of the class is to instantiate it,
@@ -54,22 +114,49 @@ class NotEncrypted:
         if not outputs:
             l.error(f"could not find output files")
 
-        for file in os.listdir(outputs):
-            self._calculate_file_entropy(
-                os.path.join(outputs, file)  # type: ignore
-            )
+        file_locs = [
+            os.path.join(outputs, file) for file in os.listdir(outputs)  # type: ignore
+        ]
+        self.modes = {}
 
-            r = [e.entropy for e in self.results]
+        # * the files are scored in parallel, results come back in file order
+        for file_loc, results in ordered_map(
+            self._file_entropies, file_locs, self._exceeds_threshold
+        ):
+            self.results = results
 
-            entropy = sum(r) / len(r)
-            if entropy > self._get_threshold():
+            if self._exceeds_threshold(results):
                 l.error(
-                    "file exceeds the encryption threshold, therefore condition is not met. {}"
+                    f"{file_loc} exceeds the encryption threshold, therefore condition is not met"
                 )
                 return False
 
         return True
 
+    def _exceeds_threshold(self, results: List[EntropyOfBlock]) -> bool:
+        r = [e.entropy for e in results]
+
+        # * an empty file has nothing to be encrypted
+        if len(r) == 0:
+            return False
+
+        entropy: float = sum(r) / len(r)
+        return entropy > self._get_threshold()
+
+    def observers(self) -> List[ScanObserver]:
+        """The histograms of the output files are built by the scan engine while it
+        streams them, so that _calculate_file_entropy does not read them again.
+
+        Returns:
+            List[ScanObserver]: observers to register with the scan engine
+        """
+        outputs = os.getenv("OUTPUTS")
+
+        if not outputs or not os.path.isdir(outputs):
+            return []
+
+        return [PyramidObserver(os.path.join(outputs, f) for f in os.listdir(outputs))]
+
     def _calculate_file_entropy(self, file_loc: str) -> None:
         """Internal function that will calculate the entropy for file
         specified in file_loc
@@ -77,16 +164,32 @@ class NotEncrypted:
         Args:
             file_loc (str): absolute string path to the location of the file
         """
+        # clear results from any previously analyzed files
+        self.results = self._file_entropies(file_loc)
+
+    def _file_entropies(self, file_loc: str) -> List[EntropyOfBlock]:
+        """Entropies of the blocks of the file. Does not touch self.results, so that
+        it can be called for several files at the same time.
+
+        In the statistical mode (ENTROPY_MODE=statistical), only as many blocks are
+        scored as it takes to tell which side of the threshold the file is on, see
+        _sampled_entropies. Files whose histograms were built already (e.g. by the
+        scan engine) are always scored exactly, that costs nothing more.
+
+        Args:
+            file_loc (str): absolute string path to the location of the file
+
+        Returns:
+            List[EntropyOfBlock]: entropy of every block (that was scored), in file
+            order, empty if there is no file
+        """
         if not os.path.exists(file_loc):
             l.error(f"file does not exist: {file_loc}")
-            return
-
-        # clear results from any previously analyzed files
-        self.results = []
+            return []
 
         file_size = os.path.getsize(file_loc)  # in bytes
 
-        l.debug(f"{file_size=}")
+        l.debug("file_size=%d", file_size)
 
         block_size = file_size / self.DEFAULT_DATA_POINTS
         # round up to the nearest DEFAULT_BLOCK_SIZE (1024)
@@ -99,28 +202,163 @@ class NotEncrypted:
         if block_size <= 0:
             block_size = self.DEFAULT_BLOCK_SIZE
 
+        if self._get_mode() == "statistical" and cached_pyramid(file_loc) is None:
+            sampled = self._sampled_entropies(file_loc, file_size, block_size)
+            if sampled is not None:
+                return sampled
+
+        # * the histograms of the file are computed once, at a finer granularity, and
+        # * shared with the other conditions. For files over 16 MiB the block size is
+        # * rounded up to a multiple of that granularity
+        pyramid = get_pyramid(file_loc)
+        block_size = pyramid.block_size_for(block_size)
+
         l.info(
-            "entropy block size (%d data points): %d"
-            % (self.DEFAULT_DATA_POINTS, block_size)
+            "entropy block size (%d data points): %d",
+            self.DEFAULT_DATA_POINTS,
+            block_size,
         )
 
-        i = 0
-
-        with open(file_loc, "rb") as f:
-            data = f.read(block_size)
-            while data:
-                entropy = self.algorithm(data)
-                self.results.append(
-                    EntropyOfBlock(
-                        offset=(i * block_size),
-                        file=file_loc,
-                        entropy=entropy,
-                        description="%f" % entropy,
-                    )
-                )
-                i += 1
-                l.debug(f"{i=}, last block entropy: {self.results[-1]=}")
-                data = f.read(block_size)
+        entropies = pyramid.entropies(block_size)
+
+        results = [
+            EntropyOfBlock(
+                offset=(i * block_size),
+                file=file_loc,
+                entropy=entropy,
+                description="%f" % entropy,
+            )
+            for i, entropy in enumerate(entropies.tolist())
+        ]
+
+        l.debug("%d blocks, last block entropy: %s", len(results), results[-1:])
+        self._record_mode(file_loc, "exact", results, len(results))
+        return results
+
+    def _sampled_entropies(
+        self, file_loc: str, file_size: int, block_size: int
+    ) -> Optional[List[EntropyOfBlock]]:
+        """Scores the blocks of the file in a random order and keeps a running mean
+        and variance of their entropies. Stops as soon as the mean of all of the
+        blocks is above or below the threshold with ENTROPY_CONFIDENCE, or once
+        every block is scored.
+
+        Files of more than ENTROPY_SAMPLE_BUDGET blocks are split into that many
+        strata of consecutive blocks and one block is scored out of each, so that
+        no part of the file goes unsampled. The order and the sampled blocks only
+        depend on the size of the file, so that a verdict can be reproduced.
+
+        Args:
+            file_loc (str): absolute string path to the location of the file
+            file_size (int): size of the file in bytes
+            block_size (int): size of the blocks in bytes
+
+        Returns:
+            Optional[List[EntropyOfBlock]]: entropies of the scored blocks, in file
+            order. None if a sample could not tell, then all blocks are scored
+        """
+        n_blocks = -(-file_size // block_size)
+        budget = self._get_sample_budget()
+        z = NormalDist().inv_cdf(0.5 + self._get_confidence() / 2)
+        threshold = self._get_threshold()
+        rng = random.Random(file_size)
+
+        is_sample = n_blocks > budget
+        if is_sample:
+            bounds = [n_blocks * i // budget for i in range(budget + 1)]
+            order = [rng.randrange(lo, hi) for lo, hi in zip(bounds, bounds[1:])]
+        else:
+            order = list(range(n_blocks))
+        # * any prefix of the order is a random sample of the file
+        rng.shuffle(order)
+
+        stats = RunningMean()
+        scored: Dict[int, float] = {}
+        mode: Optional[str] = None
+
+        with BlockReader(file_loc, block_size, depth=0) as reader:
+            for i in order:
+                raise_if_cancelled()
+                with reader.read_block(i * block_size) as block:
+                    entropy = shannon(block)
+                stats.add(entropy)
+                scored[i] = entropy
+
+                if stats.n < MIN_SEQUENTIAL_BLOCKS and stats.n < len(order):
+                    continue
+                if abs(stats.mean - threshold) > stats.half_width(z, n_blocks):
+                    mode = "sampled" if is_sample else "sequential"
+                    break
+
+        if mode is None and not is_sample:
+            # * every block was scored, the mean is exact
+            mode = "exact"
+
+        if mode is None:
+            l.info(
+                f"{file_loc}: a sample of {stats.n} blocks could not tell, scoring all"
+            )
+            return None
+
+        results = [
+            EntropyOfBlock(
+                offset=(i * block_size),
+                file=file_loc,
+                entropy=entropy,
+                description="%f" % entropy,
+            )
+            for i, entropy in sorted(scored.items())
+        ]
+        self._record_mode(file_loc, mode, results, n_blocks)
+        return results
+
+    def _record_mode(
+        self, file_loc: str, mode: str, results: List[EntropyOfBlock], n_blocks: int
+    ) -> None:
+        """Says which mode decided the file, in the log and in the run report (see
+        utils.metrics): "exact" if every block was scored, "sequential" if the
+        confidence bound stopped early, "sampled" if it did on a stratified sample
+        """
+        mean = sum(r.entropy for r in results) / len(results) if results else 0.0
+        self.modes[file_loc] = mode
+        l.info(
+            "%s: %s, %d of %d blocks, mean entropy %f",
+            file_loc,
+            mode,
+            len(results),
+            n_blocks,
+            mean,
+        )
+
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.add_detail(
+                "entropy_modes",
+                file_loc,
+                {
+                    "mode": mode,
+                    "blocks_scored": len(results),
+                    "blocks": n_blocks,
+                    "mean_entropy": round(mean, 6),
+                },
+            )
+
+    def _get_mode(self) -> str:
+        mode: str = os.getenv("ENTROPY_MODE", DEFAULT_ENTROPY_MODE).strip().lower()
+        if mode not in ENTROPY_MODES:
+            l.warning(f"unknown ENTROPY_MODE: {mode}, pick one of {ENTROPY_MODES}")
+            return DEFAULT_ENTROPY_MODE
+        return mode
+
+    def _get_confidence(self) -> float:
+        confidence = float(os.getenv("ENTROPY_CONFIDENCE", DEFAULT_ENTROPY_CONFIDENCE))
+        return min(max(confidence, 0.5), 1 - 1e-12)
+
+    def _get_sample_budget(self) -> int:
+        return max(
+            MIN_SEQUENTIAL_BLOCKS,
+            int(os.getenv("ENTROPY_SAMPLE_BUDGET", DEFAULT_ENTROPY_SAMPLE_BUDGET)),
+        )
 
-    def _get_threshold(self):
+    def _get_threshold(self) -> float:
         return float(os.getenv("ENCRYPTION_ENTROPY_THRESH", 0.85))
@@ -1,43 +1,222 @@
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Iterator, Tuple, Union
+from functools import lru_cache
 from enum import Enum, auto
-from math import log2
 import logging
 import os
 
+from .lazy import LazyModule
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = LazyModule("numpy")
+
 l = logging.getLogger("utils")
 
+# * anything that exposes the buffer protocol: bytes, bytearray, memoryview, mmap
+Buffer = Union[bytes, bytearray, memoryview]
+
+# a byte is represented by 8 bits. 2 ^ 8 = 256
+NUM_BYTE_VALUES = 256
+
+# * counts up to this value have their c * log2(c) tabulated. This covers every
+# * block size the conditions use in practice (8 MiB of float64s at most)
+CLOG2C_TABLE_SIZE = 1 << 20
+
+# * blocks smaller than this are histogrammed many at a time with one bincount over
+# * (row * 256 + byte) keys. Larger blocks amortize a bincount call per block just fine
+BATCHED_HISTOGRAM_MAX_BLOCK_SIZE = 4096
+
+# * how many bytes of small blocks go into a single batched bincount. Larger batches
+# * fall out of cache and get slower, not faster
+HISTOGRAM_BATCH_BYTES = 1 << 16
+
+# * how many bytes worth of histograms iter_byte_histograms hands out at a time
+HISTOGRAM_YIELD_BYTES = 1 << 22
+
+
+@lru_cache(maxsize=None)  # type: ignore
+def _clog2c_table() -> "np.ndarray":
+    """Lookup table of c * log2(c) for every count c in [0, CLOG2C_TABLE_SIZE].
+
+    Returns:
+        np.ndarray: float64 table, where entry 0 is 0 by convention
+    """
+    counts = np.arange(CLOG2C_TABLE_SIZE + 1, dtype=np.float64)
+    table = np.zeros_like(counts)
+    table[1:] = counts[1:] * np.log2(counts[1:])
+    table.flags.writeable = False
+    return table
+
+
+def _count_log2_count(histograms: "np.ndarray") -> "np.ndarray":
+    """Computes c * log2(c) elementwise, from the lookup table when the counts fit
+    in it and directly otherwise (huge blocks, e.g. a whole file as a single block).
+
+    Args:
+        histograms (np.ndarray): non-negative integer byte counts
+
+    Returns:
+        np.ndarray: float64 array of the same shape
+    """
+    if histograms.size == 0 or int(histograms.max()) <= CLOG2C_TABLE_SIZE:
+        return _clog2c_table()[histograms]
+
+    counts = histograms.astype(np.float64)
+    nonzero = counts > 0
+    counts[nonzero] *= np.log2(counts[nonzero])
+    return counts
+
+
+def _num_blocks(data: Buffer, block_size: int) -> int:
+    if block_size <= 0:
+        raise ValueError(f"block size has to be positive, got: {block_size}")
+
+    return -(-memoryview(data).nbytes // block_size)
+
+
+def iter_byte_histograms(
+    data: Buffer, block_size: int
+) -> Iterator[Tuple[int, "np.ndarray"]]:
+    """Splits data into consecutive blocks of block_size bytes (the last one may
+    be shorter) and yields their 256-bin byte histograms a batch of rows at a time.
+    This keeps the memory bounded by the batch, not by the size of data.
+
+    Args:
+        data (Buffer): bytes to histogram
+        block_size (int): size of each block in bytes
+
+    Yields:
+        Iterator[Tuple[int, np.ndarray]]: index of the first block in the batch and
+        an int64 array of shape (blocks in batch, 256)
+    """
+    _num_blocks(data, block_size)
+
+    arr = np.frombuffer(data, dtype=np.uint8)
+    n_full = arr.size // block_size
+    # * every yielded batch covers about HISTOGRAM_YIELD_BYTES of data, so that the
+    # * per-batch work of the callers (e.g. entropy) is amortized over many rows
+    rows_per_yield = max(1, HISTOGRAM_YIELD_BYTES // block_size)
+
+    if block_size <= BATCHED_HISTOGRAM_MAX_BLOCK_SIZE:
+        rows_per_bincount = max(1, HISTOGRAM_BATCH_BYTES // block_size)
+        # * offsetting every row by row * 256 gives each block its own 256 bins
+        row_offsets = np.arange(rows_per_bincount, dtype=np.intp) * NUM_BYTE_VALUES
+    else:
+        rows_per_bincount = 1
+
+    for start in range(0, n_full, rows_per_yield):
+        stop = min(n_full, start + rows_per_yield)
+        hist = np.empty((stop - start, NUM_BYTE_VALUES), dtype=np.int64)
+
+        for i in range(start, stop, rows_per_bincount):
+            j = min(stop, i + rows_per_bincount)
+            batch = arr[i * block_size : j * block_size]
+
+            if rows_per_bincount == 1:
+                hist[i - start] = np.bincount(batch, minlength=NUM_BYTE_VALUES)
+                continue
+
+            keys = batch.reshape(j - i, block_size) + row_offsets[: j - i, None]
+            counts = np.bincount(keys.ravel(), minlength=(j - i) * NUM_BYTE_VALUES)
+            hist[i - start : j - start] = counts.reshape(j - i, NUM_BYTE_VALUES)
+
+        yield start, hist
+
+    if arr.size > n_full * block_size:
+        tail = np.bincount(arr[n_full * block_size :], minlength=NUM_BYTE_VALUES)
+        yield n_full, tail.reshape(1, NUM_BYTE_VALUES)
+
+
+def byte_histograms(data: Buffer, block_size: int) -> "np.ndarray":
+    """256-bin byte histograms of every block_size block of data, see
+    iter_byte_histograms.
+
+    Args:
+        data (Buffer): bytes to histogram
+        block_size (int): size of each block in bytes
+
+    Returns:
+        np.ndarray: int64 array of shape (number of blocks, 256)
+    """
+    n_blocks = _num_blocks(data, block_size)
+    hist = np.zeros((n_blocks, NUM_BYTE_VALUES), dtype=np.int64)
+
+    for start, batch in iter_byte_histograms(data, block_size):
+        hist[start : start + len(batch)] = batch
+
+    return hist
+
+
+def entropy_of_histograms(histograms: "np.ndarray") -> "np.ndarray":
+    """Normalized Shannon entropy of every histogram row. Uses the identity
+
+    H = log2(n) - sum(c * log2(c)) / n
+
+    where n is the number of bytes in the block and c are the byte counts, so
+    that the only per-count work is a table lookup.
+
+    Args:
+        histograms (np.ndarray): integer array of shape (blocks, 256)
+
+    Returns:
+        np.ndarray: float64 entropies in [0, 1], one per row. Empty rows get 0
+    """
+    histograms = np.atleast_2d(histograms)
+    sizes = histograms.sum(axis=1).astype(np.float64)
+    clog2c = _count_log2_count(histograms).sum(axis=1)
+
+    entropy = np.zeros(len(histograms), dtype=np.float64)
+    nonempty = sizes > 0
+    entropy[nonempty] = np.log2(sizes[nonempty]) - clog2c[nonempty] / sizes[nonempty]
+
+    # normalize the entropy 1 byte = 8 bits. Our entropy is per byte before normalization
+    # * clipping only removes the floating point noise around 0 and 1
+    return np.clip(entropy / 8.0, 0.0, 1.0)
+
 
 class EntropyAlgos:
-    # * if performance is slow, we can multiprocess in the future
     @staticmethod
-    def shannon(data: bytes) -> float:
+    def shannon(data: Buffer) -> float:
         """Shannon's entropy
 
         Args:
-            data (bytes): data bytes
+            data (Buffer): data bytes
 
         Returns:
             float: shannon's entropy of the byte block
         """
-        entropy = 0.0
+        if not data:
+            return 0.0
 
-        if data:
-            tot_num_bytes = len(data)
+        # * bincount widens the bytes to intp, counting in slices keeps that bounded
+        arr = np.frombuffer(data, dtype=np.uint8)
+        counts = np.zeros(NUM_BYTE_VALUES, dtype=np.int64)
+        for start in range(0, arr.size, HISTOGRAM_BATCH_BYTES):
+            batch = arr[start : start + HISTOGRAM_BATCH_BYTES]
+            counts += np.bincount(batch, minlength=NUM_BYTE_VALUES)
+        return float(entropy_of_histograms(counts)[0])
 
-            # a byte is represented by 8 bits. 2 ^ 8 = 256
-            seen = dict(((chr(x), 0.0) for x in range(0, 256)))
+    @staticmethod
+    def shannon_blocks(data: Buffer, block_size: int) -> "np.ndarray":
+        """Shannon's entropy of every block_size block of data in one call. The
+        last block may be shorter than block_size, exactly like reading the data
+        with f.read(block_size) in a loop.
 
-            for byte in data:
-                seen[chr(byte)] += 1.0
+        Args:
+            data (Buffer): data bytes
+            block_size (int): size of each block in bytes
 
-            for v in seen.values():
-                p_x = v / tot_num_bytes
-                # expected value of the random variable I_X (which is log2(p_x))
-                if p_x > 0:
-                    entropy -= p_x * log2(p_x)
+        Returns:
+            np.ndarray: normalized shannon's entropy of each block
+        """
+        n_blocks = _num_blocks(data, block_size)
+        entropy = np.zeros(n_blocks, dtype=np.float64)
+
+        for start, batch in iter_byte_histograms(data, block_size):
+            entropy[start : start + len(batch)] = entropy_of_histograms(batch)
 
-        # normalize the entropy 1 byte = 8 bits. Our entropy is per byte before normalization
-        return entropy / 8.0
+        return entropy
 
 
 def validate_inputs_outputs() -> bool:
@@ -72,6 +251,19 @@ def validate_inputs_outputs() -> bool:
     return True
 
 
+def is_in_outputs(path: str) -> bool:
+    """Whether path is in the directory defined by the OUTPUTS env variable. The
+    diagnostics of the pod (metrics, profiles) must never go there, whatever is
+    in there gets published.
+    """
+    outputs = os.getenv("OUTPUTS")
+    if not outputs:
+        return False
+    outputs = os.path.join(os.path.realpath(outputs), "")
+    inside: bool = os.path.join(os.path.realpath(path), "").startswith(outputs)
+    return inside
+
+
 def get_size_of_dir(start_path="."):
     total_size = 0
     for dirpath, dirnames, filenames in os.walk(start_path):
@@ -103,4 +295,13 @@ def dataCategory(category: str) -> str:
     return r
 
 
-__all__ = ["EntropyAlgos", "validate_inputs_outputs", "FileExtension", "dataCategory"]
+__all__ = [
+    "EntropyAlgos",
+    "iter_byte_histograms",
+    "byte_histograms",
+    "entropy_of_histograms",
+    "validate_inputs_outputs",
+    "FileExtension",
+    "dataCategory",
+    "is_in_outputs",
+]
@@ -0,0 +1,280 @@
+from typing import Generator, Iterator, List, Optional, Tuple, Union
+from types import TracebackType
+from threading import Thread
+import logging
+import queue
+import mmap
+import io
+import os
+
+from .cancel import raise_if_cancelled
+from .metrics import record_read
+from .shared import shared_buffer
+
+l = logging.getLogger("[blocks]")
+
+# * set MMAP_READS=0 for mounts where mmap is slow or unsafe (some FUSE drivers)
+DEFAULT_MMAP_READS = "1"
+
+# * how many blocks are read ahead of the one being processed. 0 switches it off
+DEFAULT_READ_AHEAD_DEPTH = 2
+
+# * size of the blocks the scan engine and the pyramids read files in
+DEFAULT_READ_BUFFER_SIZE = 1 << 22
+
+
+def read_ahead_depth() -> int:
+    return max(0, int(os.getenv("READ_AHEAD_DEPTH", DEFAULT_READ_AHEAD_DEPTH)))
+
+
+def read_buffer_size() -> int:
+    return max(1, int(os.getenv("READ_BUFFER_SIZE", DEFAULT_READ_BUFFER_SIZE)))
+
+
+class BlockReader:
+    """Hands out the blocks of a file as memoryview slices without allocating a new
+    bytes object per block. The file is memory-mapped when possible. Pages of the
+    blocks that were already handed out are dropped from the mapping as the reader
+    moves on, so that the resident memory does not grow with the size of the file.
+    When the file can't be mapped (empty files, pipes, some network mounts), blocks
+    are read with readinto into a single reused bytearray instead. Files that were
+    loaded into shared memory for this process (see utils.shared) are served from
+    there and are not opened at all.
+
+    The next READ_AHEAD_DEPTH blocks are read in the background while the current
+    one is being processed, so that I/O and computation overlap. For mapped files
+    the kernel is asked to fetch them (MADV_WILLNEED). Otherwise a thread reads
+    them into a ring of READ_AHEAD_DEPTH + 1 reused buffers; it does not hold the
+    GIL while it waits on the disk.
+
+    Iterating raises Cancelled (see utils.cancel) once the current condition is
+    cancelled.
+
+    Note that a block is only valid until the next one is requested. Copy it (e.g.
+    bytes(block)) if you need to keep it around.
+
+        with BlockReader(file_loc, block_size) as reader:
+            for block in reader:
+                ...
+    """
+
+    def __init__(
+        self, file_loc: str, block_size: int, depth: Optional[int] = None
+    ) -> None:
+        if block_size <= 0:
+            raise ValueError(f"block size has to be positive, got: {block_size}")
+
+        self.file_loc = file_loc
+        self.block_size = block_size
+        self.depth = read_ahead_depth() if depth is None else depth
+        self.bytes_read = 0
+        self._recorded = 0
+        self._active: Optional[Generator[memoryview, None, None]] = None
+        self._shared = shared_buffer(file_loc)
+        self._f: Optional[io.BufferedReader] = None
+        self._mm: Optional[mmap.mmap] = None
+        self._buffer: Optional[bytearray] = None
+
+        if self._shared is not None:
+            return
+
+        self._f = open(file_loc, "rb")
+
+        if os.getenv("MMAP_READS", DEFAULT_MMAP_READS) != "0":
+            try:
+                self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError) as e:
+                # * empty files can't be mapped either, that is fine
+                l.debug(f"not memory-mapping {file_loc}: {e}")
+
+        if self._mm is not None and hasattr(self._mm, "madvise"):
+            self._mm.madvise(mmap.MADV_SEQUENTIAL)
+
+    @property
+    def is_mapped(self) -> bool:
+        return self._mm is not None or self._shared is not None
+
+    def __enter__(self) -> "BlockReader":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[memoryview]:
+        if self._shared is not None:
+            self._active = self._iter_mapped(self._shared)
+        elif self._mm is not None:
+            self._active = self._iter_mapped(self._mm)
+        elif self.depth > 0:
+            self._active = self._iter_read_ahead()
+        else:
+            self._active = self._iter_read()
+        return self._active
+
+    def read_block(self, offset: int, size: Optional[int] = None) -> memoryview:
+        """Random access to a single block
+
+        Args:
+            offset (int): offset of the block in bytes
+            size (Optional[int], optional): size of the block. Defaults to block_size.
+
+        Returns:
+            memoryview: the block, shorter than size at the end of the file
+        """
+        size = size or self.block_size
+
+        mapped = self._shared if self._shared is not None else self._mm
+
+        if mapped is not None:
+            block = memoryview(mapped)[offset : offset + size]
+        else:
+            assert self._f is not None
+            if self._buffer is None or len(self._buffer) < size:
+                self._buffer = bytearray(size)
+            self._f.seek(offset)
+            n = self._f.readinto(memoryview(self._buffer)[:size])
+            block = memoryview(self._buffer)[:n]
+
+        self.bytes_read += len(block)
+        return block
+
+    def close(self) -> None:
+        # * the reads count against the condition that is reading (see utils.metrics)
+        record_read(self.file_loc, self.bytes_read - self._recorded)
+        self._recorded = self.bytes_read
+        if self._active is not None:
+            # * stops the read-ahead thread, if any, before the file goes away
+            self._active.close()
+            self._active = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # * somebody still holds a block, the mapping goes away with it
+                l.debug(f"{self.file_loc} is still referenced, not unmapping it yet")
+            self._mm = None
+        if self._shared is not None:
+            _release(self._shared)
+            self._shared = None
+        if self._f is not None:
+            self._f.close()
+
+    def _iter_mapped(
+        self, mm: Union[mmap.mmap, memoryview]
+    ) -> Generator[memoryview, None, None]:
+        view = memoryview(mm)
+        size = len(mm)
+        # * pages are dropped from the mapping in multiples of the page size
+        released = 0
+        prefetched = 0
+
+        for offset in range(0, size, self.block_size):
+            # * keep the next depth blocks (after this one) in the read-ahead window
+            ahead = min(size, offset + (self.depth + 1) * self.block_size)
+            if self.depth > 0 and ahead > prefetched and hasattr(mm, "madvise"):
+                start = prefetched // mmap.PAGESIZE * mmap.PAGESIZE
+                mm.madvise(mmap.MADV_WILLNEED, start, ahead - start)
+                prefetched = ahead
+
+            raise_if_cancelled()
+            block = view[offset : offset + self.block_size]
+            self.bytes_read += len(block)
+            yield block
+            _release(block)
+
+            done = (offset + self.block_size) // mmap.PAGESIZE * mmap.PAGESIZE
+            if done > released and hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_DONTNEED, released, min(done, size) - released)
+                released = done
+
+        _release(view)
+
+    def _iter_read(self) -> Generator[memoryview, None, None]:
+        if self._buffer is None or len(self._buffer) < self.block_size:
+            self._buffer = bytearray(self.block_size)
+        buffer = memoryview(self._buffer)[: self.block_size]
+
+        assert self._f is not None
+        self._f.seek(0)
+        n = self._f.readinto(buffer)
+        while n:
+            self.bytes_read += n
+            yield buffer[:n]
+            raise_if_cancelled()
+            n = self._f.readinto(buffer)
+
+    def _iter_read_ahead(self) -> Generator[memoryview, None, None]:
+        buffers = [bytearray(self.block_size) for _ in range(self.depth + 1)]
+        # * indices of the buffers the thread may fill, and of the filled ones
+        free: "queue.Queue[Optional[int]]" = queue.Queue()
+        filled: "queue.Queue[Tuple[int, int, Optional[BaseException]]]" = queue.Queue()
+
+        for i in range(len(buffers)):
+            free.put(i)
+
+        assert self._f is not None
+        self._f.seek(0)
+        thread = Thread(
+            target=_fill_buffers,
+            args=(self._f, buffers, free, filled),
+            name=f"read-ahead {os.path.basename(self.file_loc)}",
+            daemon=True,
+        )
+        thread.start()
+
+        try:
+            while True:
+                raise_if_cancelled()
+                i, n, e = filled.get()
+                if e is not None:
+                    raise e
+                if not n:
+                    return
+                self.bytes_read += n
+                block = memoryview(buffers[i])[:n]
+                yield block
+                _release(block)
+                free.put(i)
+        finally:
+            free.put(None)
+            thread.join()
+
+
+def _fill_buffers(
+    f: object,
+    buffers: List[bytearray],
+    free: "queue.Queue[Optional[int]]",
+    filled: "queue.Queue[Tuple[int, int, Optional[BaseException]]]",
+) -> None:
+    """Body of the read-ahead thread: fills free buffers in file order until the
+    end of the file or until it gets None.
+    """
+    try:
+        while True:
+            i = free.get()
+            if i is None:
+                return
+            n = f.readinto(buffers[i])  # type: ignore
+            filled.put((i, n, None))
+            if not n:
+                return
+    except BaseException as e:
+        filled.put((-1, 0, e))
+
+
+def _release(view: memoryview) -> None:
+    """Releases the view so that the mapping can be closed. If the consumer still
+    holds on to it (e.g. via a numpy array), it is released when that goes away.
+    """
+    try:
+        view.release()
+    except BufferError:
+        pass
+
+
+__all__ = ["BlockReader"]
@@ -0,0 +1,64 @@
+from typing import Optional, Union
+from threading import Event, local
+
+
+class Cancelled(Exception):
+    """Raised inside a condition when the runner no longer needs its verdict,
+    because another condition has already failed.
+    """
+
+
+class AnyEvent:
+    """Looks set as soon as any of the events is set. Lets work that a condition
+    fans out to other threads be cancelled both by the runner and by the
+    condition itself.
+    """
+
+    def __init__(self, *events: Optional[Union[Event, "AnyEvent"]]) -> None:
+        self.events = [e for e in events if e is not None]
+
+    def is_set(self) -> bool:
+        return any(e.is_set() for e in self.events)
+
+
+_state = local()
+
+
+def set_cancel_event(event: Optional[Union[Event, AnyEvent]]) -> None:
+    """Sets the event that cancels whatever runs on the current thread. The runner
+    sets it for every condition it starts.
+
+    Args:
+        event (Optional[Union[Event, AnyEvent]]): cancellation event, None to clear it
+    """
+    _state.event = event
+
+
+def get_cancel_event() -> Optional[Union[Event, AnyEvent]]:
+    return getattr(_state, "event", None)
+
+
+def is_cancelled() -> bool:
+    event = get_cancel_event()
+    return event is not None and event.is_set()
+
+
+def raise_if_cancelled() -> None:
+    """Cooperative cancellation point. Long running loops (e.g. block reads) call
+    this so that a cancelled condition stops soon after the runner asks it to.
+
+    Raises:
+        Cancelled: if the current thread's cancellation event is set
+    """
+    if is_cancelled():
+        raise Cancelled()
+
+
+__all__ = [
+    "Cancelled",
+    "AnyEvent",
+    "set_cancel_event",
+    "get_cancel_event",
+    "is_cancelled",
+    "raise_if_cancelled",
+]
@@ -0,0 +1,144 @@
+from typing import Dict, Union
+import unicodedata
+import os
+
+from . import Buffer
+
+# * canonicalization is off unless KEYWORD_CANONICALIZE is set
+DEFAULT_KEYWORD_CANONICALIZE = "0"
+
+# * leet speak digits and symbols and the letters they stand for
+LEET = {
+    "0": "o",
+    "1": "i",
+    "3": "e",
+    "4": "a",
+    "5": "s",
+    "7": "t",
+    "8": "b",
+    "9": "g",
+    "@": "a",
+    "$": "s",
+    "!": "i",
+    "|": "i",
+    "+": "t",
+}
+
+# * bytes that may be slipped into a word (f.r.a.c.t.a.l.s, fr-act_als) and are
+# * dropped. Whitespace is kept, or every sentence would run its words together
+# * and short keywords would turn up across them. So is the syntax of csv and
+# * json, and the \x00 that joins the cells of a row
+SEPARATORS = b".-_*~'`/\\"
+
+_ASCII_TABLE = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZ" + "".join(LEET).encode("ascii"),
+    b"abcdefghijklmnopqrstuvwxyz" + "".join(LEET.values()).encode("ascii"),
+)
+
+# * letters of other scripts that look like latin ones, after casefolding
+CONFUSABLES = {
+    # * cyrillic
+    "а": "a",
+    "в": "b",
+    "е": "e",
+    "ё": "e",
+    "і": "i",
+    "ј": "j",
+    "к": "k",
+    "м": "m",
+    "н": "h",
+    "о": "o",
+    "р": "p",
+    "с": "c",
+    "ѕ": "s",
+    "т": "t",
+    "у": "y",
+    "х": "x",
+    "ԁ": "d",
+    "ӏ": "l",
+    # * greek
+    "α": "a",
+    "β": "b",
+    "ε": "e",
+    "η": "n",
+    "ι": "i",
+    "κ": "k",
+    "μ": "u",
+    "ν": "v",
+    "ο": "o",
+    "ρ": "p",
+    "τ": "t",
+    "υ": "u",
+    "χ": "x",
+    # * latin lookalikes that casefolding and NFKD leave alone
+    "ı": "i",
+    "ɡ": "g",
+    "ɑ": "a",
+}
+
+# * characters that are dropped: combining marks (what is left of accents after
+# * NFKD), invisible ones and unicode dashes and dots
+_DROPPED = (
+    list(range(0x0300, 0x0370))
+    + [0x00AD, 0x00B7, 0x200B, 0x200C, 0x200D, 0x2060, 0xFEFF]
+    + list(range(0x2010, 0x2016))
+    + [0x2022, 0x2027, 0x2212]
+)
+
+_UNICODE_REPLACEMENTS: Dict[str, str] = {
+    **CONFUSABLES,
+    **{chr(c): "" for c in _DROPPED},
+}
+
+
+def canonicalize(data: Union[str, Buffer]) -> bytes:
+    """Canonical form of a whole chunk of text, or of raw utf-8 bytes: lower case,
+    leet speak digits and symbols turned into letters (fr4ct4ls is fractals), the
+    SEPARATORS dropped, and, in non-ascii text, accents, invisible characters and
+    lookalike letters of other scripts (cyrillic а for a) taken care of.
+
+    ascii text, which is most of it, goes through a single bytes.translate, which
+    runs in C at memory speed. Other text is decoded once and normalized with
+    whole string operations (undecodable bytes are carried through as they are). A
+    character that is cut by the end of a chunk is left as it is.
+
+    The keywords go through the same function when the automaton is built (see
+    KeywordAutomaton), so matching canonical text needs no extra work.
+
+    Args:
+        data (Union[str, Buffer]): text, or raw utf-8 bytes
+
+    Returns:
+        bytes: canonical utf-8 bytes
+    """
+    if isinstance(data, str):
+        raw = data.encode("utf-8", "surrogatepass")
+    else:
+        raw = bytes(data)
+
+    if not raw.isascii():
+        text = raw.decode("utf-8", "surrogateescape").casefold()
+        text = unicodedata.normalize("NFKD", text)
+        # * str.translate looks every character up in a dict, which is an order of
+        # * magnitude slower than replacing the few characters that are there
+        for char in [c for c in _UNICODE_REPLACEMENTS if c in text]:
+            text = text.replace(char, _UNICODE_REPLACEMENTS[char])
+        raw = text.encode("utf-8", "surrogateescape")
+
+    return raw.translate(_ASCII_TABLE, SEPARATORS)
+
+
+def canonical_keyword(keyword: str) -> str:
+    """Canonical form of a keyword, see canonicalize"""
+    return canonicalize(keyword).decode("utf-8", "surrogateescape")
+
+
+def keyword_canonicalize() -> bool:
+    """Whether keywords are matched on the canonical form of the text (see
+    canonicalize), set KEYWORD_CANONICALIZE=1 to switch it on
+    """
+    flag: str = os.getenv("KEYWORD_CANONICALIZE", DEFAULT_KEYWORD_CANONICALIZE)
+    return flag != "0"
+
+
+__all__ = ["canonicalize", "canonical_keyword", "keyword_canonicalize"]
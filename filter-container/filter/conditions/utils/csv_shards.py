@@ -0,0 +1,316 @@
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+from types import TracebackType
+import logging
+import os
+
+from .blocks import BlockReader, read_buffer_size, _release
+from .cancel import Cancelled, is_cancelled, raise_if_cancelled, set_cancel_event
+from .lazy import LazyModule
+from .metrics import ConditionMetrics, get_metrics, tracking
+from .parallel import process_context
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = LazyModule("numpy")
+
+l = logging.getLogger("[csv_shards]")
+
+QUOTE = ord('"')
+NEWLINE = ord("\n")
+
+# * shards are never smaller than this, so that starting a worker pays off
+MIN_SHARD_SIZE = 8 << 20
+
+# * how often the pool checks whether the condition itself was cancelled
+CANCEL_POLL_INTERVAL = 0.05
+
+
+def iter_range(
+    reader: BlockReader, start: int, end: int, block_size: Optional[int] = None
+) -> Iterator[memoryview]:
+    """Blocks of the [start, end) byte range of the file, in order. Like iterating
+    the reader, every block is only valid until the next one is requested.
+    """
+    block_size = block_size or reader.block_size
+    offset = start
+
+    while offset < end:
+        raise_if_cancelled()
+        block = reader.read_block(offset, min(block_size, end - offset))
+        if not len(block):
+            return
+        offset += len(block)
+        yield block
+        _release(block)
+
+
+def count_quotes(file_loc: str, start: int, end: int) -> int:
+    """Number of double quotes in the [start, end) byte range of the file"""
+    quotes = 0
+
+    with BlockReader(file_loc, read_buffer_size()) as reader:
+        for block in iter_range(reader, start, end):
+            data = np.frombuffer(block, dtype=np.uint8)
+            quotes += int(np.count_nonzero(data == QUOTE))
+            del data
+
+    return quotes
+
+
+def record_start(file_loc: str, offset: int, in_quotes: bool) -> int:
+    """Finds the start of the first csv record at or after offset, i.e. the
+    position after the first newline that is not inside a quoted field.
+
+    Args:
+        file_loc (str): path of the csv file
+        offset (int): where to start looking
+        in_quotes (bool): whether offset is inside a quoted field, i.e. whether an
+        odd number of quotes comes before it
+
+    Returns:
+        int: start of the record, the size of the file if there is none
+    """
+    size: int = os.path.getsize(file_loc)
+
+    with BlockReader(file_loc, 1 << 16) as reader:
+        for block in iter_range(reader, offset, size):
+            data = np.frombuffer(block, dtype=np.uint8)
+            # * quote parity in front of every byte of the block
+            parity = (np.cumsum(data == QUOTE) - (data == QUOTE) + in_quotes) % 2
+            newlines = np.flatnonzero((data == NEWLINE) & (parity == 0))
+
+            if len(newlines):
+                return offset + int(newlines[0]) + 1
+
+            in_quotes = bool((in_quotes + np.count_nonzero(data == QUOTE)) % 2)
+            offset += len(block)
+            del data
+
+    return size
+
+
+def line_start(file_loc: str, offset: int) -> int:
+    """Finds the start of the first line at or after offset, i.e. the position
+    after the first newline. For files where a newline always ends a record, like
+    newline delimited json.
+
+    Returns:
+        int: start of the line, the size of the file if there is none
+    """
+    size: int = os.path.getsize(file_loc)
+    if offset == 0:
+        return 0
+
+    # * offset may be the start of a line itself
+    offset -= 1
+
+    with BlockReader(file_loc, 1 << 16) as reader:
+        for block in iter_range(reader, offset, size):
+            data = np.frombuffer(block, dtype=np.uint8)
+            newlines = np.flatnonzero(data == NEWLINE)
+
+            if len(newlines):
+                return offset + int(newlines[0]) + 1
+
+            offset += len(block)
+            del data
+
+    return size
+
+
+class ShardPool:
+    """Splits a single large csv file into byte ranges that start and end on
+    record boundaries and processes them in parallel, in worker processes, since
+    parsing csv holds the GIL.
+
+    Whether a position is inside a quoted field (where newlines do not end the
+    record) depends on everything in front of it. So the file is cut into equal
+    ranges first, the workers count the quotes in every range, and the prefix
+    sums of those counts tell where each range really starts. Doubled quotes
+    inside quoted fields ("") do not change the parity, so they are fine.
+
+    The workers are spawned, not forked (see utils.parallel.process_context), so
+    fn has to be importable.
+
+        with ShardPool(workers) as pool:
+            shards = pool.record_shards(file_loc)
+            results = pool.map(fn, [(file_loc, start, end) for start, end in shards])
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        context = process_context()
+        self._cancel = context.Event()
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=set_cancel_event,
+            initargs=(self._cancel,),
+        )
+        self._futures: Set[Future] = set()
+
+    def __enter__(self) -> "ShardPool":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._cancel.set()
+        # * shards that did not start never will (shutdown's cancel_futures is 3.9+)
+        for future in self._futures:
+            future.cancel()
+        self._futures.clear()
+        # * running shards stop at their next cancellation point. Not waiting for
+        # * them hangs python 3.8 on exit: its shutdown(wait=False) closes the pipe
+        # * the management thread of the pool still wakes up on
+        self._pool.shutdown(wait=True)
+
+    def record_shards(
+        self, file_loc: str, shards: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """Byte ranges of the file that start and end on record boundaries
+
+        Args:
+            file_loc (str): path of the csv file
+            shards (Optional[int], optional): how many ranges to aim for, there may
+            be fewer. Defaults to the number of workers.
+
+        Returns:
+            List[Tuple[int, int]]: [start, end) ranges that cover the whole file
+        """
+        size = os.path.getsize(file_loc)
+        shards = max(1, min(shards or self.max_workers, size // MIN_SHARD_SIZE))
+        cuts = [size * i // shards for i in range(shards + 1)]
+
+        counts = self.map(
+            count_quotes,
+            [(file_loc, cuts[i], cuts[i + 1]) for i in range(shards)],
+        )
+
+        starts = [0]
+        quotes = 0
+        for i in range(1, shards):
+            quotes += counts[i - 1]
+            start = record_start(file_loc, cuts[i], bool(quotes % 2))
+            # * a quoted field may span a whole range
+            if start > starts[-1] and start < size:
+                starts.append(start)
+
+        return list(zip(starts, starts[1:] + [size]))
+
+    def line_shards(
+        self, file_loc: str, shards: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """Byte ranges of the file that start and end on line boundaries, like
+        record_shards but without looking at quotes
+
+        Args:
+            file_loc (str): path of the file
+            shards (Optional[int], optional): how many ranges to aim for, there may
+            be fewer. Defaults to the number of workers.
+
+        Returns:
+            List[Tuple[int, int]]: [start, end) ranges that cover the whole file
+        """
+        size = os.path.getsize(file_loc)
+        shards = max(1, min(shards or self.max_workers, size // MIN_SHARD_SIZE))
+
+        starts = [0]
+        for i in range(1, shards):
+            start = line_start(file_loc, size * i // shards)
+            if start > starts[-1] and start < size:
+                starts.append(start)
+
+        return list(zip(starts, starts[1:] + [size]))
+
+    def map(
+        self,
+        fn: Callable[..., Any],
+        args: Sequence[Tuple[Any, ...]],
+        is_hit: Optional[Callable[[Any], bool]] = None,
+    ) -> List[Any]:
+        """Calls fn(*a) for every a in args in the worker processes. As soon as a
+        result is a hit, the shards that are still running are cancelled.
+
+        Args:
+            fn (Callable[..., Any]): module level (picklable) function
+            args (Sequence[Tuple[Any, ...]]): arguments of every call
+            is_hit (Optional[Callable[[Any], bool]], optional): tells a result that
+            makes the others unnecessary. Defaults to None.
+
+        Raises:
+            Cancelled: if the calling thread was cancelled
+
+        Returns:
+            List[Any]: results in the order of args, None for cancelled calls
+        """
+        futures = [self._pool.submit(_call, fn, a) for a in args]
+        self._futures.update(futures)
+        metrics = get_metrics()
+        results: List[Any] = [None] * len(futures)
+        index = {f: i for i, f in enumerate(futures)}
+        pending: Set[Future] = set(futures)
+
+        while pending:
+            done, pending = wait(
+                pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED
+            )
+
+            if is_cancelled():
+                self._cancel.set()
+                raise Cancelled()
+
+            for future in done:
+                result, worked = future.result()
+                results[index[future]] = result
+                if metrics is not None:
+                    metrics.merge(worked)
+
+                if is_hit is not None and result is not None and is_hit(result):
+                    self._cancel.set()
+                    for f in pending:
+                        f.cancel()
+                    return results
+
+        return results
+
+
+def _call(
+    fn: Callable[..., Any], args: Tuple[Any, ...]
+) -> Tuple[Any, ConditionMetrics]:
+    """Runs in a worker process. What the call cost is sent back along with its
+    result, for the metrics of the condition (see utils.metrics)
+    """
+    metrics = ConditionMetrics()
+    with tracking(metrics):
+        try:
+            return fn(*args), metrics
+        except Cancelled:
+            return None, metrics
+
+
+__all__ = [
+    "ShardPool",
+    "iter_range",
+    "count_quotes",
+    "record_start",
+    "line_start",
+]
@@ -0,0 +1,296 @@
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+import codecs
+import json
+import re
+
+from . import Buffer
+
+# * tokens of json text, anchored after optional whitespace. Strings use the
+# * unrolled form of the escape loop, which keeps the regex engine in tight loops
+_TOKEN = re.compile(
+    r'[ \t\n\r]*(?:("[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*")'
+    r"|(-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)"
+    r"|(true|false|null)"
+    r"|([{}\[\]:,]))"
+)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# * what may follow the part of a number at the end of a block
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+# * a string that a later block may complete
+_OPEN_STRING = re.compile(
+    r'"[^"\\\x00-\x1f]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*'
+    r"(?:\\(?:u[0-9a-fA-F]{0,3})?)?"
+)
+# * numbers and literals cut by the end of a block are never longer than this
+MAX_SCALAR_LENGTH = 1 << 10
+
+# * parser states: what the next token may be
+_VALUE, _FIRST_VALUE, _KEY, _FIRST_KEY, _COLON, _AFTER_VALUE, _END = range(7)
+
+
+class JsonError(ValueError):
+    """Raised when the text is not valid json"""
+
+
+class _Pairs(list):
+    """Key / value pairs of a parsed object. Unlike a dict, it keeps all of the
+    values of a repeated key, which may hide a keyword as well.
+    """
+
+
+def _reject_constant(name: str) -> Any:
+    raise JsonError(f"{name} is not valid json")
+
+
+_decoder = json.JSONDecoder(object_pairs_hook=_Pairs, parse_constant=_reject_constant)
+
+# * the C scanner of the json module. It parses a whole value at a position of
+# * the text, an order of magnitude faster than tokenizing it here
+_scan_once = _decoder.scan_once
+
+
+def loads(text: str) -> Any:
+    """Parses a json document like json.loads, but strictly (no NaN or Infinity)
+    and keeping every key of an object, see iter_strings
+
+    Raises:
+        JsonError: if the text is not valid json
+    """
+    try:
+        return _decoder.decode(text)
+    except JsonError:
+        raise
+    except ValueError as e:
+        raise JsonError(str(e))
+
+
+def iter_json_events(
+    blocks: Iterable[Buffer], expand: bool = True
+) -> Iterator[Tuple[str, Any]]:
+    """Parses a json document incrementally, from consecutive blocks of its raw
+    utf-8 bytes, and yields ijson-like events instead of building the document:
+
+        ("start_map", None), ("map_key", "a"), ("start_array", None),
+        ("number", 1), ("string", "x"), ("boolean", True), ("null", None),
+        ("end_array", None), ("end_map", None)
+
+    Containers that fit in what is left of the current block are parsed in one go
+    by the C scanner of the json module, the rest is tokenized here. So a large
+    array of records is only walked token by token at the top level. What a block
+    cuts in two is carried over to the next block, so the memory this takes is
+    that of a block (plus the longest string) and the nesting depth, whatever the
+    size of the document.
+
+    Args:
+        blocks (Iterable[Buffer]): consecutive blocks of the document, each only
+        valid until the next one is requested
+        expand (bool, optional): with False, a container that the C scanner parsed
+        comes as a single ("container", value) event, where objects are lists of
+        key / value pairs (see iter_strings). Defaults to True.
+
+    Raises:
+        JsonError: if the text is not a single valid json document
+
+    Yields:
+        Tuple[str, Any]: event and its value
+    """
+    state = _VALUE
+    stack: List[str] = []
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    carry = ""
+    offset = 0
+
+    for data, final in _with_final(blocks):
+        try:
+            buffer = carry + decoder.decode(data, final=final)
+        except UnicodeDecodeError as e:
+            raise JsonError(f"not utf-8: {e}")
+        size = len(buffer)
+        pos = 0
+
+        while pos < size:
+            match = _TOKEN.match(buffer, pos)
+
+            if match is None or (match.end() == size and not final):
+                if match is None:
+                    end = _WHITESPACE.match(buffer, pos).end()
+                    if end == size:
+                        pos = end
+                        break
+                    if final or not _may_continue(buffer, end):
+                        raise JsonError(f"invalid json at character {offset + end}")
+                break
+
+            string, number, literal, punct = match.groups()
+            start = match.start(match.lastindex)
+
+            if punct == ":":
+                if state != _COLON:
+                    raise JsonError(f"unexpected : at character {offset + start}")
+                pos = match.end()
+                state = _VALUE
+                continue
+
+            if punct == ",":
+                if state != _AFTER_VALUE:
+                    raise JsonError(f"unexpected , at character {offset + start}")
+                pos = match.end()
+                state = _KEY if stack[-1] == "{" else _VALUE
+                continue
+
+            if punct == "}" or punct == "]":
+                opening = "{" if punct == "}" else "["
+                first = _FIRST_KEY if punct == "}" else _FIRST_VALUE
+                if (
+                    not stack
+                    or stack[-1] != opening
+                    or (state != first and state != _AFTER_VALUE)
+                ):
+                    raise JsonError(f"unexpected {punct} at character {offset + start}")
+                pos = match.end()
+                stack.pop()
+                yield ("end_map" if punct == "}" else "end_array"), None
+
+            elif string is not None and (state == _KEY or state == _FIRST_KEY):
+                pos = match.end()
+                yield "map_key", _decode_string(string, offset + start)
+                state = _COLON
+                continue
+
+            elif state != _VALUE and state != _FIRST_VALUE:
+                raise JsonError(f"unexpected value at character {offset + start}")
+
+            elif string is not None:
+                pos = match.end()
+                yield "string", _decode_string(string, offset + start)
+
+            elif number is not None:
+                if not final and _NUMBER_TAIL.match(buffer, match.end()).end() == size:
+                    # * the next block may hold the rest of the number
+                    break
+                pos = match.end()
+                yield "number", json.loads(number)
+
+            elif literal is not None:
+                pos = match.end()
+                if literal == "null":
+                    yield "null", None
+                else:
+                    yield "boolean", literal == "true"
+
+            else:
+                try:
+                    value, pos = _scan_once(buffer, start)
+                except (StopIteration, ValueError):
+                    # * cut by the end of the block, or invalid. Tokenizing it
+                    # * tells which one it is
+                    pos = match.end()
+                    stack.append(punct)
+                    if punct == "{":
+                        yield "start_map", None
+                        state = _FIRST_KEY
+                    else:
+                        yield "start_array", None
+                        state = _FIRST_VALUE
+                    continue
+                if expand:
+                    yield from _value_events(value)
+                else:
+                    yield "container", value
+
+            # * a value (or a container) is complete
+            state = _AFTER_VALUE if stack else _END
+            if state == _END:
+                # * anything but whitespace after the document is an error
+                end = _WHITESPACE.match(buffer, pos).end()
+                if end < size:
+                    raise JsonError(f"extra data at character {offset + end}")
+                pos = end
+
+        carry = buffer[pos:]
+        offset += pos
+
+    if state != _END:
+        raise JsonError("unexpected end of json")
+
+
+def _value_events(value: Any) -> Iterator[Tuple[str, Any]]:
+    """Events of a value that the C scanner parsed, in document order"""
+    # * values and events still to come, the next one last
+    pending: List[Any] = [value]
+
+    while pending:
+        value = pending.pop()
+
+        if isinstance(value, tuple):
+            yield value
+        elif isinstance(value, str):
+            yield "string", value
+        elif isinstance(value, _Pairs):
+            yield "start_map", None
+            pending.append(("end_map", None))
+            for k, v in reversed(value):
+                pending.append(v)
+                pending.append(("map_key", k))
+        elif isinstance(value, list):
+            yield "start_array", None
+            pending.append(("end_array", None))
+            pending.extend(reversed(value))
+        elif value is None:
+            yield "null", None
+        elif isinstance(value, bool):
+            yield "boolean", value
+        else:
+            yield "number", value
+
+
+def _with_final(blocks: Iterable[Buffer]) -> Iterator[Tuple[Buffer, bool]]:
+    """Pairs every block with whether it is the last one. The previous block is
+    held back until the next one arrives, so it is copied.
+    """
+    previous: Optional[bytes] = None
+
+    for block in blocks:
+        if previous is not None:
+            yield previous, False
+        previous = bytes(block)
+
+    yield (previous if previous is not None else b""), True
+
+
+def _may_continue(buffer: str, pos: int) -> bool:
+    """Whether the text from pos on is the start of a token that the next block
+    may complete, rather than invalid json
+    """
+    if buffer.startswith('"', pos):
+        return _OPEN_STRING.fullmatch(buffer, pos) is not None
+    return len(buffer) - pos <= MAX_SCALAR_LENGTH
+
+
+def _decode_string(token: str, position: int) -> str:
+    if "\\" not in token:
+        return token[1:-1]
+    try:
+        value: str = json.loads(token)
+    except ValueError as e:
+        raise JsonError(f"invalid string at character {position}: {e}")
+    return value
+
+
+def iter_strings(value: Any) -> Iterator[str]:
+    """Keys and string values of a value parsed by loads, depth first"""
+    stack = [value]
+
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, _Pairs):
+            for k, v in value:
+                yield k
+                stack.append(v)
+        elif isinstance(value, list):
+            stack.extend(value)
+
+
+__all__ = ["JsonError", "iter_json_events", "iter_strings", "loads"]
@@ -0,0 +1,254 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import struct
+import pickle
+import mmap
+import json
+import sys
+import os
+
+from . import canonical as _canonical, keywords as _keywords
+from .keywords import (
+    KeywordAutomaton,
+    add_prebuilt_automaton,
+    keyword_canonicalize,
+    keyword_max_edits,
+)
+
+l = logging.getLogger("[keyword_index]")
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config")
+DEFAULT_KEYWORDS_YAML = os.path.join(CONFIG_DIR, "no_keywords.yaml")
+DEFAULT_KEYWORD_INDEX = os.path.join(CONFIG_DIR, "no_keywords.index")
+
+# * bump when the layout of the file changes
+KEYWORD_INDEX_VERSION = 1
+MAGIC = b"KWINDEX\x00"
+_HEADER_SIZE = struct.Struct("<Q")
+
+# * the tables of the automata start on this boundary, so numpy can use them in
+# * place
+ALIGNMENT = 64
+
+
+class KeywordIndexError(Exception):
+    """Raised when a keyword index can't be used: it is missing, was compiled
+    from another config (or matcher), or is damaged
+    """
+
+
+def source_digest(yaml_path: str) -> str:
+    """Digest of what an index is compiled from: the keywords config and the code
+    of the matcher, whose tables the index holds. An index with another digest is
+    stale.
+    """
+    digest = hashlib.sha256()
+    for path in (yaml_path, _keywords.__file__, _canonical.__file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    hexdigest: str = digest.hexdigest()
+    return hexdigest
+
+
+class KeywordIndex:
+    """The keywords of every environment and data category of the config, and
+    their prebuilt automata, loaded from a file that compile_keyword_index wrote.
+
+    Only the (json) header is parsed when it is loaded. The file is memory-mapped,
+    and the automaton of a category is unpickled the first time it is asked for,
+    with the numpy tables (e.g. the gram filter) used in place, in the mapping.
+    So it is ready in a fraction of the time yaml and confuse take.
+
+        index = load_keyword_index(DEFAULT_KEYWORD_INDEX, DEFAULT_KEYWORDS_YAML)
+        index.keywords("development", "mathematics")
+    """
+
+    def __init__(self, path: str, expected_digest: Optional[str] = None) -> None:
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise KeywordIndexError(f"empty keyword index: {path}")
+
+        try:
+            if self._map[: len(MAGIC)] != MAGIC:
+                raise KeywordIndexError(f"not a keyword index: {path}")
+            (size,) = _HEADER_SIZE.unpack_from(self._map, len(MAGIC))
+            start = len(MAGIC) + _HEADER_SIZE.size
+            header = json.loads(self._map[start : start + size].decode("utf-8"))
+        except (struct.error, ValueError) as e:
+            raise KeywordIndexError(f"damaged keyword index {path}: {e}")
+
+        if header.get("version") != KEYWORD_INDEX_VERSION:
+            raise KeywordIndexError(f"keyword index {path} has another version")
+        if expected_digest is not None and header.get("digest") != expected_digest:
+            raise KeywordIndexError(f"keyword index {path} is stale")
+
+        self.path = path
+        self.max_edits: int = header["max_edits"]
+        self.canonical: bool = header["canonical"]
+        self._environments: Dict[str, Dict[str, Dict[str, Any]]] = header[
+            "environments"
+        ]
+        self._automata: Dict[Tuple[str, str], KeywordAutomaton] = {}
+
+    def keywords(self, environment: str, category: str) -> List[str]:
+        """Keywords of a data category
+
+        Raises:
+            KeyError: if the environment has no such category
+        """
+        return list(self._environments[environment][category]["keywords"])
+
+    def automaton(self, environment: str, category: str) -> KeywordAutomaton:
+        """Prebuilt automaton of the keywords of a data category. It is built with
+        the KEYWORD_MAX_EDITS and KEYWORD_CANONICALIZE of the build.
+
+        Raises:
+            KeyError: if the environment has no such category
+        """
+        key = (environment, category)
+        automaton = self._automata.get(key)
+
+        if automaton is None:
+            entry = self._environments[environment][category]
+            view = memoryview(self._map)
+            offset, length = entry["automaton"]
+            buffers = [view[a : a + n] for a, n in entry["buffers"]]
+            automaton = pickle.loads(view[offset : offset + length], buffers=buffers)
+            self._automata[key] = automaton
+
+        return automaton
+
+    def use_automaton(self, environment: str, category: str) -> None:
+        """Lets keyword_automaton hand out the prebuilt automaton of the category,
+        if the index was built with the current KEYWORD_MAX_EDITS and
+        KEYWORD_CANONICALIZE
+        """
+        if (self.max_edits, self.canonical) == (
+            keyword_max_edits(),
+            keyword_canonicalize(),
+        ):
+            add_prebuilt_automaton(self.automaton(environment, category))
+
+
+def load_keyword_index(
+    path: str = DEFAULT_KEYWORD_INDEX, yaml_path: str = DEFAULT_KEYWORDS_YAML
+) -> Optional[KeywordIndex]:
+    """Loads the keyword index, if there is an up to date one
+
+    Args:
+        path (str, optional): the index. Defaults to DEFAULT_KEYWORD_INDEX.
+        yaml_path (str, optional): the config it should have been compiled from.
+        Defaults to DEFAULT_KEYWORDS_YAML.
+
+    Returns:
+        Optional[KeywordIndex]: the index, None if it is missing, stale or damaged,
+        then the keywords have to come from the config itself
+    """
+    if not os.path.exists(path):
+        l.debug(f"no keyword index in {path}")
+        return None
+
+    try:
+        return KeywordIndex(path, source_digest(yaml_path))
+    except (OSError, KeywordIndexError) as e:
+        l.warning(f"not using the keyword index: {e}")
+        return None
+
+
+def compile_keyword_index(
+    yaml_path: str = DEFAULT_KEYWORDS_YAML, path: str = DEFAULT_KEYWORD_INDEX
+) -> None:
+    """Compiles the keywords config into an index (see KeywordIndex), with an
+    automaton for every data category, built with the KEYWORD_MAX_EDITS and
+    KEYWORD_CANONICALIZE of the environment it runs in. Runs when the image is
+    built:
+
+        python -m filter.conditions.utils.keyword_index [yaml_path] [path]
+    """
+    import yaml
+
+    with open(yaml_path, "r") as f:
+        config = yaml.safe_load(f)
+
+    max_edits, canonical = keyword_max_edits(), keyword_canonicalize()
+    blob = bytearray()
+    environments: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def append(data: Any) -> List[int]:
+        blob.extend(b"\x00" * (-len(blob) % ALIGNMENT))
+        offset = len(blob)
+        blob.extend(data)
+        return [offset, len(blob) - offset]
+
+    for environment, settings in (config.get("environments") or {}).items():
+        categories = (settings or {}).get("keywords") or {}
+        environments[environment] = {}
+
+        for category, words in categories.items():
+            words = [str(w) for w in words or []]
+            automaton = KeywordAutomaton(words, max_edits, canonical)
+            buffers: List[pickle.PickleBuffer] = []
+            data = pickle.dumps(automaton, protocol=5, buffer_callback=buffers.append)
+            # * the blob is relative to the end of the header, fixed up below
+            environments[environment][category] = {
+                "keywords": words,
+                "buffers": [append(b.raw()) for b in buffers],
+                "automaton": append(data),
+            }
+
+    def header_for(base: int) -> bytes:
+        shifted = {
+            environment: {
+                category: {
+                    "keywords": entry["keywords"],
+                    "automaton": [entry["automaton"][0] + base, entry["automaton"][1]],
+                    "buffers": [[a + base, n] for a, n in entry["buffers"]],
+                }
+                for category, entry in categories.items()
+            }
+            for environment, categories in environments.items()
+        }
+        header = {
+            "version": KEYWORD_INDEX_VERSION,
+            "digest": source_digest(yaml_path),
+            "max_edits": max_edits,
+            "canonical": canonical,
+            "environments": shifted,
+        }
+        encoded: bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+        return encoded
+
+    # * the offsets in the header depend on its own size, which they hardly change
+    base = 0
+    while True:
+        header = header_for(base)
+        end = len(MAGIC) + _HEADER_SIZE.size + len(header)
+        if base >= end:
+            break
+        base = end + (-end % ALIGNMENT)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_SIZE.pack(len(header)))
+        f.write(header)
+        f.write(b"\x00" * (base - end))
+        f.write(blob)
+    # * a half written index is never picked up
+    os.replace(tmp, path)
+
+
+__all__ = [
+    "KeywordIndex",
+    "KeywordIndexError",
+    "compile_keyword_index",
+    "load_keyword_index",
+    "source_digest",
+]
+
+
+if __name__ == "__main__":
+    compile_keyword_index(*sys.argv[1:3])
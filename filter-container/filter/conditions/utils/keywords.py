@@ -0,0 +1,555 @@
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from collections import deque
+from functools import lru_cache
+import re
+import os
+
+from . import Buffer
+from .canonical import canonical_keyword, canonicalize, keyword_canonicalize
+from .lazy import LazyModule
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = LazyModule("numpy")
+
+# * up to this many keywords, search runs the keyword trie as a regular expression.
+# * The regex engine tries the branches of a trie node one by one, so it slows
+# * down with the number of keywords. Past this, search uses the gram filter
+REGEX_MAX_KEYWORDS = 64
+
+# * search looks at the text in windows of this many bytes, which bounds the
+# * memory of the gram filter
+SEARCH_WINDOW_SIZE = 1 << 20
+
+# * number of bits of the gram filter's hash table
+GRAM_TABLE_BITS = 22
+_GRAM_HASH = 0x9E3779B97F4A7C15
+
+# * fuzzy matching is off unless KEYWORD_MAX_EDITS is set
+DEFAULT_KEYWORD_MAX_EDITS = 0
+
+# * keywords shorter than this are only matched exactly. With a couple of edits,
+# * a short keyword is close to too many ordinary words
+FUZZY_MIN_KEYWORD_LENGTH = 5
+
+# * how many distinct tokens the fuzzy index remembers the verdict of
+FUZZY_TOKEN_CACHE_SIZE = 1 << 16
+
+# * bytes that tokens are made of: ascii letters, digits, _ and anything non-ascii,
+# * i.e. the bytes of utf-8 encoded letters
+WORD_BYTES = rb"0-9A-Za-z_\x80-\xff"
+WORD_CHARS = b"".join(re.findall(rb"[%s]" % WORD_BYTES, bytes(range(256))))
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over a set of keywords. It finds every occurrence
+    of every keyword, anywhere in the text (so "fractals123" contains "fractals"),
+    in a single pass over the text, at a cost that depends on the length of the
+    text and not on how many keywords there are. Keywords are matched as utf-8
+    bytes, so the text can be a str or raw bytes (e.g. a block of a file), and no
+    decoding is needed.
+
+    Build it once per keyword list (see keyword_automaton) and use it for every
+    cell / chunk.
+
+    iter_matches walks the automaton in python and reports all of the matches.
+    search only needs the first one and has two vectorized fast paths, see
+    _search_window.
+
+    With canonical, the automaton is built from the canonical forms of the
+    keywords, and search matches them on the canonical form of the text (see
+    utils.canonical), which it computes once for the whole text. The keywords are
+    still reported as they were given.
+    """
+
+    def __init__(
+        self, keywords: Iterable[str], max_edits: int = 0, canonical: bool = False
+    ) -> None:
+        self.keywords: List[str] = sorted({k for k in keywords if k})
+        self.max_edits = max_edits
+        self.canonical = canonical
+        # * what is matched, and the keyword each form stands for
+        self._original: Dict[str, str] = {}
+        for keyword in self.keywords:
+            form = canonical_keyword(keyword) if canonical else keyword
+            if form:
+                self._original.setdefault(form, keyword)
+        self._forms = sorted(self._original)
+        encoded = [k.encode("utf-8") for k in self._forms]
+        self.max_length = max((len(k) for k in encoded), default=0)
+
+        # * goto function, failure links and the keywords that end in each state.
+        # * State 0 is the root, symbols are byte values
+        self._goto: List[Dict[int, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+        # * a keyword ends in the state itself, not only through a failure link
+        self._terminal: List[Optional[str]] = [None]
+        self._build(encoded)
+
+        # * keywords the gram filter can't take are left to the regex
+        self._gram_size = 8 if all(len(k) >= 8 for k in encoded) else 4
+        if len(encoded) <= REGEX_MAX_KEYWORDS:
+            regex_keywords, gram_keywords = encoded, []
+        else:
+            regex_keywords = [k for k in encoded if len(k) < self._gram_size]
+            gram_keywords = [k for k in encoded if len(k) >= self._gram_size]
+
+        self._pattern = _trie_regex(regex_keywords) if regex_keywords else None
+        self._gram_table = (
+            self._build_gram_table(gram_keywords) if gram_keywords else None
+        )
+
+        self._fuzzy: Optional[FuzzyKeywordIndex] = None
+        if max_edits > 0:
+            fuzzy = [k for k in self._forms if len(k) >= FUZZY_MIN_KEYWORD_LENGTH]
+            index = FuzzyKeywordIndex(fuzzy, max_edits)
+            self._fuzzy = index if index.keywords else None
+
+    @property
+    def fuzzy(self) -> bool:
+        """Whether search also finds tokens within max_edits of a keyword"""
+        return self._fuzzy is not None
+
+    @property
+    def max_token_length(self) -> int:
+        """Longest token that may be within max_edits of a keyword"""
+        return self._fuzzy.longest if self._fuzzy is not None else 0
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def __bool__(self) -> bool:
+        return bool(self.keywords)
+
+    def contains_any(self, chars: str) -> bool:
+        """Whether any keyword contains any of chars, e.g. the csv delimiters"""
+        return any(c in k for k in self._forms for c in chars)
+
+    def may_occur_in(self, chars: str) -> bool:
+        """Whether a keyword may be found in text that is made of chars only, e.g.
+        in a number. In fuzzy mode, a keyword may have up to max_edits characters
+        that are not among them.
+        """
+        if self.canonical:
+            chars = canonicalize(chars).decode("utf-8")
+        allowed = set(chars)
+        return any(
+            sum(c not in allowed for c in k) <= self.max_edits for k in self._forms
+        )
+
+    def canonicalize(self, text: Union[str, Buffer]) -> Buffer:
+        """The text as search matches it: its canonical form with canonical, the
+        text itself (as bytes) without
+        """
+        return canonicalize(text) if self.canonical else _as_bytes(text)
+
+    def search(
+        self, text: Union[str, Buffer], canonicalized: bool = False
+    ) -> Optional[str]:
+        """First (leftmost) keyword occurrence in text. In fuzzy mode, when there is
+        none, the first token of the text that is within max_edits of a keyword
+        (see FuzzyKeywordIndex). The edges of the text count as token boundaries.
+
+        Args:
+            text (Union[str, Buffer]): text, or raw utf-8 bytes, to look in
+            canonicalized (bool, optional): whether text already went through
+            canonicalize, e.g. a block that is searched in pieces. Defaults to False.
+
+        Returns:
+            Optional[str]: the keyword, None if there is none
+        """
+        if not self._forms:
+            return None
+
+        data = _as_bytes(text) if canonicalized else self.canonicalize(text)
+        overlap = self.max_length - 1
+
+        for start in range(0, max(len(data) - overlap, 1), SEARCH_WINDOW_SIZE):
+            window = data[start : start + SEARCH_WINDOW_SIZE + overlap]
+            keyword = self._search_window(window)
+            if keyword is not None:
+                return keyword
+
+        if self._fuzzy is not None:
+            keyword = self._fuzzy.search(data)
+            return self._original[keyword] if keyword is not None else None
+        return None
+
+    def iter_matches(self, text: Union[str, Buffer]) -> Iterator[Tuple[int, str]]:
+        """All (exact) occurrences of the keywords in text, overlapping ones
+        included, in the order in which they end. The text is not canonicalized,
+        offsets are those of the text as it is given.
+
+        Args:
+            text (Union[str, Buffer]): text, or raw utf-8 bytes, to look in
+
+        Yields:
+            Tuple[int, str]: offset of the occurrence in (utf-8) bytes and the keyword
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+
+        for i, symbol in enumerate(_as_bytes(text)):
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+
+            for keyword in out[state]:
+                yield i - len(keyword.encode("utf-8")) + 1, self._original[keyword]
+
+    def match_at(self, data: Buffer, pos: int) -> Optional[str]:
+        """The shortest keyword that starts at pos in data, if any"""
+        goto, terminal = self._goto, self._terminal
+        state = 0
+
+        for symbol in data[pos : pos + self.max_length]:
+            state = goto[state].get(symbol, -1)
+            if state < 0:
+                return None
+            if terminal[state] is not None:
+                return self._original[terminal[state]]  # type: ignore
+
+        return None
+
+    def _search_window(self, window: Buffer) -> Optional[str]:
+        """With a few keywords, the regular expression of the trie is the fastest.
+        With many, every gram (4 or 8 bytes) of the window is hashed into a table
+        of the keywords' first grams, using numpy views of the window at every
+        offset, and only the positions that hit the table are checked with the
+        trie. Both run in C over the whole window.
+        """
+        best: Optional[Tuple[int, str]] = None
+
+        if self._pattern is not None:
+            match = self._pattern.search(window)
+            if match:
+                best = (match.start(), self._original[match.group().decode("utf-8")])
+
+        if self._gram_table is not None:
+            limit = len(window) if best is None else best[0]
+            for pos in self._gram_candidates(window[: limit + self.max_length]):
+                if pos >= limit:
+                    break
+                keyword = self.match_at(window, int(pos))
+                if keyword is not None:
+                    best = (int(pos), keyword)
+                    break
+
+        return best[1] if best else None
+
+    def _gram_candidates(self, window: Buffer) -> "np.ndarray":
+        assert self._gram_table is not None
+        m = self._gram_size
+        dtype = np.dtype("<u4") if m == 4 else np.dtype("<u8")
+        shift = np.uint64(64 - GRAM_TABLE_BITS)
+        multiplier = np.uint64(_GRAM_HASH)
+        candidates = []
+
+        with np.errstate(over="ignore"):
+            for k in range(m):
+                count = (len(window) - k) // m
+                if count <= 0:
+                    continue
+                grams = np.frombuffer(window, dtype=dtype, count=count, offset=k)
+                hashes = (grams.astype(np.uint64) * multiplier) >> shift
+                candidates.append(np.flatnonzero(self._gram_table[hashes]) * m + k)
+
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(candidates))
+
+    def _build_gram_table(self, keywords: List[bytes]) -> "np.ndarray":
+        m = self._gram_size
+        grams = np.array(
+            [int.from_bytes(k[:m], "little") for k in keywords], dtype=np.uint64
+        )
+        table = np.zeros(1 << GRAM_TABLE_BITS, dtype=bool)
+        with np.errstate(over="ignore"):
+            table[
+                (grams * np.uint64(_GRAM_HASH)) >> np.uint64(64 - GRAM_TABLE_BITS)
+            ] = True
+        return table
+
+    def _build(self, keywords: List[bytes]) -> None:
+        for keyword, text in zip(keywords, self._forms):
+            state = 0
+            for symbol in keyword:
+                nxt = self._goto[state].get(symbol)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._terminal.append(None)
+                    self._goto[state][symbol] = nxt
+                state = nxt
+            self._out[state] = (text,)
+            self._terminal[state] = text
+
+        # * failure links in breadth first order, so that the link of a state
+        # * points to a state that already has its own
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and symbol not in self._goto[fail]:
+                    fail = self._fail[fail]
+                link = self._goto[fail].get(symbol, 0)
+                self._fail[nxt] = link if link != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+
+class FuzzyKeywordIndex:
+    """Finds the tokens of a text that are within a bounded (Levenshtein) edit
+    distance of a keyword, e.g. fr4ctals for fractals, with a SymSpell-style
+    deletion dictionary: every string that is at most max_edits deletions away
+    from a keyword points to the keyword. Two strings are within max_edits of each
+    other only if they have such a deletion in common, so a token is looked up
+    with its own deletions, about len(token) ** max_edits dictionary lookups,
+    whatever the number of keywords. The few candidates are then verified.
+
+    Tokens are runs of WORD_BYTES, so only keywords made of them are matched
+    fuzzily, and tokens that are too short or too long to be close to any keyword
+    are skipped. Looking every token up would be slow, so the text is searched
+    for the pieces of the keywords first: when a keyword is cut into
+    max_edits + 1 pieces, max_edits edits leave at least one of them whole. Only
+    the tokens around a piece are looked up, which keeps the search at the speed
+    of a regular expression. Each distinct token is looked up once, and the
+    verdicts of the last FUZZY_TOKEN_CACHE_SIZE of them are kept, since outputs
+    repeat the same words over and over. Distances are counted in utf-8 bytes.
+    """
+
+    def __init__(self, keywords: Iterable[str], max_edits: int) -> None:
+        if max_edits < 1:
+            raise ValueError(f"max edits has to be positive, got: {max_edits}")
+
+        word = re.compile(rb"[%s]+" % WORD_BYTES)
+        self.keywords: List[str] = sorted(
+            {k for k in keywords if word.fullmatch(k.encode("utf-8"))}
+        )
+        self.max_edits = max_edits
+        self._encoded = [k.encode("utf-8") for k in self.keywords]
+        self._deletes: Dict[bytes, List[int]] = {}
+        self._cache: Dict[bytes, Optional[str]] = {}
+
+        for i, keyword in enumerate(self._encoded):
+            for deletion in _deletions(keyword, max_edits):
+                self._deletes.setdefault(deletion, []).append(i)
+
+        lengths = [len(k) for k in self._encoded] or [1]
+        # * tokens longer than this are never close to a keyword
+        self.longest = max(lengths) + max_edits
+        self._shortest = max(1, min(lengths) - max_edits)
+
+        pieces: Set[bytes] = set()
+        for keyword in self._encoded:
+            cuts = [len(keyword) * i // (max_edits + 1) for i in range(max_edits + 2)]
+            pieces.update(keyword[a:b] for a, b in zip(cuts, cuts[1:]) if b > a)
+        self._pieces = _trie_regex(sorted(pieces)) if pieces else None
+
+    def search(self, text: Union[str, Buffer]) -> Optional[str]:
+        """Keyword of the first token of text that is within max_edits of one
+
+        Args:
+            text (Union[str, Buffer]): text, or raw utf-8 bytes, to look in
+
+        Returns:
+            Optional[str]: the keyword, None if no token is close to any
+        """
+        if self._pieces is None:
+            return None
+
+        data = _as_bytes(text)
+        longest = self.longest
+        seen: Set[bytes] = set()
+
+        for match in self._pieces.finditer(data):
+            start, end = match.span()
+            # * the token around the piece
+            before = bytes(data[max(0, start - longest) : start])
+            after = bytes(data[end : end + longest])
+            start -= len(before) - len(before.rstrip(WORD_CHARS))
+            end += len(after) - len(after.lstrip(WORD_CHARS))
+
+            if not self._shortest <= end - start <= longest:
+                # * too long tokens may just have been cut by the window above
+                continue
+            token = bytes(data[start:end])
+            if token in seen:
+                continue
+            seen.add(token)
+
+            keyword = self.lookup(token)
+            if keyword is not None:
+                return keyword
+
+        return None
+
+    def lookup(self, token: bytes) -> Optional[str]:
+        """The closest keyword within max_edits of the token, if any"""
+        try:
+            return self._cache[token]
+        except KeyError:
+            pass
+
+        candidates: Set[int] = set()
+        for deletion in _deletions(token, self.max_edits):
+            candidates.update(self._deletes.get(deletion, ()))
+
+        best: Optional[Tuple[int, str]] = None
+        for i in sorted(candidates):
+            distance = _edit_distance(token, self._encoded[i], self.max_edits)
+            if distance is not None and (best is None or distance < best[0]):
+                best = (distance, self.keywords[i])
+
+        keyword = best[1] if best else None
+        if len(self._cache) >= FUZZY_TOKEN_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[token] = keyword
+        return keyword
+
+
+def _deletions(word: bytes, max_edits: int) -> Set[bytes]:
+    """word and every string that is at most max_edits deletions away from it"""
+    result = {word}
+    frontier = {word}
+
+    for _ in range(max_edits):
+        frontier = {w[:i] + w[i + 1 :] for w in frontier for i in range(len(w))}
+        frontier -= result
+        result |= frontier
+
+    return result
+
+
+def _edit_distance(a: bytes, b: bytes, max_edits: int) -> Optional[int]:
+    """Levenshtein distance of a and b, None if it is more than max_edits"""
+    if abs(len(a) - len(b)) > max_edits:
+        return None
+
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+            )
+        if min(current) > max_edits:
+            return None
+        previous = current
+
+    return previous[-1] if previous[-1] <= max_edits else None
+
+
+def _trie_regex(keywords: List[bytes]) -> "re.Pattern[bytes]":
+    """Compiles the keywords into a regular expression shaped like their trie,
+    e.g. (?:agri[123]|fractals), that matches the shortest keyword at a position.
+    """
+    trie: Dict[int, dict] = {}
+    for keyword in keywords:
+        node = trie
+        for symbol in keyword:
+            node = node.setdefault(symbol, {})
+        node[-1] = {}
+
+    def compile_node(node: Dict[int, dict]) -> bytes:
+        leaves: List[bytes] = []
+        branches: List[bytes] = []
+
+        for symbol, child in sorted(node.items()):
+            if symbol < 0:
+                continue
+            escaped = re.escape(bytes([symbol]))
+            if -1 in child:
+                # * a keyword ends here, longer ones can't match any earlier
+                leaves.append(escaped)
+            else:
+                branches.append(escaped + compile_node(child))
+
+        if len(leaves) == 1:
+            branches.append(leaves[0])
+        elif leaves:
+            branches.append(b"[" + b"".join(leaves) + b"]")
+
+        if len(branches) == 1:
+            return branches[0]
+        return b"(?:" + b"|".join(branches) + b")"
+
+    return re.compile(compile_node(trie))
+
+
+def _as_bytes(text: Union[str, Buffer]) -> Buffer:
+    if isinstance(text, str):
+        return text.encode("utf-8", "surrogatepass")
+    if isinstance(text, bytes):
+        return text
+    # * blocks of a file are searched in place
+    return memoryview(text).cast("B")
+
+
+def keyword_max_edits() -> int:
+    """Edit distance of fuzzy keyword matching, set KEYWORD_MAX_EDITS to switch
+    it on. 0, the default, only matches keywords exactly.
+    """
+    return max(0, int(os.getenv("KEYWORD_MAX_EDITS", DEFAULT_KEYWORD_MAX_EDITS)))
+
+
+# * automata that were built ahead of time, see utils.keyword_index
+_prebuilt: Dict[Tuple[Tuple[str, ...], int, bool], KeywordAutomaton] = {}
+
+
+def add_prebuilt_automaton(automaton: KeywordAutomaton) -> None:
+    """Lets keyword_automaton hand out an automaton that was built ahead of time
+    (see utils.keyword_index) instead of building it again
+    """
+    key = (tuple(automaton.keywords), automaton.max_edits, automaton.canonical)
+    _prebuilt[key] = automaton
+
+
+@lru_cache(maxsize=32)  # type: ignore
+def _cached_automaton(
+    keywords: Tuple[str, ...], max_edits: int, canonical: bool
+) -> KeywordAutomaton:
+    return KeywordAutomaton(keywords, max_edits, canonical)
+
+
+def keyword_automaton(keywords: Iterable[str]) -> KeywordAutomaton:
+    """The automaton of the keywords, built once per distinct keyword list (and
+    KEYWORD_MAX_EDITS and KEYWORD_CANONICALIZE)
+
+    Args:
+        keywords (Iterable[str]): keywords of the data categories
+
+    Returns:
+        KeywordAutomaton: automaton matching any of them
+    """
+    key = (tuple(sorted(set(keywords))), keyword_max_edits(), keyword_canonicalize())
+    prebuilt = _prebuilt.get(key)
+    if prebuilt is not None:
+        return prebuilt
+    automaton: KeywordAutomaton = _cached_automaton(*key)
+    return automaton
+
+
+__all__ = [
+    "WORD_CHARS",
+    "KeywordAutomaton",
+    "FuzzyKeywordIndex",
+    "add_prebuilt_automaton",
+    "keyword_automaton",
+    "keyword_max_edits",
+]
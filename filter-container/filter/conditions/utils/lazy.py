@@ -0,0 +1,90 @@
+from typing import Any, Dict, Optional
+from types import ModuleType
+import importlib
+import logging
+import time
+import sys
+import os
+
+l = logging.getLogger("[lazy]")
+
+# * module -> seconds it took to import it, for the startup report
+IMPORT_TIMES: Dict[str, float] = {}
+
+
+def timed_import(name: str) -> ModuleType:
+    """Imports a module and records how long it took, if it was not imported yet"""
+    imported = name in sys.modules
+
+    # ! always through import_module, a module that is in sys.modules may still be
+    # ! being imported by another thread. import_module waits for it to finish
+    start = time.perf_counter()
+    module: ModuleType = importlib.import_module(name)
+    if not imported:
+        IMPORT_TIMES.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+class LazyModule:
+    """Stands in for a heavy module (numpy) until one of its attributes is used,
+    and imports it then. A pod whose job fails a cheap condition never pays for
+    it. The import lock makes the first use safe from several threads at once.
+    Afterwards the attributes of the module are copied over, so that using them
+    costs no more than using the module itself.
+
+        if TYPE_CHECKING:
+            import numpy as np
+        else:
+            np = LazyModule("numpy")
+    """
+
+    def __init__(self, name: str) -> None:
+        self.__name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        name = self.__name
+        imported = name in sys.modules
+        module = timed_import(name)
+        if not imported and name in IMPORT_TIMES:
+            l.debug(
+                f"imported {name} on first use in {IMPORT_TIMES[name] * 1000:.1f} ms"
+            )
+        self.__dict__.update(vars(module))
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.__name}>"
+
+
+def process_age() -> Optional[float]:
+    """Seconds since the process started, interpreter startup included. None
+    where /proc is not available
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # * the command may have spaces in it, it ends with the last )
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return float(time.clock_gettime(time.CLOCK_BOOTTIME) - started)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def startup_report() -> Dict[str, Any]:
+    """How long the process took to get going: its age and the import times
+    that timed_import and LazyModule recorded, in milliseconds
+    """
+    age = process_age()
+    return {
+        "process_age_ms": round(age * 1000, 1) if age is not None else None,
+        "imports_ms": {k: round(v * 1000, 1) for k, v in IMPORT_TIMES.items()},
+    }
+
+
+__all__ = [
+    "IMPORT_TIMES",
+    "LazyModule",
+    "process_age",
+    "startup_report",
+    "timed_import",
+]
@@ -0,0 +1,195 @@
+from typing import Any, Dict, Iterator, Optional, Set
+from contextlib import contextmanager
+from threading import Lock, Thread, Event
+import tracemalloc
+import os
+
+# * seconds between two looks at the memory of the pod while conditions run
+DEFAULT_MEMORY_SAMPLE_INTERVAL = 0.01
+
+# * MB of RSS a condition may run the pod up to before it is failed. 0 is no limit
+DEFAULT_MEMORY_CEILING_MB = 0
+
+# * tracemalloc slows python allocations down a lot, it is off unless MEMORY_TRACE
+# * is set
+DEFAULT_MEMORY_TRACE = "0"
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1 << 20) if hasattr(os, "sysconf") else 0.0
+
+
+def memory_sample_interval() -> float:
+    return max(
+        1e-3, float(os.getenv("MEMORY_SAMPLE_INTERVAL", DEFAULT_MEMORY_SAMPLE_INTERVAL))
+    )
+
+
+def memory_ceiling_mb() -> float:
+    return float(os.getenv("MEMORY_CEILING_MB", DEFAULT_MEMORY_CEILING_MB))
+
+
+def memory_trace() -> bool:
+    """Whether the python allocations are traced (tracemalloc) as well, set
+    MEMORY_TRACE=1 to switch it on
+    """
+    flag: str = os.getenv("MEMORY_TRACE", DEFAULT_MEMORY_TRACE)
+    return flag != "0"
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident memory of this process right now, None where /proc is not there"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryWatch:
+    """What the memory of the pod did while a condition ran, see watching.
+
+    RSS is that of the whole process, so when conditions run at the same time
+    their peaks are those of all of them together. The same goes for the traced
+    (python and numpy) allocations, unless the condition ran on its own
+    (overlapped is False), then its traced peak is exact (on 3.9+, before that it is
+    sampled too). CONDITION_WORKERS=1 runs the conditions one at a time.
+    """
+
+    def __init__(self, ceiling_mb: float = 0.0, cancel: Any = None) -> None:
+        self.ceiling_mb = ceiling_mb
+        self.rss_start_mb = current_rss_mb()
+        self.rss_peak_mb = self.rss_start_mb
+        self.traced_start_mb: Optional[float] = None
+        self.traced_peak_mb: Optional[float] = None
+        self.overlapped = False
+        self.over_ceiling = False
+        # * set when the ceiling is crossed, e.g. the cancel event of the runner
+        self._cancel = cancel
+
+        if tracemalloc.is_tracing():
+            self.traced_start_mb = tracemalloc.get_traced_memory()[0] / (1 << 20)
+            self.traced_peak_mb = self.traced_start_mb
+
+    def sample(self, rss_mb: Optional[float], traced_mb: Optional[float]) -> None:
+        if rss_mb is not None:
+            self.rss_peak_mb = max(self.rss_peak_mb or 0.0, rss_mb)
+        if traced_mb is not None and self.traced_peak_mb is not None:
+            self.traced_peak_mb = max(self.traced_peak_mb, traced_mb)
+
+        if (
+            self.ceiling_mb > 0
+            and rss_mb is not None
+            and rss_mb > self.ceiling_mb
+            and not self.over_ceiling
+        ):
+            self.over_ceiling = True
+            if self._cancel is not None and hasattr(self._cancel, "set"):
+                self._cancel.set()
+
+    def report(self) -> Dict[str, Any]:
+        def mb(value: Optional[float]) -> Optional[float]:
+            return round(value, 1) if value is not None else None
+
+        return {
+            "rss_start_mb": mb(self.rss_start_mb),
+            "rss_peak_mb": mb(self.rss_peak_mb),
+            "traced_start_mb": mb(self.traced_start_mb),
+            "traced_peak_mb": mb(self.traced_peak_mb),
+            "overlapped": self.overlapped,
+            "ceiling_mb": self.ceiling_mb or None,
+            "over_ceiling": self.over_ceiling,
+        }
+
+
+class _Watcher:
+    """A single thread that samples the memory for all of the watches that are
+    active, and only while there are any
+    """
+
+    def __init__(self) -> None:
+        self.watches: Set[MemoryWatch] = set()
+        self.lock = Lock()
+        self._thread: Optional[Thread] = None
+        self._stop = Event()
+
+    def add(self, watch: MemoryWatch) -> None:
+        with self.lock:
+            self.watches.add(watch)
+            if len(self.watches) > 1:
+                for w in self.watches:
+                    w.overlapped = True
+            if self._thread is None:
+                self._stop = Event()
+                self._thread = Thread(
+                    target=self._run, args=(self._stop,), name="memory", daemon=True
+                )
+                self._thread.start()
+
+    def remove(self, watch: MemoryWatch) -> None:
+        with self.lock:
+            self.watches.discard(watch)
+            if not self.watches and self._thread is not None:
+                self._stop.set()
+                self._thread = None
+
+    def sample(self) -> None:
+        rss = current_rss_mb()
+        traced = (
+            tracemalloc.get_traced_memory()[0] / (1 << 20)
+            if tracemalloc.is_tracing()
+            else None
+        )
+        with self.lock:
+            watches = list(self.watches)
+        for watch in watches:
+            watch.sample(rss, traced)
+
+    def _run(self, stop: Event) -> None:
+        interval = memory_sample_interval()
+        while not stop.wait(interval):
+            self.sample()
+
+
+_watcher = _Watcher()
+
+
+@contextmanager  # type: ignore
+def watching(cancel: Any = None) -> Iterator[MemoryWatch]:
+    """Watches the memory of the pod while in the block. If the RSS goes over
+    MEMORY_CEILING_MB, the watch is marked over_ceiling and cancel (e.g. the
+    cancel event of the runner) is set, so that the condition stops before the
+    pod gets OOM-killed.
+
+        with watching(cancel) as watch:
+            condition()
+        watch.report()
+    """
+    watch = MemoryWatch(memory_ceiling_mb(), cancel)
+    # ! reset_peak is 3.9+, before that the traced peak is only sampled, like the
+    # ! RSS
+    exact = (
+        not _watcher.watches
+        and tracemalloc.is_tracing()
+        and hasattr(tracemalloc, "reset_peak")
+    )
+    if exact:
+        # * the peak since now is that of this block, as long as it runs alone
+        tracemalloc.reset_peak()
+
+    _watcher.add(watch)
+    try:
+        yield watch
+    finally:
+        # * one last look, blocks shorter than the interval are not missed
+        _watcher.sample()
+        _watcher.remove(watch)
+        if exact and tracemalloc.is_tracing() and not watch.overlapped:
+            watch.traced_peak_mb = tracemalloc.get_traced_memory()[1] / (1 << 20)
+
+
+__all__ = [
+    "MemoryWatch",
+    "current_rss_mb",
+    "memory_ceiling_mb",
+    "memory_trace",
+    "watching",
+]
@@ -0,0 +1,205 @@
+from typing import Any, Dict, Iterator, Optional
+from contextlib import contextmanager
+from threading import Lock, local
+import resource
+import time
+import os
+
+from .cancel import get_cancel_event
+from .memory import MemoryWatch, watching
+
+# * bytes in a MB of the report
+MB = 1 << 20
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process in MB. ru_maxrss carries the peak of the parent
+    over across exec, VmHWM starts from scratch
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # * kilobytes on linux
+    return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+class ConditionMetrics:
+    """What a condition (or the scan engine) cost: the time it took, the CPU time
+    of the threads that worked for it, and the bytes it read, per file.
+
+    The runner makes one for every condition and makes it the current one (see
+    tracking) of the thread that checks the condition. BlockReader records its
+    reads against the current metrics, and the pools the conditions fan work out
+    to (utils.parallel, utils.csv_shards) carry it over to their workers, so that
+    the work done there counts too.
+
+    Reads are grouped into INPUTS, OUTPUTS and other by report, once, rather than
+    for every read. What the memory of the pod did while the condition ran is
+    watched as well (see utils.memory).
+    """
+
+    def __init__(self, name: str = "") -> None:
+        self.name = name
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        # * process wide, when the condition was done
+        self.peak_rss_mb: Optional[float] = None
+        # * see MemoryWatch.report, None until the condition is done
+        self.memory: Optional[Dict[str, Any]] = None
+        # * what the condition has to say about how it got to its verdict
+        self.details: Dict[str, Dict[str, Any]] = {}
+        self.reads: Dict[str, int] = {}
+        self._lock = Lock()
+
+    @property
+    def over_ceiling(self) -> bool:
+        """Whether the pod went over MEMORY_CEILING_MB while the condition ran"""
+        return bool(self.memory and self.memory["over_ceiling"])
+
+    def add_read(self, file_loc: str, n: int) -> None:
+        with self._lock:
+            self.reads[file_loc] = self.reads.get(file_loc, 0) + n
+
+    def add_detail(self, section: str, key: str, value: Any) -> None:
+        """Adds to the details of the report, e.g. how the verdict of a file came
+        about: add_detail("entropy_modes", file_loc, {...})
+        """
+        with self._lock:
+            self.details.setdefault(section, {})[key] = value
+
+    def add_cpu(self, seconds: float) -> None:
+        with self._lock:
+            self.cpu_seconds += seconds
+
+    def merge(self, other: "ConditionMetrics") -> None:
+        """Adds the CPU time, reads and details of other, e.g. of a worker process"""
+        with self._lock:
+            self.cpu_seconds += other.cpu_seconds
+            for file_loc, n in other.reads.items():
+                self.reads[file_loc] = self.reads.get(file_loc, 0) + n
+            for section, values in other.details.items():
+                self.details.setdefault(section, {}).update(values)
+
+    def report(
+        self, inputs: Optional[str] = None, outputs: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """The metrics as they go into the run report
+
+        Args:
+            inputs (Optional[str], optional): Defaults to the INPUTS env variable.
+            outputs (Optional[str], optional): Defaults to the OUTPUTS env variable.
+
+        Returns:
+            Dict[str, Any]: wall and CPU time, bytes read from INPUTS, OUTPUTS and
+            elsewhere, number of files read, MB/s over the wall time, peak RSS and
+            the memory the pod used while the condition ran, and the details
+        """
+        roots = {
+            "inputs": inputs if inputs is not None else os.getenv("INPUTS", ""),
+            "outputs": outputs if outputs is not None else os.getenv("OUTPUTS", ""),
+        }
+        roots = {k: os.path.join(os.path.abspath(v), "") for k, v in roots.items() if v}
+        bytes_read = {"inputs": 0, "outputs": 0, "other": 0}
+
+        with self._lock:
+            reads = dict(self.reads)
+            details = {k: dict(v) for k, v in self.details.items()}
+
+        for file_loc, n in reads.items():
+            path = os.path.abspath(file_loc)
+            where = next((k for k, r in roots.items() if path.startswith(r)), "other")
+            bytes_read[where] += n
+
+        total = sum(bytes_read.values())
+        return {
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "bytes_read": bytes_read,
+            "files_read": len(reads),
+            "mb_per_s": (
+                round(total / MB / self.wall_seconds, 3)
+                if self.wall_seconds > 0
+                else None
+            ),
+            "peak_rss_mb": self.peak_rss_mb,
+            "memory": self.memory,
+            "details": details,
+        }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # * sent back from worker processes, the lock stays behind
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+_state = local()
+
+
+def get_metrics() -> Optional[ConditionMetrics]:
+    """Metrics of whatever runs on the current thread, None outside of a condition"""
+    return getattr(_state, "metrics", None)
+
+
+def record_read(file_loc: str, n: int) -> None:
+    """Records n bytes read from the file against the current metrics, if any"""
+    metrics = get_metrics()
+    if metrics is not None and n:
+        metrics.add_read(file_loc, n)
+
+
+@contextmanager  # type: ignore
+def tracking(
+    metrics: Optional[ConditionMetrics], wall: bool = False
+) -> Iterator[Optional[ConditionMetrics]]:
+    """Makes metrics the current metrics of the thread and adds the CPU time the
+    thread spends in the block to it. With wall=True, the wall time too, and the
+    memory of the pod is watched while in the block (see utils.memory.watching);
+    crossing MEMORY_CEILING_MB sets the cancel event of the thread. Does nothing
+    with None, so pools can carry over whatever their caller had.
+
+        with tracking(metrics, wall=True):
+            condition()
+    """
+    if metrics is None:
+        yield None
+        return
+
+    if wall:
+        watch: Optional[MemoryWatch] = None
+        start = time.perf_counter()
+        try:
+            with watching(get_cancel_event()) as watch, tracking(metrics) as tracked:
+                yield tracked
+        finally:
+            metrics.wall_seconds += time.perf_counter() - start
+            metrics.peak_rss_mb = round(peak_rss_mb(), 1)
+            if watch is not None:
+                metrics.memory = watch.report()
+        return
+
+    previous = get_metrics()
+    _state.metrics = metrics
+    cpu = time.thread_time()
+    try:
+        yield metrics
+    finally:
+        metrics.add_cpu(time.thread_time() - cpu)
+        _state.metrics = previous
+
+
+__all__ = [
+    "ConditionMetrics",
+    "get_metrics",
+    "peak_rss_mb",
+    "record_read",
+    "tracking",
+]
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple, TypeVar
+from threading import Event
+from math import ceil
+import multiprocessing
+import multiprocessing.context
+import logging
+import os
+
+from .cancel import (
+    AnyEvent,
+    Cancelled,
+    get_cancel_event,
+    is_cancelled,
+    raise_if_cancelled,
+    set_cancel_event,
+)
+from .metrics import get_metrics, tracking
+
+l = logging.getLogger("[parallel]")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# * how the pools of worker processes start their workers. fork would copy the
+# * locks held by the other threads of the filter (logging, read-ahead, the
+# * conditions, the memory watcher) into the workers, where nobody would ever
+# * release them. A forkserver would hand its workers the environment it was
+# * started with, rather than the current one
+PROCESS_START_METHOD = "spawn"
+
+# * cgroup v2 and v1 CPU quotas, i.e. what `docker run --cpus` / k8s limits set
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    try:
+        with open(CGROUP_V2_CPU_MAX) as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open(CGROUP_V1_CPU_QUOTA) as f:
+            quota = f.read().strip()
+        with open(CGROUP_V1_CPU_PERIOD) as f:
+            period = f.read().strip()
+        if int(quota) <= 0:
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """Number of CPUs the container may use. os.cpu_count() reports the CPUs of
+    the node, which is way more than we get on a shared filter node.
+
+    Returns:
+        int: CPUs in the affinity mask, capped by the cgroup CPU quota
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, ceil(quota)))
+
+    return cpus
+
+
+def file_workers() -> int:
+    """Size of the pools the conditions fan their files out to. Set FILE_WORKERS
+    to override it, FILE_WORKERS=1 processes the files one after another.
+    """
+    return max(1, int(os.getenv("FILE_WORKERS", available_cpus())))
+
+
+def process_context() -> multiprocessing.context.BaseContext:
+    """Context for the pools of worker processes, see PROCESS_START_METHOD. The
+    workers import what they run, so it has to live at module level
+    """
+    return multiprocessing.get_context(PROCESS_START_METHOD)
+
+
+def ordered_map(
+    fn: Callable[[T], R],
+    items: Iterable[T],
+    is_failure: Callable[[R], bool],
+    max_workers: Optional[int] = None,
+) -> Iterator[Tuple[T, R]]:
+    """Applies fn to the items on a bounded pool of threads and yields the results
+    in the order of the items, stopping after the first failing one. As soon as
+    any item fails, the items that are still being processed are cancelled (they
+    raise Cancelled at their next cancellation point) and the ones that have not
+    started yet are skipped. The workers are cancelled with the calling thread,
+    too, e.g. when the runner cancels the condition.
+
+    Args:
+        fn (Callable[[T], R]): function to apply, e.g. a per-file check
+        items (Iterable[T]): items to apply it to, e.g. paths of the output files
+        is_failure (Callable[[R], bool]): tells a failing result
+        max_workers (Optional[int], optional): defaults to file_workers()
+
+    Yields:
+        Tuple[T, R]: items and their results, in order, up to and including the first
+        failing one. Items that were cancelled because of a later failure are left out
+    """
+    items = list(items)
+    max_workers = min(max_workers or file_workers(), len(items))
+
+    if max_workers <= 1:
+        for item in items:
+            raise_if_cancelled()
+            result = fn(item)
+            yield item, result
+            if is_failure(result):
+                return
+        return
+
+    stop = Event()
+    cancel = AnyEvent(get_cancel_event(), stop)
+    # * the work of the pool counts against the condition that fans it out
+    metrics = get_metrics()
+
+    def run(item: T) -> R:
+        set_cancel_event(cancel)
+        try:
+            with tracking(metrics):
+                raise_if_cancelled()
+                result = fn(item)
+        finally:
+            set_cancel_event(None)
+        if is_failure(result):
+            stop.set()
+        return result
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="file")
+    futures = [(item, pool.submit(run, item)) for item in items]
+
+    try:
+        for item, future in futures:
+            try:
+                result = future.result()
+            except Cancelled:
+                if stop.is_set() and not is_cancelled():
+                    # * cancelled because a later item failed, go and get it
+                    continue
+                raise
+            yield item, result
+            if is_failure(result):
+                return
+    finally:
+        stop.set()
+        for _, future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+__all__ = ["available_cpus", "file_workers", "ordered_map", "process_context"]
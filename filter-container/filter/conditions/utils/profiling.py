@@ -0,0 +1,209 @@
+from typing import Counter, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from threading import Event, Thread, get_ident
+from types import FrameType
+import collections
+import tempfile
+import cProfile
+import logging
+import marshal
+import time
+import sys
+import os
+
+from . import is_in_outputs
+
+l = logging.getLogger("[profiling]")
+
+# * profiling is off unless PROFILE is set to one of PROFILE_MODES
+DEFAULT_PROFILE = ""
+PROFILE_MODES = ("deterministic", "sampling")
+
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), "filter-diagnostics")
+
+# * seconds between two samples of the sampling profiler
+DEFAULT_PROFILE_INTERVAL = 0.005
+
+# * what pstats knows a function by: file, line of the definition, name
+FunctionKey = Tuple[str, int, str]
+
+
+def profile_mode() -> Optional[str]:
+    """How the conditions are profiled (see profiling), None if they are not.
+    PROFILE=deterministic uses cProfile, PROFILE=sampling looks at the stack every
+    PROFILE_INTERVAL seconds, which costs much less on hot loops.
+    """
+    mode: str = os.getenv("PROFILE", DEFAULT_PROFILE).strip().lower()
+    if mode in ("", "0"):
+        return None
+    if mode not in PROFILE_MODES:
+        l.warning(f"unknown PROFILE: {mode}, pick one of {PROFILE_MODES}")
+        return None
+    return mode
+
+
+def profile_dir() -> str:
+    path: str = os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR)
+    return path
+
+
+def profile_interval() -> float:
+    return max(1e-4, float(os.getenv("PROFILE_INTERVAL", DEFAULT_PROFILE_INTERVAL)))
+
+
+def _key(frame: FrameType) -> FunctionKey:
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class StackSampler:
+    """Samples the stack of a thread every interval seconds, from a thread of its
+    own, and counts how often every stack turned up. Enough to draw a flamegraph
+    (see collapsed) or to estimate where the time goes (see stats).
+
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        ...
+        sampler.stop()
+    """
+
+    def __init__(self, thread_id: int, interval: Optional[float] = None) -> None:
+        self.thread_id = thread_id
+        self.interval = interval or profile_interval()
+        # * stacks from the outermost to the innermost function
+        self.counts: Counter[Tuple[FunctionKey, ...]] = collections.Counter()
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_key(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[tuple(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """The stacks in the collapsed format of flamegraph.pl and speedscope:
+        a line per stack, the functions separated by ;, and the number of samples
+        """
+        lines = []
+        for stack, count in self.counts.most_common():
+            names = [
+                f"{name} ({os.path.basename(f)}:{line})" for f, line, name in stack
+            ]
+            lines.append(f"{';'.join(names)} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def stats(self) -> Dict[FunctionKey, Tuple[int, int, float, float, Dict]]:
+        """Estimates of the stats cProfile would have collected, in the format that
+        pstats reads. A sample counts as a call: the time of a function is the
+        number of samples it was on top of the stack in (tt) or anywhere in it (ct)
+        times the interval.
+        """
+        stats: Dict[FunctionKey, List] = {}
+        for stack, count in self.counts.items():
+            seconds = count * self.interval
+            for key in set(stack):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                entry[0] += count
+                entry[1] += count
+                entry[3] += seconds
+            stats[stack[-1]][2] += seconds
+            for caller, callee in set(zip(stack, stack[1:])):
+                edges = stats[callee][4]
+                n, _, tt, ct = edges.get(caller, (0, 0, 0.0, 0.0))
+                edges[caller] = (n + count, n + count, tt, ct + seconds)
+        return {key: tuple(entry) for key, entry in stats.items()}
+
+
+@contextmanager  # type: ignore
+def profiling(name: str) -> Iterator[None]:
+    """Profiles the current thread while in the block, if PROFILE is set (see
+    profile_mode), and writes <name>.pstats (for pstats, snakeviz) and
+    <name>.collapsed (for flamegraphs) into PROFILE_DIR, never into OUTPUTS.
+    Costs nothing more than reading PROFILE otherwise.
+
+    Only the current thread is profiled. Work it hands to the pools of
+    utils.parallel shows up as waiting for them, set FILE_WORKERS=1 to run that
+    work on the current thread instead.
+
+        with profiling(condition.name):
+            condition()
+    """
+    mode = profile_mode()
+    if mode is None:
+        yield
+        return
+
+    sampler = StackSampler(get_ident())
+    profiler: Optional[cProfile.Profile] = None
+
+    if mode == "deterministic":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # * e.g. another profiler is active already
+            l.warning(f"not profiling {name} with cProfile: {e}")
+            profiler = None
+
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        if profiler is not None:
+            profiler.disable()
+        _write_profile(name, sampler, profiler, time.perf_counter() - start)
+
+
+def _write_profile(
+    name: str,
+    sampler: StackSampler,
+    profiler: Optional[cProfile.Profile],
+    seconds: float,
+) -> None:
+    directory = profile_dir()
+    base = os.path.join(directory, name)
+
+    if is_in_outputs(directory):
+        l.error(f"not writing the profile of {name} into OUTPUTS: {directory}")
+        return
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        if profiler is not None:
+            profiler.dump_stats(f"{base}.pstats")
+        else:
+            with open(f"{base}.pstats", "wb") as f:
+                marshal.dump(sampler.stats(), f)
+        with open(f"{base}.collapsed", "w") as f:
+            f.write(sampler.collapsed())
+    except OSError as e:
+        l.warning(f"could not write the profile of {name} to {directory}: {e}")
+        return
+
+    l.info(
+        f"profiled {name} for {seconds:.3f}s "
+        f"({sum(sampler.counts.values())} samples) into {base}.*"
+    )
+
+
+__all__ = [
+    "StackSampler",
+    "profile_mode",
+    "profiling",
+]
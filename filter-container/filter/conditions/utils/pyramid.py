@@ -0,0 +1,338 @@
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from threading import Lock
+import logging
+import os
+
+from . import (
+    Buffer,
+    NUM_BYTE_VALUES,
+    iter_byte_histograms,
+    entropy_of_histograms,
+)
+from .blocks import BlockReader, read_buffer_size
+from .lazy import LazyModule
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    np = LazyModule("numpy")
+
+l = logging.getLogger("[pyramid]")
+
+# * the finest granularity we ever histogram at
+DEFAULT_BASE_BLOCK_SIZE = 1024
+
+# * at most this many base blocks are kept per file. With uint16 counts that is
+# * 8 MiB of histograms per file regardless of how large the file is
+MAX_BASE_BLOCKS = 16384
+
+
+def base_block_size_for(
+    file_size: int,
+    min_block_size: int = DEFAULT_BASE_BLOCK_SIZE,
+    max_blocks: int = MAX_BASE_BLOCKS,
+) -> int:
+    """Picks the base block size for a file of file_size bytes: the smallest
+    min_block_size * 2 ^ k that splits the file into at most max_blocks blocks.
+    Using powers of two means that the base of a smaller file always divides
+    the base of a larger one, so block sizes can be shared between files.
+
+    Args:
+        file_size (int): size of the file in bytes
+        min_block_size (int, optional): finest base. Defaults to DEFAULT_BASE_BLOCK_SIZE.
+        max_blocks (int, optional): cap on the number of base blocks. Defaults to MAX_BASE_BLOCKS.
+
+    Returns:
+        int: base block size in bytes
+    """
+    block_size = min_block_size
+    while block_size * max_blocks < file_size:
+        block_size *= 2
+    return block_size
+
+
+class HistogramPyramid:
+    """256-bin byte histograms of a file (or buffer) at a fine base block size.
+    Byte histograms add up, so the histogram of any block that is a multiple of
+    the base is the sum of its neighbouring base histograms. This lets the
+    conditions ask for entropies at any such block size without reading the data
+    again. Coarser levels are cached as they are requested and are themselves
+    used to derive even coarser ones.
+    """
+
+    def __init__(
+        self, base_histograms: "np.ndarray", base_block_size: int, size: int
+    ) -> None:
+        self.base_block_size = base_block_size
+        self.size = size
+        self._levels: Dict[int, np.ndarray] = {base_block_size: base_histograms}
+
+    @classmethod
+    def from_buffer(
+        cls, data: Buffer, base_block_size: int = DEFAULT_BASE_BLOCK_SIZE
+    ) -> "HistogramPyramid":
+        builder = PyramidBuilder(memoryview(data).nbytes, base_block_size)
+        builder.update(data)
+        return builder.finish()
+
+    @classmethod
+    def from_file(
+        cls, file_loc: str, base_block_size: Optional[int] = None
+    ) -> "HistogramPyramid":
+        """Reads the file once and histograms it at base_block_size.
+
+        Args:
+            file_loc (str): path of the file
+            base_block_size (Optional[int], optional): if not given, it is picked
+            with base_block_size_for. Defaults to None.
+
+        Returns:
+            HistogramPyramid: pyramid of the file
+        """
+        file_size = os.path.getsize(file_loc)
+
+        if base_block_size is None:
+            base_block_size = base_block_size_for(file_size)
+
+        builder = PyramidBuilder(file_size, base_block_size)
+        # * whole base blocks per read, so that nothing is carried over between reads
+        chunk_size = max(1, read_buffer_size() // base_block_size) * base_block_size
+
+        with BlockReader(file_loc, chunk_size) as reader:
+            for block in reader:
+                builder.update(block)
+
+        return builder.finish()
+
+    def block_size_for(self, block_size: int) -> int:
+        """Rounds block_size up to the nearest multiple of the base block size
+
+        Args:
+            block_size (int): desired block size in bytes
+
+        Returns:
+            int: closest block size that this pyramid can serve
+        """
+        base = self.base_block_size
+        return max(base, -(-block_size // base) * base)
+
+    def histograms(self, block_size: int) -> "np.ndarray":
+        """Histograms of consecutive blocks of block_size bytes. The last block
+        may be shorter, exactly like reading the file with f.read(block_size).
+
+        Args:
+            block_size (int): a multiple of the base block size
+
+        Raises:
+            ValueError: if block_size is not a multiple of the base block size
+
+        Returns:
+            np.ndarray: array of shape (number of blocks, 256)
+        """
+        if block_size <= 0 or block_size % self.base_block_size:
+            raise ValueError(
+                f"block size {block_size} is not a multiple of the base block size"
+                f" {self.base_block_size}"
+            )
+
+        level = self._levels.get(block_size)
+        if level is not None:
+            return level
+
+        # * derive from the coarsest cached level that evenly divides block_size
+        finer = max(bs for bs in self._levels if block_size % bs == 0)
+        finer_histograms = self._levels[finer]
+        factor = block_size // finer
+
+        if len(finer_histograms) == 0:
+            level = np.zeros((0, NUM_BYTE_VALUES), dtype=np.int64)
+        else:
+            level = np.add.reduceat(
+                finer_histograms,
+                np.arange(0, len(finer_histograms), factor),
+                axis=0,
+                dtype=np.int64,
+            )
+
+        self._levels[block_size] = level
+        return level
+
+    def entropies(self, block_size: int) -> "np.ndarray":
+        """Normalized Shannon entropy of every block of block_size bytes
+
+        Args:
+            block_size (int): a multiple of the base block size
+
+        Returns:
+            np.ndarray: entropies in [0, 1]
+        """
+        return entropy_of_histograms(self.histograms(block_size))
+
+    def total_histogram(self) -> "np.ndarray":
+        return self._levels[self.base_block_size].sum(axis=0, dtype=np.int64)
+
+    def entropy(self) -> float:
+        """Normalized Shannon entropy of the whole file taken as a single block
+
+        Returns:
+            float: entropy in [0, 1]
+        """
+        return float(entropy_of_histograms(self.total_histogram())[0])
+
+
+class PyramidBuilder:
+    """Builds a HistogramPyramid incrementally from data that arrives in pieces
+    of any size, e.g. blocks handed out by a reader. Pieces that do not end on a
+    base block boundary are carried over into the next update.
+    """
+
+    def __init__(self, size: int, base_block_size: int) -> None:
+        if base_block_size <= 0:
+            raise ValueError(f"block size has to be positive, got: {base_block_size}")
+
+        self.size = 0
+        self.base_block_size = base_block_size
+        # * counts in a base block never exceed the base block size
+        dtype = np.uint16 if base_block_size <= np.iinfo(np.uint16).max else np.uint32
+        self._histograms = np.zeros(
+            (-(-size // base_block_size), NUM_BYTE_VALUES), dtype=dtype
+        )
+        self._rows = 0
+        self._carry = bytearray()
+
+    def update(self, data: Buffer) -> None:
+        view = memoryview(data).cast("B")
+        self.size += len(view)
+
+        if self._carry:
+            needed = self.base_block_size - len(self._carry)
+            self._carry += view[:needed]
+            view = view[needed:]
+            if len(self._carry) < self.base_block_size:
+                return
+            self._add_rows(self._carry)
+            self._carry = bytearray()
+
+        full = len(view) - len(view) % self.base_block_size
+        if full:
+            self._add_rows(view[:full])
+        if full < len(view):
+            self._carry += view[full:]
+
+    def finish(self) -> HistogramPyramid:
+        if self._carry:
+            self._add_rows(self._carry)
+            self._carry = bytearray()
+
+        return HistogramPyramid(
+            self._histograms[: self._rows], self.base_block_size, self.size
+        )
+
+    def _add_rows(self, data: Buffer) -> None:
+        for _, batch in iter_byte_histograms(data, self.base_block_size):
+            end = self._rows + len(batch)
+            if end > len(self._histograms):
+                # * the file grew since we looked at its size
+                grown = np.zeros((end, NUM_BYTE_VALUES), dtype=self._histograms.dtype)
+                grown[: self._rows] = self._histograms[: self._rows]
+                self._histograms = grown
+            self._histograms[self._rows : end] = batch
+            self._rows = end
+
+
+_pyramids: Dict[Tuple[str, int, int, Optional[int]], HistogramPyramid] = {}
+_pyramids_lock = Lock()
+
+
+def _pyramid_key(
+    file_loc: str, base_block_size: Optional[int], stat: Optional[os.stat_result] = None
+) -> Tuple[str, int, int, Optional[int]]:
+    if stat is None:
+        stat = os.stat(file_loc)
+    return (os.path.realpath(file_loc), stat.st_size, stat.st_mtime_ns, base_block_size)
+
+
+def get_pyramid(
+    file_loc: str, base_block_size: Optional[int] = None
+) -> HistogramPyramid:
+    """Returns the pyramid of the file, reading the file only if no condition has
+    done so already. Cached pyramids are keyed by the file's size and modification
+    time, so a file that changes in between is read again.
+
+    Args:
+        file_loc (str): path of the file
+        base_block_size (Optional[int], optional): see HistogramPyramid.from_file.
+        Defaults to None.
+
+    Returns:
+        HistogramPyramid: pyramid of the file
+    """
+    key = _pyramid_key(file_loc, base_block_size)
+
+    with _pyramids_lock:
+        pyramid = _pyramids.get(key)
+
+    if pyramid is None:
+        l.debug("building the histogram pyramid of %s", file_loc)
+        pyramid = HistogramPyramid.from_file(file_loc, base_block_size)
+        with _pyramids_lock:
+            _pyramids[key] = pyramid
+
+    return pyramid
+
+
+def cached_pyramid(
+    file_loc: str, base_block_size: Optional[int] = None
+) -> Optional[HistogramPyramid]:
+    """The pyramid of the file if somebody built it already (e.g. the scan
+    engine), None otherwise. Never reads the file.
+
+    Args:
+        file_loc (str): path of the file
+        base_block_size (Optional[int], optional): see get_pyramid. Defaults to None.
+
+    Returns:
+        Optional[HistogramPyramid]: pyramid of the file
+    """
+    key = _pyramid_key(file_loc, base_block_size)
+    with _pyramids_lock:
+        return _pyramids.get(key)
+
+
+def cache_pyramid(
+    file_loc: str,
+    pyramid: HistogramPyramid,
+    stat: Optional[os.stat_result] = None,
+    base_block_size: Optional[int] = None,
+) -> None:
+    """Hands a pyramid built elsewhere (e.g. by the scan engine) over to
+    get_pyramid, so that the conditions do not read the file again.
+
+    Args:
+        file_loc (str): path of the file
+        pyramid (HistogramPyramid): pyramid of the file
+        stat (Optional[os.stat_result], optional): stat of the file taken before it
+        was read. Defaults to None, in which case the file is stat-ed now.
+        base_block_size (Optional[int], optional): the base_block_size get_pyramid
+        will be called with. Defaults to None.
+    """
+    key = _pyramid_key(file_loc, base_block_size, stat)
+    with _pyramids_lock:
+        _pyramids[key] = pyramid
+
+
+def clear_pyramids() -> None:
+    with _pyramids_lock:
+        _pyramids.clear()
+
+
+__all__ = [
+    "DEFAULT_BASE_BLOCK_SIZE",
+    "base_block_size_for",
+    "HistogramPyramid",
+    "PyramidBuilder",
+    "get_pyramid",
+    "cached_pyramid",
+    "cache_pyramid",
+    "clear_pyramids",
+]
@@ -0,0 +1,186 @@
+from typing import Dict, Iterable, List, Optional, Set
+import logging
+import os
+
+from . import Buffer
+from .blocks import BlockReader, read_buffer_size
+from .cancel import raise_if_cancelled
+from .pyramid import PyramidBuilder, base_block_size_for, cache_pyramid
+
+l = logging.getLogger("[scan]")
+
+
+class ScanObserver:
+    """Something that wants to see the files under INPUTS / OUTPUTS. The engine
+    walks the directories once and calls visit for every file it finds. Only the
+    files that at least one observer wants are read, and the data of those is handed
+    to the observers that want it via start_file, feed (block by block, in order)
+    and end_file.
+
+    Conditions create observers (see their observers method) and, once the scan
+    is finished, get their verdict from the observers' state instead of reading
+    the files themselves.
+    """
+
+    def __init__(self) -> None:
+        # * set by the engine if this observer raised. Conditions then fall back
+        # * to reading the files themselves
+        self.failed = False
+
+    def wants(self, file_loc: str) -> bool:
+        return False
+
+    def merge(self, other: "ScanObserver") -> bool:
+        """Lets the engine coalesce observers that would do the same work, e.g.
+        two conditions that both need the histograms of the output file.
+
+        Args:
+            other (ScanObserver): observer that is being registered
+
+        Returns:
+            bool: True if this observer took over other's work, then other is not
+            registered
+        """
+        return False
+
+    def visit(self, file_loc: str, stat: os.stat_result) -> None:
+        """Called for every file the engine finds, wanted or not"""
+        pass
+
+    def start_file(self, file_loc: str, stat: os.stat_result) -> None:
+        """Called before the first block of a wanted file"""
+        pass
+
+    def feed(self, file_loc: str, offset: int, data: Buffer) -> None:
+        pass
+
+    def end_file(self, file_loc: str) -> None:
+        pass
+
+
+class PyramidObserver(ScanObserver):
+    """Builds the histogram pyramid (see utils.pyramid) of the files it is
+    interested in and hands them over to get_pyramid. Serves both as the entropy
+    accumulator of the output files and as the correlation profile of the input.
+    """
+
+    def __init__(self, file_locs: Iterable[str]) -> None:
+        super().__init__()
+        self.file_locs: Set[str] = {os.path.abspath(f) for f in file_locs}
+        self._builders: Dict[str, PyramidBuilder] = {}
+        self._stats: Dict[str, os.stat_result] = {}
+
+    def wants(self, file_loc: str) -> bool:
+        return os.path.abspath(file_loc) in self.file_locs
+
+    def merge(self, other: ScanObserver) -> bool:
+        if type(other) is not PyramidObserver:
+            return False
+        self.file_locs |= other.file_locs
+        return True
+
+    def start_file(self, file_loc: str, stat: os.stat_result) -> None:
+        self._stats[file_loc] = stat
+        self._builders[file_loc] = PyramidBuilder(
+            stat.st_size, base_block_size_for(stat.st_size)
+        )
+
+    def feed(self, file_loc: str, offset: int, data: Buffer) -> None:
+        self._builders[file_loc].update(data)
+
+    def end_file(self, file_loc: str) -> None:
+        builder = self._builders.pop(file_loc)
+        cache_pyramid(file_loc, builder.finish(), self._stats.pop(file_loc))
+
+
+class ScanEngine:
+    """Streams every file under the given roots at most once and sends its blocks
+    to all of the registered observers that want it. Reading a large output once
+    instead of once per condition is what matters on network backed volumes.
+    """
+
+    def __init__(self, block_size: Optional[int] = None) -> None:
+        # * how many bytes the engine hands to the observers at a time
+        self.block_size = block_size or read_buffer_size()
+        self.observers: List[ScanObserver] = []
+        self.bytes_read = 0
+
+    def register(self, observer: ScanObserver) -> None:
+        for registered in self.observers:
+            if registered.merge(observer):
+                return
+        self.observers.append(observer)
+
+    def run(self, roots: Iterable[str]) -> None:
+        """Walks the roots (skipping symbolic links, like get_size_of_dir) and feeds
+        the observers.
+
+        Args:
+            roots (Iterable[str]): directories to scan, e.g. INPUTS and OUTPUTS
+
+        Raises:
+            Cancelled: if the cancel event of the thread is set
+        """
+        seen: Set[str] = set()
+
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                for f in filenames:
+                    file_loc = os.path.join(dirpath, f)
+                    if os.path.islink(file_loc) or file_loc in seen:
+                        continue
+                    seen.add(file_loc)
+                    # * between the files, BlockReader between the blocks
+                    raise_if_cancelled()
+                    self._scan_file(file_loc)
+
+        l.info(f"scanned {len(seen)} files, read {self.bytes_read} bytes")
+
+    def _scan_file(self, file_loc: str) -> None:
+        stat = os.stat(file_loc)
+        interested = []
+
+        for observer in self.observers:
+            if observer.failed:
+                continue
+            if not self._call(observer, "visit", file_loc, stat):
+                continue
+            if observer.wants(file_loc):
+                interested.append(observer)
+
+        if not interested:
+            return
+
+        for observer in interested:
+            self._call(observer, "start_file", file_loc, stat)
+
+        l.debug("scanning %s for %d observers", file_loc, len(interested))
+
+        with BlockReader(file_loc, self.block_size) as reader:
+            offset = 0
+            for block in reader:
+                for observer in interested:
+                    if not observer.failed:
+                        self._call(observer, "feed", file_loc, offset, block)
+                offset += len(block)
+            self.bytes_read += reader.bytes_read
+
+        for observer in interested:
+            if not observer.failed:
+                self._call(observer, "end_file", file_loc)
+
+    def _call(self, observer: ScanObserver, method: str, *args: object) -> bool:
+        try:
+            getattr(observer, method)(*args)
+        except Exception as e:
+            l.error(f"{type(observer).__name__} failed in {method}: {e}")
+            observer.failed = True
+            return False
+        return True
+
+
+__all__ = [
+    "ScanObserver",
+    "PyramidObserver",
+    "ScanEngine",
+]
@@ -0,0 +1,260 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from types import TracebackType
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+import logging
+import sys
+import io
+import os
+
+l = logging.getLogger("[shared]")
+
+# * where POSIX shared memory lives. Containers often cap it (64 MiB by default
+# * in docker), and writing past the cap kills the process with SIGBUS
+SHM_DIR = "/dev/shm"
+
+# * how much of the free shared memory we are willing to take
+SHM_FILL_RATIO = 0.8
+
+
+class SharedFile(NamedTuple):
+    """Picklable handle of a file that was loaded into shared memory. The worker
+    processes attach to the segment by name.
+    """
+
+    file_loc: str
+    name: str
+    size: int
+    mtime_ns: int
+
+
+def _shm_free_bytes() -> Optional[int]:
+    try:
+        st = os.statvfs(SHM_DIR)
+    except OSError:
+        return None
+    return int(st.f_bavail * st.f_frsize * SHM_FILL_RATIO)
+
+
+class SharedFiles:
+    """Loads files into shared memory segments, once, so that conditions running
+    in worker processes read them straight from RAM instead of each re-reading
+    the disk or having the bytes pickled over to them. The segments are owned by
+    this (the parent) process and are unlinked when the context exits, whatever
+    happened to the workers. Files that do not fit into the free shared memory
+    are left out; they are read from the disk as usual.
+
+        with SharedFiles(file_locs) as shared:
+            pool = ProcessPoolExecutor(
+                initializer=attach_shared_files, initargs=(shared.handles,)
+            )
+    """
+
+    def __init__(self, file_locs: Iterable[str]) -> None:
+        self.file_locs = list(file_locs)
+        self.handles: List[SharedFile] = []
+        self._segments: List[SharedMemory] = []
+
+    def __enter__(self) -> "SharedFiles":
+        free = _shm_free_bytes()
+
+        try:
+            for file_loc in self.file_locs:
+                stat = os.stat(file_loc)
+                if stat.st_size == 0:
+                    continue
+                if free is not None and stat.st_size > free:
+                    l.info(f"{file_loc} does not fit into shared memory, skipping it")
+                    continue
+
+                segment = self._load(file_loc, stat.st_size)
+                if segment is None:
+                    continue
+                if free is not None:
+                    free -= stat.st_size
+
+                self.handles.append(
+                    SharedFile(
+                        os.path.realpath(file_loc),
+                        segment.name,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+                )
+        except BaseException:
+            self.close()
+            raise
+
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for segment in self._segments:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self._segments = []
+        self.handles = []
+
+    def _load(self, file_loc: str, size: int) -> Optional[SharedMemory]:
+        try:
+            segment = SharedMemory(create=True, size=size)
+        except OSError as e:
+            l.warning(f"could not create a shared memory segment for {file_loc}: {e}")
+            return None
+        self._segments.append(segment)
+
+        buffer = segment.buf
+        with open(file_loc, "rb", buffering=0) as f:
+            offset = 0
+            while offset < size:
+                n = f.readinto(buffer[offset:])
+                if not n:
+                    # * the file shrank since we looked at its size
+                    break
+                offset += n
+
+        l.debug(f"loaded {offset} bytes of {file_loc} into {segment.name}")
+        return segment
+
+
+_attached: Dict[str, Tuple[SharedFile, SharedMemory]] = {}
+_attached_lock = Lock()
+
+
+def attach_shared_files(handles: Iterable[SharedFile]) -> None:
+    """Attaches the current (worker) process to the segments, after which
+    shared_buffer, and through it BlockReader, serves the files from them.
+
+    Args:
+        handles (Iterable[SharedFile]): handles of SharedFiles in the parent
+    """
+    with _attached_lock:
+        for handle in handles:
+            if handle.file_loc in _attached:
+                continue
+            # * the parent owns the segments. Before 3.13 every process shares
+            # * the parent's resource tracker, where attaching is a no-op
+            kwargs = {"track": False} if sys.version_info >= (3, 13) else {}
+            try:
+                segment = SharedMemory(name=handle.name, **kwargs)
+            except FileNotFoundError:
+                l.warning(f"shared memory of {handle.file_loc} is gone")
+                continue
+            _attached[handle.file_loc] = (handle, segment)
+
+
+def detach_shared_files() -> None:
+    with _attached_lock:
+        for _, segment in _attached.values():
+            try:
+                segment.close()
+            except BufferError:
+                # * a block is still referenced, the mapping goes away with it
+                pass
+        _attached.clear()
+
+
+def shared_buffer(file_loc: str) -> Optional[memoryview]:
+    """The contents of the file, if it was loaded into shared memory and has not
+    changed since.
+
+    Args:
+        file_loc (str): path of the file
+
+    Returns:
+        Optional[memoryview]: read-only view of the contents, None if the file has
+        to be read from the disk
+    """
+    if not _attached:
+        return None
+
+    file_loc = os.path.realpath(file_loc)
+    with _attached_lock:
+        entry = _attached.get(file_loc)
+    if entry is None:
+        return None
+
+    handle, segment = entry
+    stat = os.stat(file_loc)
+    if stat.st_size != handle.size or stat.st_mtime_ns != handle.mtime_ns:
+        l.debug(f"{file_loc} changed since it was shared, reading it from the disk")
+        return None
+
+    view: memoryview = segment.buf[: handle.size].toreadonly()
+    return view
+
+
+class _SharedFileIO(io.RawIOBase):
+    """Raw, read-only file over a shared memory view"""
+
+    def __init__(self, view: memoryview) -> None:
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b: bytearray) -> int:
+        chunk = self._view[self._pos : self._pos + len(b)]
+        n = len(chunk)
+        memoryview(b).cast("B")[:n] = chunk
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+        super().close()
+
+
+def open_file(file_loc: str) -> io.BufferedReader:
+    """Opens the file for binary reading, from shared memory if it is there
+
+    Args:
+        file_loc (str): path of the file
+
+    Returns:
+        io.BufferedReader: file object, use it as a context manager
+    """
+    view = shared_buffer(file_loc)
+    if view is None:
+        return open(file_loc, "rb")
+    return io.BufferedReader(_SharedFileIO(view))
+
+
+__all__ = [
+    "SharedFile",
+    "SharedFiles",
+    "attach_shared_files",
+    "detach_shared_files",
+    "shared_buffer",
+    "open_file",
+]
@@ -1,49 +1,260 @@
 #!/usr/bin/env python
 import os
+import json
 import time
 import shutil
 import logging
+import tracemalloc
+from threading import Event
+from typing import Any, Dict, Optional
 
-from filter.conditions.no_keywords import NoKeywords
-from filter.conditions.not_correlated import NotCorrelated
-from filter.conditions.not_encrypted import NotEncrypted
-from filter.conditions.small_size import SmallSize
+from filter.conditions.utils import is_in_outputs
+from filter.conditions.utils.cancel import Cancelled, set_cancel_event
+from filter.conditions.utils.lazy import process_age, startup_report, timed_import
+from filter.conditions.utils.memory import memory_trace
+from filter.conditions.utils.metrics import ConditionMetrics, peak_rss_mb, tracking
+from filter.conditions.utils.profiling import profiling
 
 l = logging.getLogger("[privacy_pod]")
 
+# * where the metrics of the run (see report_metrics) are written to, as json.
+# * They are always logged. Empty writes no file
+DEFAULT_METRICS_REPORT = ""
 
-def main():
-    l.debug(os.environ)
+# * module and class of every condition, in the order they are checked. They are
+# * imported when they are needed, see main
+CONDITIONS = [
+    ("filter.conditions.small_size", "SmallSize"),
+    ("filter.conditions.not_encrypted", "NotEncrypted"),
+    ("filter.conditions.not_correlated", "NotCorrelated"),
+    ("filter.conditions.no_keywords", "NoKeywords"),
+]
 
-    all_conditions = [SmallSize(), NotEncrypted(), NotCorrelated(), NoKeywords()]
 
-    for condition in all_conditions:
-        l.info(f"checking {condition.name} condition...")
-        r = condition()
+def load_condition(module: str, name: str) -> Any:
+    """Imports the module of a condition (timing it for the startup report) and
+    instantiates the condition
+    """
+    return getattr(timed_import(module), name)()
 
-        if not r:
-            l.warning(
-                f"{condition.name} condition not met. overwriting the outputs file"
-            )
-            outputs = os.getenv("OUTPUTS")
 
-            for filename in os.listdir(outputs):
-                file_path = os.path.join(outputs, filename)
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    l.warn(f"failed to delete {file_path}. reason: {e}")
+def metrics_report_path() -> str:
+    path: str = os.getenv("METRICS_REPORT", DEFAULT_METRICS_REPORT)
+    return path
 
-            with open(os.path.join(outputs, "output.txt"), "w") as f:
-                f.write("contact ocean protocol for support")
 
-            # * early exit
-            return
+def report_metrics(
+    verdicts: Dict[str, Optional[bool]],
+    metrics: Dict[str, ConditionMetrics],
+    main_seconds: float,
+) -> Dict[str, Any]:
+    """Logs the metrics of the run as a single json line and writes them to
+    METRICS_REPORT, if it is set: startup, the whole run, the shared scan and, per
+    condition, its verdict, wall and CPU time, bytes read from INPUTS and OUTPUTS,
+    files read, MB/s, the peak RSS of the pod when it was done and the memory it
+    used while the condition ran (see utils.memory; with MEMORY_TRACE=1, the
+    python allocations too).
 
-    return
+    Args:
+        verdicts (Dict[str, Optional[bool]]): what main returns
+        metrics (Dict[str, ConditionMetrics]): of the conditions, and of the scan
+        main_seconds (float): how long main took
+
+    Returns:
+        Dict[str, Any]: the report
+    """
+    times = os.times()
+    age = process_age()
+    scan_metrics = metrics.get("scan")
+
+    report = {
+        "startup": startup_report(),
+        "main_seconds": round(main_seconds, 6),
+        "process_seconds": round(age, 3) if age is not None else None,
+        "cpu_seconds": round(times.user + times.system, 6),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "scan": scan_metrics.report() if scan_metrics is not None else None,
+        "conditions": {
+            name: {"verdict": verdict, **metrics[name].report()}
+            for name, verdict in verdicts.items()
+            if name in metrics
+        },
+    }
+    l.info(f"metrics: {json.dumps(report)}")
+
+    path = metrics_report_path()
+    if not path:
+        return report
+
+    if is_in_outputs(path):
+        l.error(f"not writing the metrics into OUTPUTS: {path}")
+        return report
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp, path)
+    except OSError as e:
+        l.warning(f"could not write the metrics to {path}: {e}")
+
+    return report
+
+
+def scan(conditions: list) -> None:
+    """Reads INPUTS and OUTPUTS once, feeding the observers of all of the
+    conditions, so that the conditions do not have to read the files themselves.
+    Set SHARED_SCAN=0 to let every condition read the files on its own.
+
+    Args:
+        conditions (list): conditions that are about to be checked
+    """
+    if os.getenv("SHARED_SCAN", "1") == "0":
+        return
+
+    roots = [os.getenv("INPUTS", ""), os.getenv("OUTPUTS", "")]
+    if not all(os.path.isdir(root) for root in roots):
+        # * the conditions report the missing directories themselves
+        return
+
+    from filter.conditions.utils.scan import ScanEngine
+
+    engine = ScanEngine()
+
+    for condition in conditions:
+        for observer in condition.observers():
+            engine.register(observer)
+
+    engine.run(roots)
+
+
+def went_over_ceiling(name: str, metrics: ConditionMetrics) -> bool:
+    """Whether name (e.g. a condition, or the scan) went over MEMORY_CEILING_MB
+    while it was tracked, see utils.memory.watching. Logs it if it did
+
+    Args:
+        name (str): what was tracked, for the log
+        metrics (ConditionMetrics): it was tracked with
+
+    Returns:
+        bool: True if it was stopped before the pod got OOM-killed
+    """
+    if not metrics.over_ceiling:
+        return False
+
+    assert metrics.memory is not None
+    l.error(
+        f"{name} went over the memory ceiling of {metrics.memory['ceiling_mb']}MB "
+        f"({metrics.memory['rss_peak_mb']}MB)"
+    )
+    return True
+
+
+def wipe_outputs(outputs: str) -> None:
+    """Replaces everything in outputs with a note, so that nothing gets published.
+
+    Args:
+        outputs (str): the directory defined by the OUTPUTS env variable
+    """
+    # ! os.listdir(None) would list (and we would wipe) the working directory
+    if not outputs or not os.path.isdir(outputs):
+        l.error(f"OUTPUTS is not a directory: {outputs}, nothing to overwrite")
+        return
+
+    for filename in os.listdir(outputs):
+        file_path = os.path.join(outputs, filename)
+        try:
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+            elif os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+        except Exception as e:
+            l.warn(f"failed to delete {file_path}. reason: {e}")
+
+    with open(os.path.join(outputs, "output.txt"), "w") as f:
+        f.write("contact ocean protocol for support")
+
+
+def main() -> Dict[str, Optional[bool]]:
+    start = time.perf_counter()
+
+    if memory_trace() and not tracemalloc.is_tracing():
+        # * before anything is allocated, so that the peaks are complete
+        tracemalloc.start()
+
+    # * SmallSize only looks at the sizes of the files. When the outputs are too
+    # * large, nothing else is imported, read or checked
+    small_size = load_condition(*CONDITIONS[0])
+    small_size_metrics = ConditionMetrics(small_size.name)
+    metrics = {small_size.name: small_size_metrics}
+    # * set when it goes over MEMORY_CEILING_MB, see tracking
+    set_cancel_event(Event())
+    try:
+        with tracking(small_size_metrics, wall=True), profiling(small_size.name):
+            is_small = bool(small_size())
+    except Exception as e:
+        # ! an error means we can't vouch for the outputs, as in the runner
+        l.exception(f"{small_size.name} condition raised: {e}")
+        is_small = False
+    finally:
+        set_cancel_event(None)
+
+    if went_over_ceiling(f"{small_size.name} condition", small_size_metrics):
+        is_small = False
+
+    if not is_small:
+        l.info(f"startup: {json.dumps(startup_report())}")
+        l.warning(f"{small_size.name} condition not met. overwriting the outputs file")
+        wipe_outputs(os.getenv("OUTPUTS", ""))
+        verdicts: Dict[str, Optional[bool]] = {small_size.name: False}
+        report_metrics(verdicts, metrics, time.perf_counter() - start)
+        return verdicts
+
+    from filter.runner import ConditionRunner
+
+    conditions = [load_condition(*c) for c in CONDITIONS[1:]]
+    l.info(f"startup: {json.dumps(startup_report())}")
+
+    runner = ConditionRunner(conditions)
+
+    # * worker processes would not see what the scan found out, they read the
+    # * outputs from shared memory instead
+    if not runner.uses_processes:
+        metrics["scan"] = ConditionMetrics("scan")
+        # * the engine stops between two blocks once the scan goes over
+        # * MEMORY_CEILING_MB
+        set_cancel_event(Event())
+        try:
+            with tracking(metrics["scan"], wall=True), profiling("scan"):
+                scan(conditions)
+        except Cancelled:
+            l.info("the scan was cancelled")
+        finally:
+            set_cancel_event(None)
+
+        if went_over_ceiling("the scan", metrics["scan"]):
+            # ! it read the files for all of the conditions, none of them got to
+            # ! vouch for the outputs
+            l.warning("the scan was stopped. overwriting the outputs file")
+            wipe_outputs(os.getenv("OUTPUTS", ""))
+            verdicts = {small_size.name: True}
+            verdicts.update((c.name, False) for c in conditions)
+            report_metrics(verdicts, metrics, time.perf_counter() - start)
+            return verdicts
+
+    results: Dict[str, Optional[bool]] = {small_size.name: True}
+    if not runner():
+        assert runner.failed is not None
+        l.warning(
+            f"{runner.failed.name} condition not met. overwriting the outputs file"
+        )
+        wipe_outputs(os.getenv("OUTPUTS", ""))
+
+    results.update(runner.results)
+    metrics.update(runner.metrics)
+    report_metrics(results, metrics, time.perf_counter() - start)
+    return results
 
 
 if __name__ == "__main__":
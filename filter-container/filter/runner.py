@@ -0,0 +1,223 @@
+from concurrent.futures import (
+    Executor,
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    Future,
+    FIRST_COMPLETED,
+    wait,
+)
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from threading import Event
+import logging
+import os
+
+from filter.conditions.utils.cancel import Cancelled, set_cancel_event
+from filter.conditions.utils.metrics import ConditionMetrics, tracking
+from filter.conditions.utils.parallel import process_context
+from filter.conditions.utils.profiling import profiling
+from filter.conditions.utils.shared import SharedFiles, attach_shared_files
+
+l = logging.getLogger("[runner]")
+
+# * "thread" or "process". Processes get around the GIL for the pure python parts
+# * of the conditions, at the cost of starting them
+DEFAULT_CONDITION_POOL = "thread"
+
+
+class ConditionRunner:
+    """Checks all of the conditions at the same time on a pool of worker threads.
+    The conditions are independent, so when they all pass the verdict arrives in
+    the time of the slowest one, rather than the sum of all of them. As soon as
+    any condition is not met, the others are cancelled cooperatively (they raise
+    Cancelled at their next cancellation point, see utils.cancel) and the runner
+    returns right away, without waiting for them to wind down (worker threads;
+    worker processes are waited for, see below).
+
+    The number of workers can be set with the CONDITION_WORKERS env variable.
+    CONDITION_WORKERS=1 checks the conditions one after another, in order.
+
+    With CONDITION_POOL=process the conditions run in worker processes instead.
+    The output files are then loaded into shared memory once (see utils.shared)
+    and the workers read them from there. The workers are spawned, not forked
+    (see utils.parallel.process_context), and the conditions are pickled over to
+    them, so whatever state they build up stays there; the runner only gets
+    their verdicts back. A worker that crashes counts as a failed condition. The
+    runner waits for the cancelled workers to stop before it returns.
+
+    What every condition cost (see utils.metrics) ends up in self.metrics. Those
+    of cancelled conditions are as far as they got in threads, and empty in
+    processes.
+
+    With MEMORY_CEILING_MB set, a condition that runs the pod over it is
+    cancelled and counts as not met (see utils.memory). The RSS is that of the
+    whole pod, so with several conditions at a time, all of those running fail.
+    """
+
+    def __init__(
+        self,
+        conditions: List[Any],
+        max_workers: Optional[int] = None,
+        pool: Optional[str] = None,
+    ):
+        self.conditions = conditions
+        self.max_workers = max_workers or int(
+            os.getenv("CONDITION_WORKERS", max(1, len(conditions)))
+        )
+        self.pool = pool or os.getenv("CONDITION_POOL", DEFAULT_CONDITION_POOL)
+        if self.pool not in ("thread", "process"):
+            raise ValueError(f"unknown condition pool: {self.pool}")
+        # * condition name -> True / False, None if it was cancelled or never ran
+        self.results: Dict[str, Optional[bool]] = {c.name: None for c in conditions}
+        self.metrics: Dict[str, ConditionMetrics] = {
+            c.name: ConditionMetrics(c.name) for c in conditions
+        }
+        self.failed: Optional[Any] = None
+
+    @property
+    def uses_processes(self) -> bool:
+        return self.pool == "process"
+
+    def __call__(self) -> bool:
+        """Checks the conditions.
+
+        Returns:
+            bool: True if all of the conditions are met. If False, self.failed is
+            the first condition that was found not to be met
+        """
+        if not self.uses_processes:
+            cancel = Event()
+            pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="condition"
+            )
+            return self._run(
+                pool,
+                cancel,
+                lambda c: pool.submit(_check, c, cancel, self.metrics[c.name]),
+            )
+
+        context = process_context()
+        cancel = context.Event()
+
+        # * the segments are unlinked on the way out, even if a worker died
+        with SharedFiles(_output_files()) as shared:
+            l.info(f"shared {len(shared.handles)} output files with the workers")
+            pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(cancel, shared.handles),
+            )
+            return self._run(pool, cancel, lambda c: pool.submit(_check_in_worker, c))
+
+    def _run(self, pool: Executor, cancel: Any, submit: Any) -> bool:
+        pending: Set[Future] = set()
+        futures: Dict[Future, Any] = {}
+
+        for condition in self.conditions:
+            future = submit(condition)
+            futures[future] = condition
+            pending.add(future)
+
+        try:
+            while pending and self.failed is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                # * keep the order of the conditions among those that finished together
+                for future in sorted(
+                    done, key=lambda f: self.conditions.index(futures[f])
+                ):
+                    condition = futures[future]
+                    try:
+                        is_valid, metrics = future.result()
+                        self.metrics[condition.name] = metrics
+                    except Exception as e:
+                        # ! e.g. the worker process died
+                        l.error(f"{condition.name} condition could not be checked: {e}")
+                        is_valid = False
+                    self.results[condition.name] = is_valid
+
+                    if is_valid is False and self.failed is None:
+                        self.failed = condition
+        finally:
+            cancel.set()
+            for future in pending:
+                future.cancel()
+            # * cancelled conditions finish in the background. Worker processes
+            # * are waited for, they stop at their next cancellation point and
+            # * python joins them on exit anyway. On 3.8, shutdown(wait=False)
+            # * leaves them running forever and the filter hangs on exit
+            pool.shutdown(wait=self.uses_processes)
+
+        return self.failed is None
+
+
+def _check(
+    condition: Any, cancel: Any, metrics: Optional[ConditionMetrics] = None
+) -> Tuple[Optional[bool], ConditionMetrics]:
+    metrics = metrics or ConditionMetrics(condition.name)
+    if cancel.is_set():
+        return None, metrics
+
+    set_cancel_event(cancel)
+    l.info(f"checking {condition.name} condition...")
+
+    try:
+        with tracking(metrics, wall=True), profiling(condition.name):
+            is_valid: Optional[bool] = bool(condition())
+    except Cancelled:
+        l.info(f"{condition.name} condition was cancelled")
+        is_valid = None
+    except Exception as e:
+        if cancel.is_set():
+            # * e.g. the outputs were wiped from under a cancelled condition
+            l.info(f"{condition.name} condition was cancelled ({e})")
+            is_valid = None
+        else:
+            # ! an error means we can't vouch for the outputs
+            l.exception(f"{condition.name} condition raised: {e}")
+            is_valid = False
+    finally:
+        set_cancel_event(None)
+
+    if metrics.over_ceiling:
+        # ! it was stopped before the pod got OOM-killed, so it did not get to
+        # ! vouch for the outputs either
+        assert metrics.memory is not None
+        l.error(
+            f"{condition.name} condition went over the memory ceiling of "
+            f"{metrics.memory['ceiling_mb']}MB ({metrics.memory['rss_peak_mb']}MB)"
+        )
+        is_valid = False
+
+    if is_valid is False:
+        # * right away, so that the worker does not pick up the next condition
+        cancel.set()
+    return is_valid, metrics
+
+
+def _output_files() -> Iterator[str]:
+    outputs = os.getenv("OUTPUTS", "")
+    if not os.path.isdir(outputs):
+        return
+
+    for dirpath, _, filenames in os.walk(outputs):
+        for f in filenames:
+            file_loc = os.path.join(dirpath, f)
+            if not os.path.islink(file_loc):
+                yield file_loc
+
+
+_worker_cancel: Optional[Any] = None
+
+
+def _init_worker(cancel: Any, handles: List[Any]) -> None:
+    global _worker_cancel
+    _worker_cancel = cancel
+    attach_shared_files(handles)
+
+
+def _check_in_worker(condition: Any) -> Tuple[Optional[bool], ConditionMetrics]:
+    return _check(condition, _worker_cancel)
+
+
+__all__ = ["ConditionRunner"]
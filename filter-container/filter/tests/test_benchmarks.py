@@ -0,0 +1,113 @@
+import pytest  # type: ignore
+import tempfile
+import os
+
+from filter.benchmarks import (
+    BENCHMARKS,
+    SCENARIOS,
+    compare,
+    make_input,
+    parse_size,
+    run_scenarios,
+    run_suite,
+)
+from filter.benchmarks.scenarios import is_correct
+
+
+def result(mb_per_s, peak_rss_mb):
+    return {"mb_per_s": mb_per_s, "ops_per_s": 1.0, "peak_rss_mb": peak_rss_mb}
+
+
+def test_parse_size():
+    assert parse_size("64KB") == 1 << 16
+    assert parse_size("1mb") == 1 << 20
+    assert parse_size("1GB") == 1 << 30
+    assert parse_size("1000") == 1000
+
+
+def test_inputs_are_reproducible():
+    first, second = tempfile.mkdtemp(), tempfile.mkdtemp()
+
+    for kind in ("random", "csv"):
+        a, b = make_input(kind, 1 << 16, first), make_input(kind, 1 << 16, second)
+        with open(a, "rb") as f, open(b, "rb") as g:
+            assert f.read() == g.read()
+
+    with open(make_input("csv", 1 << 16, first)) as f:
+        assert f.readline() == "id,name,category,value,score\n"
+
+    directory = make_input("dir", 3 * (1 << 16), first)
+    files = [f for _, _, fs in os.walk(directory) for f in fs if f != ".done"]
+    assert len(files) == 3
+
+
+def test_run_suite():
+    results = run_suite(["64KB"], data_dir=tempfile.mkdtemp(), repeat=1)["results"]
+
+    assert sorted(results) == sorted(f"{name}@64KB" for name in BENCHMARKS)
+    for measured in results.values():
+        assert measured["mb_per_s"] > 0
+        assert measured["ops_per_s"] > 0
+        assert measured["peak_rss_mb"] > 0
+
+
+def test_run_suite_unknown_benchmark():
+    with pytest.raises(ValueError):
+        run_suite(["64KB"], names=["nope"], data_dir=tempfile.mkdtemp())
+
+
+def test_compare():
+    baseline = {
+        "results": {
+            "shannon@1MB": result(100.0, 100.0),
+            "check_csv@1MB": result(100.0, 100.0),
+            "only_in_baseline@1MB": result(100.0, 100.0),
+        }
+    }
+    current = {
+        "results": {
+            "shannon@1MB": result(95.0, 105.0),
+            "check_csv@1MB": result(80.0, 200.0),
+        }
+    }
+
+    lines, regressions = compare(baseline, current, tolerance=0.1)
+
+    assert len(lines) == 2
+    assert len(regressions) == 1
+    assert "check_csv@1MB" in regressions[0]
+    assert "throughput" in regressions[0] and "peak rss" in regressions[0]
+
+    _, regressions = compare(baseline, current, tolerance=0.5)
+    assert "peak rss" in regressions[0] and "throughput" not in regressions[0]
+
+
+def test_scenarios():
+    results = run_scenarios(["1MB"], data_dir=tempfile.mkdtemp())["results"]
+
+    assert sorted(results) == sorted(f"{name}@1MB" for name in SCENARIOS)
+    for name, measured in results.items():
+        assert measured["correct"], (name, measured["verdicts"])
+        assert measured["wall_seconds"] > 0
+        assert measured["peak_rss_mb"] > 0
+
+
+def test_is_correct():
+    passed = {"SmallSize": True, "NotEncrypted": True, "Keywords": True}
+    caught = {"SmallSize": True, "NotEncrypted": None, "Keywords": False}
+
+    assert is_correct(passed, ())
+    assert not is_correct(caught, ())
+    assert is_correct(caught, ("NotEncrypted", "Keywords"))
+    assert not is_correct(caught, ("NotEncrypted",))
+    assert not is_correct(passed, ("Keywords",))
+    # * a condition that never got to say anything is not a pass
+    assert not is_correct({"SmallSize": True, "Keywords": None}, ())
+
+
+def test_compare_verdicts():
+    baseline = {"results": {"encrypts@1MB": {**result(1.0, 1.0), "correct": True}}}
+    current = {"results": {"encrypts@1MB": {**result(1.0, 1.0), "correct": False}}}
+
+    _, regressions = compare(baseline, current, tolerance=0.1)
+    assert len(regressions) == 1 and "verdict" in regressions[0]
@@ -0,0 +1,81 @@
+import pytest  # type: ignore
+import tempfile
+import os
+
+from filter.conditions.utils.blocks import BlockReader
+
+
+@pytest.fixture(params=["1", "0"], ids=["mmap", "readinto"])
+def mmap_reads(request):
+    os.environ["MMAP_READS"] = request.param
+    yield request.param
+    del os.environ["MMAP_READS"]
+
+
+def write_temp(data: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(data)
+    return f.name
+
+
+def test_blocks_like_read_loop(mmap_reads):
+    data = bytes(range(256)) * 40 + b"tail"
+    file_loc = write_temp(data)
+
+    with BlockReader(file_loc, 1000) as reader:
+        assert reader.is_mapped == (mmap_reads == "1")
+        blocks = [bytes(block) for block in reader]
+        assert reader.bytes_read == len(data)
+
+    assert blocks == [data[i : i + 1000] for i in range(0, len(data), 1000)]
+
+    os.unlink(file_loc)
+
+
+def test_empty_file(mmap_reads):
+    file_loc = write_temp(b"")
+
+    with BlockReader(file_loc, 1000) as reader:
+        assert not reader.is_mapped
+        assert list(reader) == []
+
+    os.unlink(file_loc)
+
+
+def test_read_block(mmap_reads):
+    data = b"2+2=5" * 1000
+    file_loc = write_temp(data)
+
+    with BlockReader(file_loc, 100) as reader:
+        assert bytes(reader.read_block(4990)) == data[4990:]
+        assert bytes(reader.read_block(5, 10)) == data[5:15]
+
+    os.unlink(file_loc)
+
+
+@pytest.mark.parametrize("depth", [1, 3])
+def test_read_ahead(mmap_reads, depth):
+    data = bytes(range(256)) * 400
+    file_loc = write_temp(data)
+
+    with BlockReader(file_loc, 1000, depth=depth) as reader:
+        blocks = [bytes(block) for block in reader]
+
+    assert b"".join(blocks) == data
+    assert all(len(block) == 1000 for block in blocks[:-1])
+
+    os.unlink(file_loc)
+
+
+def test_read_ahead_stops_when_abandoned():
+    os.environ["MMAP_READS"] = "0"
+    file_loc = write_temp(b"2+2=5" * 10000)
+
+    with BlockReader(file_loc, 100, depth=2) as reader:
+        for i, block in enumerate(reader):
+            if i == 3:
+                break
+
+    assert reader._active is None
+    del os.environ["MMAP_READS"]
+    os.unlink(file_loc)
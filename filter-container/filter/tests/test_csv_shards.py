@@ -0,0 +1,113 @@
+import pytest  # type: ignore
+import threading
+import tempfile
+import logging
+import csv
+import io
+import os
+
+from filter.conditions.no_keywords import NoKeywords, check_csv_range
+from filter.conditions.utils import csv_shards
+from filter.conditions.utils.csv_shards import ShardPool, record_start
+from filter.tests.test_scan import make_job
+
+
+@pytest.fixture(autouse=True)
+def small_shards(monkeypatch):
+    os.environ["OUTPUTS"] = ""
+    os.environ["INPUTS"] = ""
+    os.environ["DIDS"] = "[]"
+    monkeypatch.setattr(csv_shards, "MIN_SHARD_SIZE", 1024)
+    monkeypatch.setenv("CSV_SHARD_MIN_SIZE", "1024")
+    monkeypatch.setenv("FILE_WORKERS", "4")
+    yield
+
+
+def quoted_csv(rows: int) -> bytes:
+    lines = ["id,comment,value"]
+    for i in range(rows):
+        # * quoted fields with newlines and doubled quotes in them
+        lines.append(f'{i},"line one\nline ""two""\nthree",{i * 7}')
+    return ("\n".join(lines) + "\n").encode()
+
+
+def write_temp(data: bytes) -> str:
+    fd, file_loc = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return file_loc
+
+
+def test_record_start_skips_quoted_newlines():
+    data = b'a,b\n1,"x\ny"\n2,z\n'
+    file_loc = write_temp(data)
+
+    # * offset 8 is inside the quoted field, the newline there does not count
+    assert record_start(file_loc, 8, True) == data.index(b"2,z")
+    assert record_start(file_loc, 0, False) == 4
+    assert record_start(file_loc, len(data) - 1, False) == len(data)
+
+
+def test_shards_start_on_record_boundaries():
+    data = quoted_csv(2000)
+    file_loc = write_temp(data)
+
+    with ShardPool(4) as pool:
+        shards = pool.record_shards(file_loc, 7)
+
+    assert len(shards) > 1
+    assert shards[0][0] == 0 and shards[-1][1] == len(data)
+    assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+
+    rows = []
+    for start, end in shards:
+        rows.extend(csv.reader(io.StringIO(data[start:end].decode())))
+    assert rows == list(csv.reader(io.StringIO(data.decode())))
+
+
+def test_range_verdict():
+    data = quoted_csv(10)
+    file_loc = write_temp(data)
+
+    verdict = check_csv_range(file_loc, 0, len(data), ["agri2"])
+    assert verdict.keyword is None
+    assert verdict.first_columns == verdict.max_columns == 3
+
+    verdict = check_csv_range(file_loc, 0, len(data), ["7"])
+    assert verdict.keyword == "7"
+
+
+@pytest.mark.parametrize(
+    "output, is_valid",
+    [
+        (quoted_csv(3000), True),
+        (quoted_csv(3000) + b'3000,"agri2",1\n', False),
+        (b"agri2,b\n" + quoted_csv(3000), False),
+        # * a ragged row makes pandas fail, which is the verdict we keep
+        (quoted_csv(3000) + b"1,2,3,4\n", False),
+    ],
+    ids=["clean", "keyword in the last shard", "keyword in the header", "ragged"],
+)
+def test_sharded_check_matches_pandas(output, is_valid, monkeypatch, caplog):
+    make_job(output)
+    file_loc = os.path.join(os.environ["OUTPUTS"], "out.csv")
+
+    with caplog.at_level(logging.INFO):
+        assert NoKeywords().check_csv(file_loc) == is_valid
+    assert "shards" in caplog.text
+
+    monkeypatch.setenv("FILE_WORKERS", "1")
+    assert NoKeywords().check_csv(file_loc) == is_valid
+
+
+_held = threading.Lock()
+
+
+def take_the_lock():
+    # * a forked worker would get the lock as held, by a thread it does not have
+    return _held.acquire(timeout=1)
+
+
+def test_workers_do_not_inherit_held_locks():
+    with _held, ShardPool(2) as pool:
+        assert pool.map(take_the_lock, [(), ()]) == [True, True]
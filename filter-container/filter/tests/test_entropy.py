@@ -0,0 +1,64 @@
+import pytest  # type: ignore
+import random
+from math import log2
+
+from filter.conditions.utils import EntropyAlgos, byte_histograms
+
+
+def reference_shannon(data: bytes) -> float:
+    """The original pure python implementation, byte by byte"""
+    entropy = 0.0
+
+    if data:
+        for count in (data.count(bytes([x])) for x in range(256)):
+            p_x = count / len(data)
+            if p_x > 0:
+                entropy -= p_x * log2(p_x)
+
+    return entropy / 8.0
+
+
+def test_shannon_bounds():
+    assert EntropyAlgos.shannon(b"") == 0.0
+    assert EntropyAlgos.shannon(100 * b"a") == 0.0
+    assert EntropyAlgos.shannon(bytes(range(256))) == pytest.approx(1.0)
+
+
+def test_shannon_matches_reference():
+    gibberish = b"2+2=5"
+    rnd = bytes(random.Random(0).getrandbits(8) for _ in range(5000))
+
+    for data in (gibberish, 100 * gibberish, rnd, bytearray(rnd), memoryview(rnd)):
+        assert EntropyAlgos.shannon(data) == pytest.approx(
+            reference_shannon(bytes(data))
+        )
+
+
+def test_shannon_of_more_than_a_batch():
+    # * counted in slices of HISTOGRAM_BATCH_BYTES, the last one partial
+    size = 3 * (1 << 16) + 1234
+    data = random.Random(1).getrandbits(8 * size).to_bytes(size, "little")
+    data += 5000 * b"a"
+
+    assert EntropyAlgos.shannon(data) == pytest.approx(reference_shannon(data))
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 1024, 4097, 10000, 20000])
+def test_shannon_blocks_matches_scalar(block_size):
+    """Last block is shorter, exactly like f.read(block_size) in a loop"""
+    r = random.Random(block_size)
+    data = bytes(r.getrandbits(5) for _ in range(12345))
+
+    blocks = [data[i : i + block_size] for i in range(0, len(data), block_size)]
+    entropies = EntropyAlgos.shannon_blocks(data, block_size)
+
+    assert len(entropies) == len(blocks)
+    assert list(entropies) == pytest.approx([reference_shannon(b) for b in blocks])
+    assert list(byte_histograms(data, block_size).sum(axis=1)) == [
+        len(b) for b in blocks
+    ]
+
+
+def test_shannon_blocks_invalid_block_size():
+    with pytest.raises(ValueError):
+        EntropyAlgos.shannon_blocks(b"2+2=5", 0)
@@ -0,0 +1,149 @@
+import pytest  # type: ignore
+import statistics
+import tempfile
+import random
+import os
+
+from filter.conditions.not_encrypted import NotEncrypted, RunningMean
+from filter.conditions.utils.metrics import ConditionMetrics, tracking
+from filter.conditions.utils.pyramid import clear_pyramids, get_pyramid
+
+MB = 1 << 20
+
+
+def write_output(data):
+    outputs = tempfile.mkdtemp()
+    file_loc = os.path.join(outputs, "out")
+    with open(file_loc, "wb") as f:
+        f.write(data)
+    return outputs, file_loc
+
+
+def text(size):
+    rng = random.Random(0)
+    words = [b"alpha", b"beta", b"gamma", b"delta", b"42", b"3.14", b"\n"]
+    data = b" ".join(rng.choice(words) for _ in range(size // 3))
+    return data[:size]
+
+
+def random_bytes(size, seed=0):
+    # * what random.Random(seed).randbytes(size) returns, which is 3.9+
+    return random.Random(seed).getrandbits(8 * size).to_bytes(size, "little")
+
+
+def alternating(size):
+    # * every other 1 KiB block is random, the others are all zeros
+    rng = random.Random(0)
+    blocks = [
+        rng.getrandbits(8 * 1024).to_bytes(1024, "little") if i % 2 else bytes(1024)
+        for i in range(size // 1024)
+    ]
+    return b"".join(blocks)
+
+
+@pytest.fixture(autouse=True)
+def statistical(monkeypatch):
+    clear_pyramids()
+    monkeypatch.setenv("ENTROPY_MODE", "statistical")
+    monkeypatch.delenv("ENCRYPTION_ENTROPY_THRESH", raising=False)
+    yield
+    clear_pyramids()
+
+
+def check(outputs, monkeypatch):
+    monkeypatch.setenv("OUTPUTS", outputs)
+    condition = NotEncrypted()
+    return condition(), condition
+
+
+def test_running_mean():
+    rng = random.Random(1)
+    values = [rng.random() for _ in range(100)]
+    stats = RunningMean()
+    for value in values:
+        stats.add(value)
+
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.variance == pytest.approx(statistics.variance(values))
+    assert stats.half_width(3.0, 100) == 0
+    assert stats.half_width(3.0, 1000) > 0
+
+
+@pytest.mark.parametrize(
+    "data, is_valid",
+    [(text(4 * MB), True), (random_bytes(4 * MB), False)],
+    ids=["text", "random"],
+)
+def test_stops_early(data, is_valid, monkeypatch):
+    monkeypatch.setenv("ENTROPY_SAMPLE_BUDGET", "2048")
+    outputs, file_loc = write_output(data)
+
+    valid, condition = check(outputs, monkeypatch)
+
+    assert valid is is_valid
+    assert condition.modes == {file_loc: "sequential"}
+    assert len(condition.results) < 2048
+
+
+def test_large_files_are_sampled(monkeypatch):
+    monkeypatch.setenv("ENTROPY_SAMPLE_BUDGET", "128")
+    outputs, file_loc = write_output(text(4 * MB))
+
+    is_valid, condition = check(outputs, monkeypatch)
+
+    assert is_valid
+    assert condition.modes == {file_loc: "sampled"}
+    assert len(condition.results) <= 128
+
+    # * the same blocks every time
+    _, again = check(outputs, monkeypatch)
+    assert again.results == condition.results
+
+
+def test_falls_back_to_every_block(monkeypatch):
+    monkeypatch.setenv("ENTROPY_SAMPLE_BUDGET", "128")
+    outputs, file_loc = write_output(alternating(2 * MB))
+
+    monkeypatch.setenv("ENTROPY_MODE", "exact")
+    exact_valid, exact = check(outputs, monkeypatch)
+    mean = sum(r.entropy for r in exact.results) / len(exact.results)
+    assert exact_valid
+    clear_pyramids()
+
+    # * right at the mean, no sample can tell which side of it the file is on
+    monkeypatch.setenv("ENTROPY_MODE", "statistical")
+    monkeypatch.setenv("ENCRYPTION_ENTROPY_THRESH", str(mean - 1e-6))
+    is_valid, condition = check(outputs, monkeypatch)
+
+    assert is_valid is False
+    assert condition.modes == {file_loc: "exact"}
+    assert len(condition.results) == len(exact.results)
+
+
+def test_cached_histograms_are_scored_exactly(monkeypatch):
+    outputs, file_loc = write_output(text(1 * MB))
+    get_pyramid(file_loc)
+
+    metrics = ConditionMetrics("NotEncrypted")
+    with tracking(metrics):
+        is_valid, condition = check(outputs, monkeypatch)
+
+    assert is_valid
+    assert condition.modes == {file_loc: "exact"}
+    assert metrics.reads == {}
+
+
+def test_mode_in_the_report(monkeypatch):
+    monkeypatch.setenv("ENTROPY_SAMPLE_BUDGET", "2048")
+    outputs, file_loc = write_output(text(4 * MB))
+
+    metrics = ConditionMetrics("NotEncrypted")
+    with tracking(metrics):
+        is_valid, condition = check(outputs, monkeypatch)
+
+    modes = metrics.report()["details"]["entropy_modes"]
+    assert modes[file_loc]["mode"] == "sequential"
+    assert modes[file_loc]["blocks_scored"] == len(condition.results)
+    assert modes[file_loc]["blocks"] == 2048
+    # * only the scored blocks were read
+    assert 0 < metrics.reads[file_loc] < 4 * MB
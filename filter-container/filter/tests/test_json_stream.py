@@ -0,0 +1,202 @@
+import pytest  # type: ignore
+import logging
+import random
+import json
+import os
+
+from filter.conditions.no_keywords import NoKeywords, check_ndjson_range
+from filter.conditions.utils import csv_shards
+from filter.conditions.utils.csv_shards import ShardPool, line_start
+from filter.conditions.utils.json_stream import JsonError, iter_json_events
+from filter.tests.test_scan import make_job
+
+
+@pytest.fixture(autouse=True)
+def small_shards(monkeypatch):
+    os.environ["OUTPUTS"] = ""
+    os.environ["INPUTS"] = ""
+    os.environ["DIDS"] = "[]"
+    monkeypatch.setattr(csv_shards, "MIN_SHARD_SIZE", 1024)
+    monkeypatch.setenv("NDJSON_SHARD_MIN_SIZE", str(1 << 40))
+    monkeypatch.setenv("READ_BUFFER_SIZE", "64")
+    yield
+
+
+def in_blocks(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(7 if depth < 4 else 4)
+    if kind == 0:
+        return rng.choice([True, False, None])
+    if kind == 1:
+        return rng.choice([0, -12, 3.5, 1e-7, 12345678901234567890])
+    if kind in (2, 3):
+        return "".join(rng.choices('ab "\\/\n\té€\U0001f600', k=rng.randrange(8)))
+    if kind == 4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return {
+        random_value(rng, 4) if kind == 5 else "k": random_value(rng, depth + 1)
+        for _ in range(rng.randrange(4))
+    }
+
+
+def rebuild(events):
+    """Builds the document back from the events"""
+    stack, keys = [[]], []
+    for event, value in events:
+        if event in ("start_map", "start_array"):
+            stack.append({} if event == "start_map" else [])
+            continue
+        if event == "map_key":
+            keys.append(value)
+            continue
+        if event in ("end_map", "end_array"):
+            value = stack.pop()
+        top = stack[-1]
+        if isinstance(top, dict):
+            top[keys.pop()] = value
+        else:
+            top.append(value)
+    return stack[0][0]
+
+
+def test_events_match_json_loads():
+    rng = random.Random(7)
+
+    for _ in range(300):
+        value = random_value(rng)
+        text = json.dumps(
+            value, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 1])
+        )
+        data = text.encode()
+
+        for size in (1, 3, 17, len(data) + 1):
+            assert rebuild(iter_json_events(in_blocks(data, size))) == json.loads(text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        " ",
+        "{",
+        '{"a" 1}',
+        "[1,]",
+        '{"a":1,}',
+        "[1] 2",
+        "tru",
+        '"abc',
+        "{1:2}",
+        "[1 2]",
+        '"\\x"',
+        "[01]",
+        "[1.]",
+        "{}}",
+        '["\x01"]',
+        "agri1",
+        "[1]]",
+        "[NaN]",
+    ],
+)
+def test_invalid_json(text):
+    data = text.encode()
+
+    for size in (1, 2, 100):
+        with pytest.raises(JsonError):
+            list(iter_json_events(in_blocks(data, size)))
+
+
+def test_line_start():
+    data = b'{"a": 1}\n{"b": 2}\n\n{"c": 3}\n'
+    file_loc = os.path.join(make_job(data, "out.json")[1], "out.json")
+
+    assert line_start(file_loc, 0) == 0
+    assert line_start(file_loc, 1) == 9
+    assert line_start(file_loc, 9) == 9
+    assert line_start(file_loc, 10) == 18
+    assert line_start(file_loc, len(data)) == len(data)
+
+
+def ndjson(records: int, extra: str = "") -> bytes:
+    lines = [
+        json.dumps({"id": i, "comment": 'line one\nline "two"', "tags": ["x", i]})
+        for i in range(records)
+    ]
+    return ("\n".join(lines) + "\n" + extra).encode()
+
+
+@pytest.mark.parametrize(
+    "output, is_valid",
+    [
+        (b'{"id": 1, "tags": ["a", {"b": null}], "v": 2.5e3}', True),
+        (b'{"id": 1, "tags": ["a", {"agri1": null}], "v": 2.5e3}', False),
+        (b'{"id": 1, "tags": ["a", {"b": "xagri2x"}]}', False),
+        # * escaped, agri3
+        (b'{"id": 1, "tags": ["a", {"b": "agri\\u0033"}]}', False),
+        (b'{\n  "id": 1,\n  "tags": ["agri1"]\n}\n', False),
+        (b'{\n  "id": 1,\n  "tags": ["agri"]\n}\n', True),
+        # * repeated keys, json.loads would keep the last value only
+        (b'[{"a": "agri1", "a": "b"}, "x"]', False),
+        (b'{"a": "agri1", "a": "b"}\n', False),
+        # * keywords are looked for in strings only
+        (b"[31, true]", True),
+        (b"this is agri1 text", False),
+        (b"just text", False),
+        (b'{"a": 1} {"b": 2}', False),
+        (json.dumps([{"a": "line one", "b": [1, 2]}] * 50).encode(), True),
+        (
+            json.dumps([{"a": "line one", "b": [1, 2]}] * 50 + ["xxagri1"]).encode(),
+            False,
+        ),
+        (ndjson(200), True),
+        (ndjson(200, '{"comment": "agri\\u0032"}\n'), False),
+        (ndjson(200, '{"comment": agri2}\n'), False),
+        (ndjson(200, "\n\n"), True),
+    ],
+)
+def test_check_json(output, is_valid):
+    make_job(output, "out.json")
+
+    assert NoKeywords()() == is_valid
+
+
+@pytest.mark.parametrize(
+    "output, is_valid",
+    [
+        (ndjson(3000), True),
+        (ndjson(3000, '{"comment": "agri2"}\n'), False),
+        (ndjson(3000).replace(b'"id": 1500', b'"agri1": 1500'), False),
+        (ndjson(3000, '{"comment": "unterminated}\n'), False),
+    ],
+    ids=["clean", "keyword in the last shard", "keyword in a key", "invalid"],
+)
+def test_sharded_ndjson(output, is_valid, monkeypatch, caplog):
+    monkeypatch.setenv("NDJSON_SHARD_MIN_SIZE", "1024")
+    monkeypatch.setenv("FILE_WORKERS", "4")
+    make_job(output, "out.json")
+    file_loc = os.path.join(os.environ["OUTPUTS"], "out.json")
+
+    with caplog.at_level(logging.INFO):
+        assert NoKeywords().check_json(file_loc) == is_valid
+    assert "shards" in caplog.text
+
+    monkeypatch.setenv("FILE_WORKERS", "1")
+    assert NoKeywords().check_json(file_loc) == is_valid
+
+
+def test_ndjson_shards_cover_the_file(monkeypatch):
+    data = ndjson(3000)
+    file_loc = os.path.join(make_job(data, "out.json")[1], "out.json")
+
+    with ShardPool(4) as pool:
+        shards = pool.line_shards(file_loc)
+
+    assert len(shards) == 4
+    assert shards[0][0] == 0 and shards[-1][1] == len(data)
+    for (_, end), (start, _) in zip(shards, shards[1:]):
+        assert end == start and data[start - 1 : start] == b"\n"
+
+    for start, end in shards:
+        assert check_ndjson_range(file_loc, start, end, ["agri1"]) is None
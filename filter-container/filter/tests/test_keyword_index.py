@@ -0,0 +1,118 @@
+import pytest  # type: ignore
+import os
+import shutil
+import tempfile
+
+from filter.conditions import no_keywords
+from filter.conditions.no_keywords import NoKeywords
+from filter.conditions.utils.keyword_index import (
+    DEFAULT_KEYWORDS_YAML,
+    KeywordIndex,
+    KeywordIndexError,
+    compile_keyword_index,
+    load_keyword_index,
+)
+from filter.conditions.utils.keywords import keyword_automaton
+
+BIG_CATEGORY = [f"keyword{i:04d}" for i in range(200)]
+
+
+@pytest.fixture
+def config():
+    """A copy of the keywords config with a category large enough for the gram
+    filter, and its index
+    """
+    directory = tempfile.mkdtemp()
+    yaml_path = os.path.join(directory, "no_keywords.yaml")
+    shutil.copy(DEFAULT_KEYWORDS_YAML, yaml_path)
+    with open(yaml_path, "a") as f:
+        f.write(f"  big:\n    keywords:\n      many: [{', '.join(BIG_CATEGORY)}]\n")
+
+    path = os.path.join(directory, "no_keywords.index")
+    compile_keyword_index(yaml_path, path)
+    yield yaml_path, path
+    shutil.rmtree(directory)
+
+
+def test_keywords_and_automata(config):
+    yaml_path, path = config
+    index = load_keyword_index(path, yaml_path)
+
+    assert index is not None
+    assert index.keywords("development", "agricultureBioEngineering") == [
+        "agri1",
+        "agri2",
+        "agri3",
+    ]
+    assert index.keywords("big", "many") == BIG_CATEGORY
+    with pytest.raises(KeyError):
+        index.keywords("development", "sociology")
+    with pytest.raises(KeyError):
+        index.keywords("testing", "mathematics")
+
+    automaton = index.automaton("big", "many")
+    assert automaton.search("xx keyword0123 yy") == "keyword0123"
+    assert automaton.search("keyword") is None
+    assert index.automaton("big", "many") is automaton
+
+    index.use_automaton("big", "many")
+    assert keyword_automaton(reversed(BIG_CATEGORY)) is automaton
+
+
+def test_built_with_other_settings(config, monkeypatch):
+    yaml_path, path = config
+    monkeypatch.setenv("KEYWORD_MAX_EDITS", "1")
+    index = load_keyword_index(path, yaml_path)
+
+    index.use_automaton("development", "mathematics")
+    automaton = keyword_automaton(index.keywords("development", "mathematics"))
+    assert automaton is not index.automaton("development", "mathematics")
+    assert automaton.fuzzy
+
+
+def test_stale_or_damaged(config):
+    yaml_path, path = config
+
+    with open(yaml_path, "a") as f:
+        f.write("  more: {}\n")
+    assert load_keyword_index(path, yaml_path) is None
+    with pytest.raises(KeywordIndexError):
+        KeywordIndex(path, "not the digest")
+    assert KeywordIndex(path).keywords("big", "many") == BIG_CATEGORY
+
+    for data in (b"", b"KWINDEX\x00\x10", b"something else entirely"):
+        with open(path, "wb") as f:
+            f.write(data)
+        assert load_keyword_index(path, yaml_path) is None
+
+    assert load_keyword_index(path + ".missing", yaml_path) is None
+
+
+def test_no_keywords_uses_the_index(monkeypatch):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "no_keywords.index")
+    outputs = tempfile.mkdtemp()
+
+    monkeypatch.setenv("DATA_CATEGORIES", '["Agriculture & Bio Engineering"]')
+    monkeypatch.setenv("OUTPUTS", outputs)
+    monkeypatch.setenv("DIDS", '["a12345678"]')
+    monkeypatch.setattr(no_keywords, "DEFAULT_KEYWORD_INDEX", path)
+
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("0,1,2,3\nagri1,0,0,0")
+
+    # * without an index, the config is parsed
+    nk = NoKeywords()
+    assert nk.index is None and nk.config is not None
+    assert nk() == False
+
+    compile_keyword_index(DEFAULT_KEYWORDS_YAML, path)
+    nk = NoKeywords()
+    assert nk.index is not None and nk.config is None
+    assert nk() == False
+
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("0,1,2,3\nagri,0,0,0")
+    assert nk() == True
+
+    shutil.rmtree(directory)
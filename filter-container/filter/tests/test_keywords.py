@@ -0,0 +1,203 @@
+import pytest  # type: ignore
+import random
+
+from filter.conditions.utils import keywords as keywords_module
+from filter.conditions.utils.canonical import canonicalize
+from filter.conditions.no_keywords import find_keyword_in_blocks
+from filter.conditions.utils.keywords import (
+    FuzzyKeywordIndex,
+    KeywordAutomaton,
+    keyword_automaton,
+)
+
+
+def brute_force_matches(keywords, text):
+    data = text.encode()
+    return sorted(
+        (i, k)
+        for k in set(keywords)
+        for i in range(len(data))
+        if data.startswith(k.encode(), i)
+    )
+
+
+def brute_force_search(keywords, text):
+    matches = brute_force_matches(keywords, text)
+    if not matches:
+        return None
+    start = matches[0][0]
+    return min((k for i, k in matches if i == start), key=len)
+
+
+def test_finds_keywords_anywhere():
+    automaton = KeywordAutomaton(["he", "she", "his", "hers", "fractals"])
+
+    assert automaton.search("fractals123") == "fractals"
+    assert automaton.search("ushers") == "she"
+    assert automaton.search("nothing here") == "he"
+    assert automaton.search("nope") is None
+    assert list(automaton.iter_matches("ushers")) == [
+        (1, "she"),
+        (2, "he"),
+        (2, "hers"),
+    ]
+
+
+def test_raw_bytes():
+    automaton = KeywordAutomaton(["agri1", "é1"])
+
+    assert automaton.search(b"0,agri1,2") == "agri1"
+    assert automaton.search(memoryview("0,xé1".encode())) == "é1"
+    assert automaton.search(bytearray(b"0,agri2")) is None
+
+
+@pytest.mark.parametrize("keywords", [3, 10, 200], ids=["regex", "regex", "grams"])
+def test_matches_brute_force(keywords):
+    rng = random.Random(keywords)
+
+    for _ in range(200):
+        kws = [
+            "".join(rng.choices("abcdé", k=rng.randint(1, 9))) for _ in range(keywords)
+        ]
+        text = "".join(rng.choices("abcdéxyz ", k=rng.randint(0, 300)))
+        automaton = KeywordAutomaton(kws)
+
+        assert automaton.search(text) == brute_force_search(kws, text)
+        assert sorted(automaton.iter_matches(text)) == brute_force_matches(kws, text)
+
+
+def test_keyword_across_search_windows(monkeypatch):
+    monkeypatch.setattr(keywords_module, "SEARCH_WINDOW_SIZE", 16)
+    kws = [f"keyword{i:03d}" for i in range(100)]
+    automaton = KeywordAutomaton(kws)
+
+    for offset in range(0, 40):
+        text = "x" * offset + "keyword042" + "y" * 20
+        assert automaton.search(text) == "keyword042"
+
+
+def test_built_once():
+    assert keyword_automaton(["b", "a"]) is keyword_automaton(["a", "b", "a"])
+    assert not KeywordAutomaton([])
+    assert KeywordAutomaton([]).search("anything") is None
+
+
+def test_fuzzy_matches():
+    automaton = KeywordAutomaton(["fractals", "chaosTheory", "pdes"], 1)
+
+    assert automaton.fuzzy
+    assert automaton.search("a fr4ctals b") == "fractals"
+    assert automaton.search("a,fractal,b") == "fractals"
+    assert automaton.search("chaosTheoryy") == "chaosTheory"
+    # * exact matches are found anywhere, fuzzy ones are whole tokens
+    assert automaton.search("xxfractalsxx") == "fractals"
+    assert automaton.search("xxfr4ctalsxx") is None
+    # * two edits, and too short to be matched fuzzily
+    assert automaton.search("frcatals pdez") is None
+
+    assert not KeywordAutomaton(["fractals"]).fuzzy
+    assert KeywordAutomaton(["fractals"]).search("fr4ctals") is None
+
+
+@pytest.mark.parametrize("max_edits", [1, 2])
+def test_fuzzy_matches_brute_force(max_edits):
+    rng = random.Random(max_edits)
+    keywords = ["fractals", "fourier", "agri1", "goodStuff", "mathIsTheBest"]
+    index = FuzzyKeywordIndex(keywords, max_edits)
+
+    def distance(a, b):
+        row = list(range(len(b) + 1))
+        for i, x in enumerate(a, 1):
+            prev, row[0] = row[0], i
+            for j, y in enumerate(b, 1):
+                prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (x != y))
+        return row[-1]
+
+    for _ in range(2000):
+        token = list(rng.choice(keywords))
+        for _ in range(rng.randint(0, 3)):
+            i = rng.randrange(len(token) + 1)
+            op = rng.randrange(3)
+            if op == 0:
+                token.insert(i, rng.choice("ab4_"))
+            elif i < len(token):
+                if op == 1:
+                    del token[i]
+                else:
+                    token[i] = rng.choice("ab4_")
+        token = "".join(token)
+
+        close = [k for k in keywords if distance(token, k) <= max_edits]
+        found = index.search(f"x, {token} .y")
+        assert (found is not None) == bool(close), token
+        if found is not None:
+            assert found in close
+
+
+def test_fuzzy_keyword_across_blocks(monkeypatch):
+    monkeypatch.setenv("KEYWORD_MAX_EDITS", "1")
+    automaton = keyword_automaton(["fractals", "chaos theory"])
+    text = b"y" * 30 + b" fr4ctals " + b"z" * 40 + b"chaos theory"
+
+    for size in (1, 2, 5, 16):
+        blocks = [text[i : i + size] for i in range(0, len(text), size)]
+        assert find_keyword_in_blocks(automaton, blocks) == "fractals"
+        blocks = [text[i : i + size] for i in range(40, len(text), size)]
+        assert find_keyword_in_blocks(automaton, blocks) == "chaos theory"
+
+    # * a cut token is not taken for a whole one
+    long_token = b"fractal" + b"q" * 50
+    for size in (1, 3, 8):
+        blocks = [long_token[i : i + size] for i in range(0, len(long_token), size)]
+        assert find_keyword_in_blocks(automaton, blocks) is None
+
+
+def test_canonicalize():
+    assert canonicalize("F.R.4.C.T-A_L$") == b"fractals"
+    assert canonicalize(b'Chaos Theory,\x00"x"\n') == b'chaos theory,\x00"x"\n'
+    # * cyrillic a, fullwidth letters, a zero width space and an accent
+    assert canonicalize("fr\u0430ctals") == b"fractals"
+    assert (
+        canonicalize("\uff26\uff32\uff21\uff23\uff34\uff21\uff2c\uff33") == b"fractals"
+    )
+    assert canonicalize("fra\u200bct\u00e0ls") == b"fractals"
+    # * bytes that are not utf-8 are carried through
+    assert canonicalize(b"\xff\xfeAB\xc3") == b"\xff\xfeab\xc3"
+
+    text = "".join(
+        random.Random(0).choice("aB4.-\u0430\u00e0 \u200b") for _ in range(500)
+    )
+    assert canonicalize(canonicalize(text)) == canonicalize(text)
+
+
+def test_canonical_matches():
+    keywords = ["fractals", "chaosTheory", "agri1"]
+    automaton = KeywordAutomaton(keywords, canonical=True)
+
+    assert automaton.search("a F.R.4.C.T.A.L.S b") == "fractals"
+    assert automaton.search("CHAOS-THEORY") == "chaosTheory"
+    assert automaton.search("agr11") == "agri1"
+    assert automaton.search("fr\u0430ctals".encode()) == "fractals"
+    # * whitespace still separates words
+    assert automaton.search("chaos theory") is None
+    assert automaton.search("frac tals") is None
+
+    plain = KeywordAutomaton(keywords)
+    assert plain.search("a F.R.4.C.T.A.L.S b") is None
+    assert plain.search("agr11") is None
+
+    fuzzy = KeywordAutomaton(keywords, 1, canonical=True)
+    assert fuzzy.search("FR4CT-ALZ") == "fractals"
+
+
+def test_canonical_keyword_across_blocks(monkeypatch):
+    monkeypatch.setenv("KEYWORD_CANONICALIZE", "1")
+    automaton = keyword_automaton(["fractals"])
+    text = b"y" * 30 + b"F.r.4.c.t.4.l.5" + b"z" * 30
+
+    for size in (1, 2, 5, 16):
+        blocks = [text[i : i + size] for i in range(0, len(text), size)]
+        assert find_keyword_in_blocks(automaton, blocks) == "fractals"
+
+    monkeypatch.setenv("KEYWORD_CANONICALIZE", "0")
+    assert find_keyword_in_blocks(keyword_automaton(["fractals"]), [text]) is None
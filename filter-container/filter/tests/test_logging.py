@@ -0,0 +1,96 @@
+import subprocess
+import tempfile
+import logging
+import sys
+import os
+
+import filter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_python(code, **env):
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env={**os.environ, "PYTHONPATH": ROOT, **env},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+
+def test_level_defaults_to_info():
+    code = "import filter, logging; print(logging.getLogger().level)"
+
+    assert run_python(code).stdout.strip() == str(logging.INFO)
+    assert run_python(code, LOG_LEVEL="debug").stdout.strip() == str(logging.DEBUG)
+    assert run_python(code, LOG_LEVEL="5").stdout.strip() == "5"
+    assert run_python(code, LOG_LEVEL="loud").stdout.strip() == str(logging.INFO)
+
+
+def test_queued_records_are_written_on_exit():
+    code = (
+        "import filter, logging\n"
+        "for i in range(1000):\n"
+        "    logging.getLogger('[test]').info('record %d', i)\n"
+    )
+    for log_queue in ("1", "0"):
+        done = run_python(code, LOG_QUEUE=log_queue)
+
+        assert done.returncode == 0, done.stderr
+        lines = [s for s in done.stdout.splitlines() if "[test]" in s]
+        assert len(lines) == 1000
+        assert "record 999" in lines[-1]
+
+
+def test_forked_processes_log():
+    code = (
+        "import filter, logging, multiprocessing\n"
+        "def child():\n"
+        "    logging.getLogger('[test]').info('from the child')\n"
+        "p = multiprocessing.get_context('fork').Process(target=child)\n"
+        "p.start()\n"
+        "p.join()\n"
+    )
+    done = run_python(code)
+
+    assert done.returncode == 0, done.stderr
+    assert "from the child" in done.stdout
+
+
+def test_formatting_is_deferred():
+    class Costly:
+        formatted = 0
+
+        def __str__(self):
+            Costly.formatted += 1
+            return "costly"
+
+    record = logging.LogRecord("test", logging.INFO, "", 0, "%s", (Costly(),), None)
+
+    # * put on the queue as is, formatted by the logging thread
+    assert filter.DeferredQueueHandler(None).prepare(record) is record
+    assert Costly.formatted == 0
+
+    # * and not at all below the level
+    logging.getLogger("[test]").debug("%s", Costly())
+    assert Costly.formatted == 0
+
+
+def test_main_does_not_log_the_environment():
+    inputs, outputs = tempfile.mkdtemp(), tempfile.mkdtemp()
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("a" * 1000)
+
+    done = run_python(
+        "import filter.main; filter.main.main()",
+        INPUTS=inputs,
+        OUTPUTS=outputs,
+        LOG_LEVEL="DEBUG",
+        SECRET_TOKEN="do-not-log-me",
+    )
+
+    assert done.returncode == 0, done.stderr
+    assert "SmallSize condition not met" in done.stdout
+    assert "do-not-log-me" not in done.stdout
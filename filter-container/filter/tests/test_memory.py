@@ -0,0 +1,201 @@
+import pytest  # type: ignore
+import tempfile
+import tracemalloc
+import time
+import os
+
+from filter.benchmarks.scenarios import fresh_outputs, make_job, run_job
+from filter.benchmarks.suite import DEFAULT_DATA_DIR, parse_size
+from filter.conditions.utils.cancel import raise_if_cancelled
+from filter.conditions.utils.memory import current_rss_mb, watching
+from filter.conditions.utils.metrics import ConditionMetrics, tracking
+from filter.runner import ConditionRunner
+import filter.main
+
+MB = 1 << 20
+
+# * the ceilings are checked on a generated job, which takes a while. Set
+# * MEMORY_TEST=1 to run them, and MEMORY_TEST_SIZE for the size of its input
+DEFAULT_MEMORY_TEST_SIZE = "256MB"
+
+# * MB a condition may add to the RSS of the pod, and to the python allocations,
+# * while it checks a job, whatever the size of the job. numpy is imported by
+# * the first condition that needs it and counts against it
+MEMORY_CEILINGS_MB = {
+    "SmallSize": {"rss": 16, "traced": 4},
+    "NotEncrypted": {"rss": 96, "traced": 64},
+    "Correlation": {"rss": 96, "traced": 64},
+    "Keywords": {"rss": 96, "traced": 64},
+}
+
+
+class Allocating:
+    """A condition that holds on to size bytes for a while, or until it is
+    cancelled
+    """
+
+    name = "allocating"
+
+    def __init__(self, size, seconds=10.0):
+        self.size = size
+        self.seconds = seconds
+
+    def __call__(self):
+        # * written to, so that the pages are resident
+        data = b"x" * self.size
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            raise_if_cancelled()
+            time.sleep(0.01)
+        return bool(data)
+
+
+def test_watching_sees_the_peak():
+    with watching() as watch:
+        data = b"x" * (64 * MB)
+        time.sleep(0.05)
+        del data
+
+    assert watch.rss_peak_mb - watch.rss_start_mb >= 48
+    assert watch.traced_peak_mb is None
+    assert not watch.overlapped
+    assert not watch.over_ceiling
+
+
+def test_watching_traces_the_allocations():
+    tracemalloc.start()
+    try:
+        with watching() as watch:
+            data = b"x" * (32 * MB)
+            del data
+    finally:
+        tracemalloc.stop()
+
+    # * exact, even though the block is shorter than the sampling interval
+    assert watch.traced_peak_mb - watch.traced_start_mb >= 32
+
+
+def test_traced_peak_is_sampled_without_reset_peak(monkeypatch):
+    # * as on 3.8
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    tracemalloc.start()
+    try:
+        with watching() as watch:
+            data = b"x" * (32 * MB)
+            time.sleep(0.05)
+            del data
+    finally:
+        tracemalloc.stop()
+
+    assert watch.traced_peak_mb - watch.traced_start_mb >= 32
+
+
+def test_watches_that_overlap():
+    with watching() as outer:
+        with watching() as inner:
+            pass
+
+    assert outer.overlapped and inner.overlapped
+
+
+def test_memory_in_the_report():
+    metrics = ConditionMetrics("test")
+
+    with tracking(metrics, wall=True):
+        pass
+
+    memory = metrics.report()["memory"]
+    assert memory["rss_peak_mb"] >= memory["rss_start_mb"] > 0
+    assert memory["ceiling_mb"] is None
+    assert not metrics.over_ceiling
+
+
+def test_condition_over_the_ceiling_fails(monkeypatch):
+    monkeypatch.setenv("MEMORY_CEILING_MB", str(current_rss_mb() + 64))
+    runner = ConditionRunner([Allocating(128 * MB)])
+
+    start = time.monotonic()
+    assert not runner()
+    assert time.monotonic() - start < 5
+
+    assert runner.results == {"allocating": False}
+    assert runner.metrics["allocating"].over_ceiling
+
+
+def test_condition_under_the_ceiling(monkeypatch):
+    monkeypatch.setenv("MEMORY_CEILING_MB", str(current_rss_mb() + 256))
+    runner = ConditionRunner([Allocating(16 * MB, seconds=0.1)])
+
+    assert runner()
+    assert runner.metrics["allocating"].memory["ceiling_mb"] > 0
+    assert not runner.metrics["allocating"].over_ceiling
+
+
+def job_outputs(monkeypatch):
+    inputs, outputs = tempfile.mkdtemp(), tempfile.mkdtemp()
+    with open(os.path.join(inputs, "0"), "w") as f:
+        f.write("a" * 1000)
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("data")
+    monkeypatch.setenv("INPUTS", inputs)
+    monkeypatch.setenv("OUTPUTS", outputs)
+    return outputs
+
+
+def test_small_size_over_the_ceiling_fails(monkeypatch):
+    outputs = job_outputs(monkeypatch)
+    monkeypatch.setenv("MEMORY_CEILING_MB", str(current_rss_mb() + 64))
+    monkeypatch.setattr(filter.main, "load_condition", lambda *_: Allocating(128 * MB))
+
+    assert filter.main.main() == {"allocating": False}
+    assert os.listdir(outputs) == ["output.txt"]
+
+
+def test_scan_over_the_ceiling_fails(monkeypatch):
+    outputs = job_outputs(monkeypatch)
+    monkeypatch.setenv("CONDITION_POOL", "thread")
+    monkeypatch.setenv("MEMORY_CEILING_MB", str(current_rss_mb() + 64))
+
+    def scan(conditions):
+        Allocating(128 * MB)()
+
+    monkeypatch.setattr(filter.main, "scan", scan)
+
+    start = time.monotonic()
+    verdicts = filter.main.main()
+    assert time.monotonic() - start < 5
+
+    assert verdicts == {
+        "SmallSize": True,
+        "NotEncrypted": False,
+        "Correlation": False,
+        "Keywords": False,
+    }
+    assert os.listdir(outputs) == ["output.txt"]
+
+
+@pytest.mark.skipif(
+    os.getenv("MEMORY_TEST", "0") == "0", reason="set MEMORY_TEST=1 to run it"
+)
+def test_conditions_stay_under_their_ceilings():
+    size = parse_size(os.getenv("MEMORY_TEST_SIZE", DEFAULT_MEMORY_TEST_SIZE))
+    job = make_job("non_violating", size, DEFAULT_DATA_DIR)
+    outputs = fresh_outputs(job, tempfile.mkdtemp())
+
+    # * one condition at a time, reading the files on its own, so that what the
+    # * pod uses is down to that condition alone
+    measured = run_job(
+        job,
+        outputs,
+        {"SHARED_SCAN": "0", "CONDITION_WORKERS": "1", "MEMORY_TRACE": "1"},
+    )
+
+    assert all(measured["verdicts"].values()), measured["verdicts"]
+    for name, ceilings in MEMORY_CEILINGS_MB.items():
+        memory = measured["conditions"][name]["memory"]
+        assert not memory["overlapped"], name
+
+        rss = memory["rss_peak_mb"] - memory["rss_start_mb"]
+        traced = memory["traced_peak_mb"] - memory["traced_start_mb"]
+        assert rss <= ceilings["rss"], f"{name} added {rss:.1f}MB of RSS"
+        assert traced <= ceilings["traced"], f"{name} allocated {traced:.1f}MB"
@@ -0,0 +1,159 @@
+import pytest  # type: ignore
+import tempfile
+import pickle
+import json
+import os
+
+from filter.conditions.utils.blocks import BlockReader
+from filter.conditions.utils.metrics import (
+    ConditionMetrics,
+    get_metrics,
+    record_read,
+    tracking,
+)
+from filter.conditions.utils.parallel import ordered_map
+from filter.runner import ConditionRunner
+import filter.main
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def read_all(file_loc):
+    with BlockReader(file_loc, 1024) as reader:
+        for _ in reader:
+            pass
+    return True
+
+
+@pytest.fixture
+def job(monkeypatch):
+    root = tempfile.mkdtemp()
+    inputs, outputs = os.path.join(root, "inputs"), os.path.join(root, "outputs")
+    rows = "".join(f"{i},{i * 7 % 13},row {i}\n" for i in range(2000))
+    write(os.path.join(inputs, "did", "0"), ("a,b,c\n" + rows).encode())
+    write(os.path.join(outputs, "out.csv"), b"count\n" + 100 * b"1\n")
+
+    monkeypatch.setenv("INPUTS", inputs)
+    monkeypatch.setenv("OUTPUTS", outputs)
+    monkeypatch.setenv("DIDS", '["did"]')
+    monkeypatch.setenv("DATA_CATEGORIES", '["Mathematics"]')
+    return root
+
+
+def test_reads_are_grouped():
+    metrics = ConditionMetrics("test")
+    metrics.add_read("/in/did/0", 100)
+    metrics.add_read("/in/did/0", 50)
+    metrics.add_read("/out/out.csv", 10)
+    metrics.add_read("/elsewhere", 1)
+    metrics.wall_seconds = 1.0
+
+    report = metrics.report(inputs="/in", outputs="/out")
+
+    assert report["bytes_read"] == {"inputs": 150, "outputs": 10, "other": 1}
+    assert report["files_read"] == 3
+    assert report["mb_per_s"] == pytest.approx(161 / (1 << 20), abs=1e-3)
+
+
+def test_tracking():
+    file_loc = write(os.path.join(tempfile.mkdtemp(), "f"), 5000 * b"a")
+    metrics = ConditionMetrics("test")
+
+    record_read(file_loc, 10)
+    with tracking(metrics, wall=True):
+        assert get_metrics() is metrics
+        read_all(file_loc)
+    assert get_metrics() is None
+
+    assert metrics.reads == {file_loc: 5000}
+    assert metrics.wall_seconds > 0
+    assert metrics.peak_rss_mb > 0
+
+    with tracking(None):
+        read_all(file_loc)
+    assert metrics.reads == {file_loc: 5000}
+
+
+def test_pools_count_for_the_caller():
+    root = tempfile.mkdtemp()
+    files = [write(os.path.join(root, str(i)), 1000 * b"a") for i in range(4)]
+    metrics = ConditionMetrics("test")
+
+    with tracking(metrics):
+        results = list(ordered_map(read_all, files, lambda r: not r, max_workers=2))
+
+    assert len(results) == 4
+    assert sum(metrics.reads.values()) == 4000
+
+
+def test_metrics_pickle():
+    metrics = ConditionMetrics("test")
+    metrics.add_read("f", 1)
+    metrics.add_cpu(0.5)
+
+    other = pickle.loads(pickle.dumps(metrics))
+    other.merge(metrics)
+
+    assert other.reads == {"f": 2}
+    assert other.cpu_seconds == pytest.approx(1.0)
+
+
+def test_runner_metrics():
+    file_loc = write(os.path.join(tempfile.mkdtemp(), "f"), 3000 * b"a")
+
+    class Reads:
+        name = "reads"
+
+        def __call__(self):
+            return read_all(file_loc)
+
+    runner = ConditionRunner([Reads()])
+
+    assert runner()
+    assert runner.metrics["reads"].reads == {file_loc: 3000}
+    assert runner.metrics["reads"].wall_seconds > 0
+
+
+def test_main_writes_the_report(job, monkeypatch):
+    path = os.path.join(job, "logs", "metrics.json")
+    monkeypatch.setenv("METRICS_REPORT", path)
+
+    verdicts = filter.main.main()
+
+    with open(path) as f:
+        report = json.load(f)
+
+    assert all(verdicts.values())
+    assert set(report["conditions"]) == set(verdicts)
+    assert report["startup"]["imports_ms"]
+    assert report["peak_rss_mb"] > 0
+
+    condition = report["conditions"]["Correlation"]
+    assert condition["verdict"] is True
+    assert set(condition) >= {
+        "wall_seconds",
+        "cpu_seconds",
+        "bytes_read",
+        "files_read",
+        "mb_per_s",
+        "peak_rss_mb",
+    }
+
+    # * the shared scan read the input and the output for all of them
+    read = report["scan"]["bytes_read"]
+    assert read["inputs"] == os.path.getsize(os.path.join(job, "inputs", "did", "0"))
+    assert read["outputs"] > 0
+
+
+def test_main_does_not_write_into_outputs(job, monkeypatch):
+    path = os.path.join(job, "outputs", "metrics.json")
+    monkeypatch.setenv("METRICS_REPORT", path)
+
+    filter.main.main()
+
+    assert not os.path.exists(path)
@@ -2,9 +2,15 @@ import pytest
 import os
 import json
 import tempfile
+import tracemalloc
 from typing import Optional, Dict
 
-from filter.conditions.no_keywords import NoKeywords
+from filter.conditions.no_keywords import (
+    DistinctCells,
+    NoKeywords,
+    find_keyword_in_csv,
+)
+from filter.conditions.utils.keywords import KeywordAutomaton
 
 
 DEFAULT_DATA_CATEGORIES = f'["Agriculture & Bio Engineering"]'
@@ -139,3 +145,253 @@ def test_multiple_categories():
     r = nk()
 
     assert r == False
+
+
+def test_keyword_inside_a_value():
+    nk = NoKeywords()
+
+    outputs = tempfile.mkdtemp()
+
+    os.environ["DATA_CATEGORIES"] = f'["Mathematics"]'
+    os.environ["OUTPUTS"] = outputs
+    os.environ["DIDS"] = '["a12345678"]'
+
+    has_keyword = "0,1,2,3\n0,fractals123,0,0"
+
+    output_f = tempfile.gettempprefix()
+    with open(os.path.join(outputs, f"{output_f}.csv"), "w") as f:
+        f.write(has_keyword)
+
+    r = nk()
+
+    assert r == False
+
+
+def test_keyword_inside_a_column_name():
+    outputs = tempfile.mkdtemp()
+
+    os.environ["DATA_CATEGORIES"] = DEFAULT_DATA_CATEGORIES
+    os.environ["OUTPUTS"] = outputs
+    os.environ["DIDS"] = '["a12345678"]'
+
+    nk = NoKeywords()
+
+    has_keyword = "0,my_agri2_column,2,3\n0,0,0,0"
+
+    output_f = tempfile.gettempprefix()
+    with open(os.path.join(outputs, f"{output_f}.csv"), "w") as f:
+        f.write(has_keyword)
+
+    assert nk.check_csv(os.path.join(outputs, f"{output_f}.csv")) == False
+
+
+def make_csv_checker(rows: str, monkeypatch, block_size: int = 16):
+    monkeypatch.setenv("READ_BUFFER_SIZE", str(block_size))
+    monkeypatch.setenv("CSV_SHARD_MIN_SIZE", str(1 << 40))
+
+    outputs = tempfile.mkdtemp()
+
+    os.environ["DATA_CATEGORIES"] = DEFAULT_DATA_CATEGORIES
+    os.environ["OUTPUTS"] = outputs
+    os.environ["DIDS"] = '["a12345678"]'
+
+    file_path = os.path.join(outputs, f"{tempfile.gettempprefix()}.csv")
+    with open(file_path, "w") as f:
+        f.write(rows)
+
+    return NoKeywords(), file_path
+
+
+@pytest.mark.parametrize("row", [0, 1, 5, 8, 19])
+def test_keyword_in_a_later_block(row, monkeypatch):
+    rows = ["0,1,2,3"] + ["0,0,0,0"] * 20
+    rows[row] = "0,0,xagri2x,0"
+    nk, file_path = make_csv_checker("\n".join(rows), monkeypatch)
+
+    assert nk.check_csv(file_path) == False
+
+
+def test_keyword_in_a_quoted_cell_across_blocks(monkeypatch):
+    rows = ["0,1,2,3"] + ["0,0,0,0"] * 4 + ['0,"a long\nag,ri1 cell",0,0']
+    nk, file_path = make_csv_checker("\n".join(rows), monkeypatch)
+
+    assert nk.check_csv(file_path) == True
+
+    rows[-1] = '0,"a long\nxagri1 cell",0,0'
+    nk, file_path = make_csv_checker("\n".join(rows), monkeypatch)
+
+    assert nk.check_csv(file_path) == False
+
+
+def test_keyword_split_by_quotes(monkeypatch):
+    # * the cell is agri1, the text is not
+    nk, file_path = make_csv_checker('0,1,2,3\n0,"agr"i1,0,0\n', monkeypatch)
+
+    assert nk.check_csv(file_path) == False
+    automaton = KeywordAutomaton(["agri1"])
+    assert find_keyword_in_csv(automaton, '0,"agr"i1,0,0\n') == "agri1"
+
+
+def test_no_keyword_in_blocks(monkeypatch):
+    rows = ["0,1,2,3"] + ["0,0,0,0"] * 20 + ["0,1"]
+    nk, file_path = make_csv_checker("\n".join(rows), monkeypatch)
+
+    assert nk.check_csv(file_path) == True
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        "",
+        "0,1,2,3\n0,0,0,0\n0,0,0,0,0\n",
+        "0,1,2,3\n0,0,0,0\n\xff,0,0,0\n",
+    ],
+    ids=["empty", "ragged", "not utf-8"],
+)
+def test_csv_pandas_would_refuse(rows, monkeypatch):
+    nk, file_path = make_csv_checker("", monkeypatch)
+    with open(file_path, "wb") as f:
+        f.write(rows.encode("latin-1"))
+
+    assert nk.check_csv(file_path) == False
+
+
+def test_csv_memory_is_bounded_by_the_blocks(monkeypatch):
+    row = ",".join(["0.5", "text", "12"] * 8)
+    header = ",".join(f"c{i}" for i in range(24))
+
+    def peak(rows: int) -> int:
+        nk, file_path = make_csv_checker(
+            header + "\n" + "\n".join([row] * rows), monkeypatch, 1 << 16
+        )
+        tracemalloc.start()
+        try:
+            assert nk.check_csv(file_path) == True
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    small, large = peak(5_000), peak(50_000)
+
+    assert large < small * 2
+
+
+def make_txt_checker(text: bytes, monkeypatch, block_size: int = 7):
+    nk, csv_path = make_csv_checker("", monkeypatch, block_size)
+    os.remove(csv_path)
+
+    file_path = csv_path[: -len(".csv")] + ".txt"
+    with open(file_path, "wb") as f:
+        f.write(text)
+
+    return nk, file_path
+
+
+@pytest.mark.parametrize("offset", range(0, 16))
+def test_txt_keyword_across_blocks(offset, monkeypatch):
+    nk, file_path = make_txt_checker(
+        b"x" * offset + b"log line with agri3 in it\n" + b"y" * 20, monkeypatch
+    )
+
+    assert nk.check_txt(file_path) == False
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 1 << 20])
+def test_txt_block_sizes(block_size, monkeypatch):
+    text = "2021-01-01 INFO é nothing to see here\n" * 50
+
+    nk, file_path = make_txt_checker(text.encode(), monkeypatch, block_size)
+    assert nk.check_txt(file_path) == True
+
+    nk, file_path = make_txt_checker(
+        (text + "fractals agri2").encode(), monkeypatch, block_size
+    )
+    assert nk.check_txt(file_path) == False
+
+
+def test_txt_end_to_end(monkeypatch):
+    nk, file_path = make_txt_checker(b"", monkeypatch)
+    assert nk() == True
+
+    with open(file_path, "wb") as f:
+        f.write(b"\x00\xff binary junk agri1 \xfe")
+    assert nk() == False
+
+
+def test_fuzzy_keywords(monkeypatch):
+    outputs = tempfile.mkdtemp()
+
+    os.environ["DATA_CATEGORIES"] = f'["Mathematics"]'
+    os.environ["OUTPUTS"] = outputs
+    os.environ["DIDS"] = '["a12345678"]'
+
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("0,1,2,3\n0,fr4ct4l5,f0urier,0")
+
+    assert NoKeywords()() == True
+
+    monkeypatch.setenv("KEYWORD_MAX_EDITS", "1")
+    assert NoKeywords()() == False
+
+
+def test_canonical_keywords(monkeypatch):
+    outputs = tempfile.mkdtemp()
+
+    os.environ["DATA_CATEGORIES"] = f'["Mathematics"]'
+    os.environ["OUTPUTS"] = outputs
+    os.environ["DIDS"] = '["a12345678"]'
+
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("0,1,2,3\n0,F.R.4.C.T.4.L.5,0,0")
+    with open(os.path.join(outputs, "out.json"), "w") as f:
+        f.write('{"a": ["Chaos-Theory"]}')
+
+    assert NoKeywords()() == True
+
+    monkeypatch.setenv("KEYWORD_CANONICALIZE", "1")
+    nk = NoKeywords()
+    assert nk.check_csv(os.path.join(outputs, "out.csv")) == False
+    assert nk.check_json(os.path.join(outputs, "out.json")) == False
+
+
+def test_distinct_cells():
+    cells = DistinctCells(KeywordAutomaton(["fractals"]))
+    rows = [["a", "1", "x"], ["a", "2.5e3", "y"], ["b", " -3 ", "x"], ["1", "b"]]
+
+    assert cells.new_cells(rows) == ["a", "x", "y", "b", "b"]
+    assert cells.new_cells([["a", "z", "x"]]) == ["z"]
+
+    # * a keyword that a number may hold
+    cells = DistinctCells(KeywordAutomaton(["1984"]))
+    assert cells.new_cells([["19845", "1"]]) == ["19845", "1"]
+    assert not DistinctCells(KeywordAutomaton(["test"], canonical=True)).skip_numbers
+    assert not DistinctCells(KeywordAutomaton(["ab1234"], 2)).skip_numbers
+
+
+def test_quoted_csv_searches_distinct_cells(monkeypatch):
+    searched = []
+    search = KeywordAutomaton.search
+
+    def counting(self, text, canonicalized=False):
+        searched.append(len(text))
+        return search(self, text, canonicalized)
+
+    monkeypatch.setattr(KeywordAutomaton, "search", counting)
+    rows = "name,colour\n" + '"a, b","red"\n"c","blue"\n' * 5000
+    nk, file_path = make_csv_checker(rows, monkeypatch, 1 << 12)
+
+    assert nk.check_csv(file_path) == True
+    # * every value once, not once per row
+    assert 0 < sum(searched) < 100
+
+
+def test_keyword_with_csv_syntax():
+    automaton = KeywordAutomaton(["fract,als", "agri1"])
+    rows = "a,b,c\n" + "1,x,y\n" * 1000
+    cells = DistinctCells(automaton)
+
+    assert find_keyword_in_csv(automaton, rows, cells) is None
+    assert find_keyword_in_csv(automaton, '2,x,"fract,als"\n', cells) == "fract,als"
+    # * across cells is not in a cell
+    assert find_keyword_in_csv(automaton, "fract,als\n") is None
+    assert find_keyword_in_csv(automaton, rows + "3,agri1,z\n") == "agri1"
@@ -0,0 +1,121 @@
+import pytest  # type: ignore
+import logging
+import tempfile
+import time
+import os
+
+from filter.conditions.no_keywords import NoKeywords
+from filter.conditions.not_encrypted import NotEncrypted
+from filter.conditions.utils import parallel
+from filter.conditions.utils.cancel import (
+    Cancelled,
+    raise_if_cancelled,
+    set_cancel_event,
+)
+from filter.conditions.utils.parallel import available_cpus, ordered_map
+from filter.conditions.utils.pyramid import clear_pyramids
+from filter.tests.test_scan import make_job
+
+
+@pytest.fixture(autouse=True)
+def clean_env_vars_before_tests():
+    os.environ["OUTPUTS"] = ""
+    os.environ["INPUTS"] = ""
+    os.environ["DIDS"] = "[]"
+    clear_pyramids()
+    yield
+
+
+def slow(delay):
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        raise_if_cancelled()
+        time.sleep(0.01)
+
+
+def test_results_in_order():
+    def fn(i):
+        slow(0.01 * (5 - i))
+        return i
+
+    assert list(ordered_map(fn, range(5), lambda r: False, max_workers=4)) == [
+        (i, i) for i in range(5)
+    ]
+
+
+def test_failure_cancels_the_rest():
+    started = []
+
+    def fn(i):
+        started.append(i)
+        if i == 1:
+            return False
+        slow(30)
+        return True
+
+    start = time.monotonic()
+    results = list(ordered_map(fn, range(10), lambda ok: not ok, max_workers=3))
+
+    assert time.monotonic() - start < 5
+    # * item 0 was cancelled because item 1 failed
+    assert results == [(1, False)]
+    assert len(started) < 10
+
+
+def test_cancelled_with_the_caller():
+    class Event:
+        def is_set(self):
+            return True
+
+    set_cancel_event(Event())
+    try:
+        with pytest.raises(Cancelled):
+            list(ordered_map(lambda i: i, range(4), lambda r: False, max_workers=2))
+    finally:
+        set_cancel_event(None)
+
+
+def test_cpus_capped_by_cgroup(monkeypatch):
+    cpu_max = tempfile.mktemp()
+    monkeypatch.setattr(parallel, "CGROUP_V2_CPU_MAX", cpu_max)
+
+    with open(cpu_max, "w") as f:
+        f.write("max 100000\n")
+    cpus = available_cpus()
+    assert cpus >= 1
+
+    with open(cpu_max, "w") as f:
+        f.write("50000 100000\n")
+    assert available_cpus() == 1
+
+
+@pytest.mark.parametrize("workers", ["1", "4"])
+def test_not_encrypted_names_the_failed_file(workers, monkeypatch, caplog):
+    monkeypatch.setenv("FILE_WORKERS", workers)
+    inputs, outputs = make_job(b"0,1,2,3\n" * 1000, "a.csv")
+    for name in "bcd":
+        with open(os.path.join(outputs, f"{name}.csv"), "wb") as f:
+            f.write(b"0,1,2,3\n" * 1000)
+    with open(os.path.join(outputs, "e.zip"), "wb") as f:
+        f.write(os.urandom(100000))
+
+    with caplog.at_level(logging.ERROR):
+        assert not NotEncrypted()()
+
+    assert "e.zip exceeds the encryption threshold" in caplog.text
+
+
+@pytest.mark.parametrize("workers", ["1", "4"])
+def test_no_keywords_names_the_failed_file(workers, monkeypatch, caplog):
+    monkeypatch.setenv("FILE_WORKERS", workers)
+    inputs, outputs = make_job(b"0,1,2,3\n", "a.csv")
+    for name in "bcd":
+        with open(os.path.join(outputs, f"{name}.csv"), "wb") as f:
+            f.write(b"0,1,2,3\n")
+    with open(os.path.join(outputs, "c.csv"), "wb") as f:
+        f.write(b"0,1,2,3\n0,agri2,0,0\n")
+
+    with caplog.at_level(logging.ERROR):
+        assert not NoKeywords()()
+
+    assert "c.csv contains keywords" in caplog.text
@@ -0,0 +1,91 @@
+import pytest  # type: ignore
+import tempfile
+import pstats
+import time
+import os
+
+from filter.conditions.utils.profiling import StackSampler, profiling
+from filter.runner import ConditionRunner
+
+
+def busy(seconds=0.2):
+    n = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        n += 1
+    return n
+
+
+class Busy:
+    name = "busy"
+
+    def __call__(self):
+        return busy() > 0
+
+
+@pytest.mark.parametrize("mode", ["deterministic", "sampling"])
+def test_profiling(mode, monkeypatch):
+    directory = tempfile.mkdtemp()
+    monkeypatch.setenv("PROFILE", mode)
+    monkeypatch.setenv("PROFILE_DIR", directory)
+
+    with profiling("condition"):
+        busy()
+
+    stats = pstats.Stats(os.path.join(directory, "condition.pstats"))
+    assert any(name == "busy" for _, _, name in stats.stats)  # type: ignore
+
+    with open(os.path.join(directory, "condition.collapsed")) as f:
+        lines = f.read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert "busy (test_profiling.py:" in stack
+    assert int(count) > 0
+
+
+def test_profiling_is_off_by_default(monkeypatch):
+    directory = tempfile.mkdtemp()
+    monkeypatch.delenv("PROFILE", raising=False)
+    monkeypatch.setenv("PROFILE_DIR", directory)
+
+    with profiling("condition"):
+        busy(0.01)
+
+    assert os.listdir(directory) == []
+
+
+def test_profiles_never_go_into_outputs(monkeypatch):
+    outputs = tempfile.mkdtemp()
+    monkeypatch.setenv("PROFILE", "sampling")
+    monkeypatch.setenv("OUTPUTS", outputs)
+    monkeypatch.setenv("PROFILE_DIR", os.path.join(outputs, "profiles"))
+
+    with profiling("condition"):
+        busy(0.01)
+
+    assert os.listdir(outputs) == []
+
+
+def test_sampler_stats():
+    sampler = StackSampler(0, interval=0.01)
+    a, b, c = ("f", 1, "a"), ("f", 2, "b"), ("f", 3, "c")
+    sampler.counts.update({(a, b): 3, (a, c): 1})
+
+    stats = sampler.stats()
+
+    assert stats[a][:4] == (4, 4, 0.0, pytest.approx(0.04))
+    assert stats[b][:4] == (3, 3, pytest.approx(0.03), pytest.approx(0.03))
+    assert stats[b][4] == {a: (3, 3, 0.0, pytest.approx(0.03))}
+    assert sampler.collapsed().splitlines() == [
+        "a (f:1);b (f:2) 3",
+        "a (f:1);c (f:3) 1",
+    ]
+
+
+def test_runner_profiles_every_condition(monkeypatch):
+    directory = tempfile.mkdtemp()
+    monkeypatch.setenv("PROFILE", "sampling")
+    monkeypatch.setenv("PROFILE_DIR", directory)
+
+    assert ConditionRunner([Busy()])()
+    assert sorted(os.listdir(directory)) == ["busy.collapsed", "busy.pstats"]
@@ -0,0 +1,85 @@
+import pytest  # type: ignore
+import tempfile
+import random
+import os
+
+from filter.conditions.utils import EntropyAlgos, byte_histograms
+from filter.conditions.utils.pyramid import (
+    HistogramPyramid,
+    PyramidBuilder,
+    base_block_size_for,
+    get_pyramid,
+    clear_pyramids,
+)
+
+
+def random_bytes(n: int, seed: int = 0) -> bytes:
+    r = random.Random(seed)
+    return bytes(r.getrandbits(6) for _ in range(n))
+
+
+@pytest.mark.parametrize("block_size", [1024, 2048, 3072, 10240, 102400])
+def test_coarse_levels_match_direct_histograms(block_size):
+    data = random_bytes(50000)
+    pyramid = HistogramPyramid.from_buffer(data, 1024)
+
+    assert (pyramid.histograms(block_size) == byte_histograms(data, block_size)).all()
+    assert list(pyramid.entropies(block_size)) == pytest.approx(
+        list(EntropyAlgos.shannon_blocks(data, block_size))
+    )
+
+
+def test_whole_file_entropy():
+    data = random_bytes(5000)
+    pyramid = HistogramPyramid.from_buffer(data, 1024)
+
+    assert pyramid.entropy() == pytest.approx(EntropyAlgos.shannon(data))
+    assert pyramid.total_histogram().sum() == len(data)
+
+
+def test_block_size_must_be_multiple_of_base():
+    pyramid = HistogramPyramid.from_buffer(random_bytes(5000), 1024)
+
+    with pytest.raises(ValueError):
+        pyramid.histograms(1500)
+
+    assert pyramid.block_size_for(1500) == 2048
+    assert pyramid.block_size_for(1) == 1024
+
+
+def test_builder_handles_unaligned_updates():
+    data = random_bytes(20000)
+    builder = PyramidBuilder(len(data), 1024)
+
+    i = 0
+    for step in (1, 1000, 37, 5000, 4096, 20000):
+        builder.update(data[i : i + step])
+        i += step
+
+    pyramid = builder.finish()
+
+    assert pyramid.size == len(data)
+    assert (pyramid.histograms(1024) == byte_histograms(data, 1024)).all()
+
+
+def test_file_pyramid_is_read_once():
+    data = random_bytes(30000)
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(data)
+
+    clear_pyramids()
+    pyramid = get_pyramid(f.name)
+
+    assert pyramid is get_pyramid(f.name)
+    assert pyramid.base_block_size == base_block_size_for(len(data))
+    assert (pyramid.histograms(4096) == byte_histograms(data, 4096)).all()
+
+    os.unlink(f.name)
+
+
+def test_base_block_size_is_capped():
+    assert base_block_size_for(0) == 1024
+    assert base_block_size_for(16 * 1024 * 1024) == 1024
+    assert base_block_size_for(16 * 1024 * 1024 + 1) == 2048
+    assert base_block_size_for(1024**3) == 65536
@@ -0,0 +1,116 @@
+import tempfile
+import time
+import os
+
+from filter.conditions.small_size import SmallSize
+from filter.conditions.utils.cancel import raise_if_cancelled
+from filter.main import main, wipe_outputs
+from filter.runner import ConditionRunner
+
+
+class Condition:
+    def __init__(self, name, is_valid=True, delay=0.0):
+        self.name = name
+        self.is_valid = is_valid
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    def __call__(self):
+        self.calls += 1
+        deadline = time.monotonic() + self.delay
+        try:
+            while time.monotonic() < deadline:
+                raise_if_cancelled()
+                time.sleep(0.01)
+        except Exception:
+            self.cancelled = True
+            raise
+        if isinstance(self.is_valid, Exception):
+            raise self.is_valid
+        return self.is_valid
+
+
+def test_all_conditions_met():
+    conditions = [Condition("a", delay=0.05), Condition("b"), Condition("c")]
+    runner = ConditionRunner(conditions)
+
+    assert runner()
+    assert runner.failed is None
+    assert runner.results == {"a": True, "b": True, "c": True}
+
+
+def test_conditions_run_concurrently():
+    conditions = [Condition(name, delay=0.3) for name in "abcd"]
+
+    start = time.monotonic()
+    assert ConditionRunner(conditions)()
+    assert time.monotonic() - start < 1.0
+
+
+def test_failure_cancels_the_others():
+    slow = Condition("slow", delay=30)
+    runner = ConditionRunner([slow, Condition("bad", is_valid=False)])
+
+    start = time.monotonic()
+    assert not runner()
+    assert time.monotonic() - start < 5
+
+    assert runner.failed.name == "bad"
+    assert runner.results["bad"] is False
+    assert runner.results["slow"] is None
+
+    deadline = time.monotonic() + 5
+    while not slow.cancelled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert slow.cancelled
+
+
+def test_error_fails_closed():
+    runner = ConditionRunner([Condition("a"), Condition("b", RuntimeError("boom"))])
+
+    assert not runner()
+    assert runner.failed.name == "b"
+
+
+def test_single_worker_stops_at_first_failure():
+    conditions = [Condition("a"), Condition("b", is_valid=False), Condition("c")]
+    runner = ConditionRunner(conditions, max_workers=1)
+
+    assert not runner()
+    assert runner.failed.name == "b"
+    assert runner.results == {"a": True, "b": False, "c": None}
+    assert conditions[2].calls == 0
+
+
+def test_wipe_outputs():
+    outputs = tempfile.mkdtemp()
+    os.makedirs(os.path.join(outputs, "dir"))
+    with open(os.path.join(outputs, "dir", "f"), "w") as f:
+        f.write("data")
+
+    wipe_outputs(outputs)
+
+    assert os.listdir(outputs) == ["output.txt"]
+
+
+def test_wipe_outputs_without_outputs():
+    cwd = os.getcwd()
+    wipe_outputs("")
+    assert os.getcwd() == cwd and os.listdir(cwd)
+
+
+def test_main_fails_closed_when_small_size_raises(monkeypatch):
+    outputs = tempfile.mkdtemp()
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("data")
+    monkeypatch.setenv("INPUTS", tempfile.mkdtemp())
+    monkeypatch.setenv("OUTPUTS", outputs)
+
+    def raises(self):
+        raise FileNotFoundError("removed while it was being sized")
+
+    monkeypatch.setattr(SmallSize, "__call__", raises)
+
+    assert main() == {"SmallSize": False}
+    assert os.listdir(outputs) == ["output.txt"]
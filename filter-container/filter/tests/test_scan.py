@@ -0,0 +1,121 @@
+import pytest  # type: ignore
+from threading import Event
+import tempfile
+import json
+import os
+
+from filter.conditions import DEFAULT_FILENAME
+from filter.conditions.no_keywords import NoKeywords, CsvKeywordObserver
+from filter.conditions.not_correlated import NotCorrelated
+from filter.conditions.not_encrypted import NotEncrypted
+from filter.conditions.utils.cancel import Cancelled, set_cancel_event
+from filter.conditions.utils.pyramid import clear_pyramids
+from filter.conditions.utils.scan import ScanEngine, PyramidObserver
+
+DEFAULT_DATA_CATEGORIES = f'["Agriculture & Bio Engineering"]'
+
+
+@pytest.fixture(autouse=True)
+def clean_env_vars_before_tests():
+    os.environ["OUTPUTS"] = ""
+    os.environ["INPUTS"] = ""
+    os.environ["DIDS"] = "[]"
+    # * left behind by test_not_correlated
+    os.environ.pop("CORRELATION_ENTROPY_THRESH", None)
+    clear_pyramids()
+    yield
+
+
+def make_job(output: bytes, output_name: str = "out.csv"):
+    inputs = tempfile.mkdtemp()
+    outputs = tempfile.mkdtemp()
+
+    os.environ["INPUTS"] = inputs
+    os.environ["OUTPUTS"] = outputs
+    os.environ["DIDS"] = '["a12345678"]'
+    os.environ["DATA_CATEGORIES"] = DEFAULT_DATA_CATEGORIES
+
+    did = json.loads(os.getenv("DIDS"))
+    os.makedirs(os.path.join(inputs, did[0]))
+
+    with open(os.path.join(inputs, did[0], DEFAULT_FILENAME), "wb") as f:
+        f.write(1000 * b"0,1,2,3\n4,5,6,7\n")
+
+    with open(os.path.join(outputs, output_name), "wb") as f:
+        f.write(output)
+
+    return inputs, outputs
+
+
+def scan(conditions, block_size=None):
+    engine = ScanEngine(block_size)
+    for condition in conditions:
+        for observer in condition.observers():
+            engine.register(observer)
+    engine.run([os.environ["INPUTS"], os.environ["OUTPUTS"]])
+    return engine
+
+
+def test_every_file_is_read_once():
+    inputs, outputs = make_job(b"0,1,2,3\n0,0,0,0\n")
+
+    conditions = [NotEncrypted(), NotCorrelated(), NoKeywords()]
+    engine = scan(conditions)
+
+    # * both pyramid observers were merged into one
+    assert sum(isinstance(o, PyramidObserver) for o in engine.observers) == 1
+    assert engine.bytes_read == 16000 + 16
+
+    assert [c() for c in conditions] == [True, True, True]
+
+
+def test_verdicts_match_unscanned_conditions():
+    make_job(b"0,1,2,3\n0,agri2,0,0\n")
+
+    scanned = [NotEncrypted(), NotCorrelated(), NoKeywords()]
+    scan(scanned)
+    clear_pyramids()
+    not_scanned = [NotEncrypted(), NotCorrelated(), NoKeywords()]
+
+    assert [c() for c in scanned] == [c() for c in not_scanned]
+    assert scanned[-1]._observer.verdicts != {}
+
+
+def test_keywords_across_blocks_and_quoted_newlines():
+    output = b'a,b\n"x\nagri1",1\n' + 200 * b"0,1\n" + b'"agri3"\n'
+    inputs, outputs = make_job(output)
+    file_loc = os.path.join(outputs, "out.csv")
+
+    observer = CsvKeywordObserver([file_loc], ["agri1", "agri3"])
+    engine = ScanEngine(block_size=7)
+    engine.register(observer)
+    engine.run([outputs])
+
+    # * "x\nagri1" is a single cell, so only agri3 matches
+    assert observer.verdicts == {file_loc: False}
+    assert observer._files == {}
+
+
+def test_ragged_csv_is_left_to_pandas():
+    inputs, outputs = make_job(b"a,b\n1,2,3\n")
+    file_loc = os.path.join(outputs, "out.csv")
+
+    observer = CsvKeywordObserver([file_loc], ["agri1"])
+    engine = ScanEngine()
+    engine.register(observer)
+    engine.run([outputs])
+
+    assert observer.verdicts == {}
+
+
+def test_cancelled_scan_stops():
+    inputs, outputs = make_job(b"0,1,2,3\n")
+
+    cancel = Event()
+    cancel.set()
+    set_cancel_event(cancel)
+    try:
+        with pytest.raises(Cancelled):
+            scan([NotEncrypted()])
+    finally:
+        set_cancel_event(None)
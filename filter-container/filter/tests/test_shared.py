@@ -0,0 +1,142 @@
+import pytest  # type: ignore
+import threading
+import tempfile
+import os
+
+from filter.conditions.no_keywords import NoKeywords
+from filter.conditions.not_correlated import NotCorrelated
+from filter.conditions.not_encrypted import NotEncrypted
+from filter.conditions.small_size import SmallSize
+from filter.conditions.utils.blocks import BlockReader
+from filter.conditions.utils.pyramid import clear_pyramids
+from filter.conditions.utils.shared import (
+    SharedFiles,
+    attach_shared_files,
+    detach_shared_files,
+    open_file,
+    shared_buffer,
+)
+from filter.runner import ConditionRunner
+from filter.tests.test_scan import make_job
+
+
+@pytest.fixture(autouse=True)
+def clean_env_vars_before_tests():
+    os.environ["OUTPUTS"] = ""
+    os.environ["INPUTS"] = ""
+    os.environ["DIDS"] = "[]"
+    clear_pyramids()
+    yield
+    detach_shared_files()
+
+
+def write_temp(data: bytes) -> str:
+    fd, file_loc = tempfile.mkstemp()
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return file_loc
+
+
+def test_segments_are_unlinked():
+    file_loc = write_temp(b"0123456789" * 1000)
+
+    with SharedFiles([file_loc, write_temp(b"")]) as shared:
+        # * empty files are not shared
+        assert len(shared.handles) == 1
+        name = shared.handles[0].name
+        assert os.path.exists(os.path.join("/dev/shm", name))
+
+    assert not os.path.exists(os.path.join("/dev/shm", name))
+
+
+def test_block_reader_reads_shared_file():
+    data = os.urandom(10000)
+    file_loc = write_temp(data)
+
+    with SharedFiles([file_loc]) as shared:
+        attach_shared_files(shared.handles)
+
+        with BlockReader(file_loc, 4096) as reader:
+            assert reader.is_mapped
+            # * the file is not opened at all
+            assert reader._f is None
+            assert b"".join(bytes(b) for b in reader) == data
+            assert bytes(reader.read_block(100, 10)) == data[100:110]
+
+        with open_file(file_loc) as f:
+            assert f.read() == data
+
+        detach_shared_files()
+
+
+def test_changed_file_is_read_from_disk():
+    file_loc = write_temp(b"before")
+
+    with SharedFiles([file_loc]) as shared:
+        attach_shared_files(shared.handles)
+        assert bytes(shared_buffer(file_loc)) == b"before"
+
+        with open(file_loc, "wb") as f:
+            f.write(b"after, and longer")
+
+        assert shared_buffer(file_loc) is None
+        with BlockReader(file_loc, 4) as reader:
+            assert b"".join(bytes(b) for b in reader) == b"after, and longer"
+
+        detach_shared_files()
+
+
+def test_process_pool_verdicts_match_threads():
+    make_job(b"0,1,2,3\n0,agri2,0,0\n")
+
+    conditions = [SmallSize(), NotEncrypted(), NotCorrelated(), NoKeywords()]
+    expected = {c.name: c() for c in conditions}
+    clear_pyramids()
+
+    runner = ConditionRunner(conditions, max_workers=1, pool="process")
+
+    assert not runner()
+    assert runner.failed.name == "Correlation"
+    # * the conditions after the failed one were cancelled
+    assert runner.results == {
+        "SmallSize": True,
+        "NotEncrypted": True,
+        "Correlation": False,
+        "Keywords": None,
+    }
+    assert expected == {**runner.results, "Keywords": expected["Keywords"]}
+
+
+class Crash:
+    name = "Crash"
+
+    def __call__(self):
+        os._exit(1)
+
+
+def test_crashed_worker_fails_closed():
+    make_job(b"0,1,2,3\n")
+
+    runner = ConditionRunner([Crash()], pool="process")
+
+    assert not runner()
+    assert runner.failed.name == "Crash"
+
+
+_held = threading.Lock()
+
+
+class TakesTheLock:
+    name = "TakesTheLock"
+
+    def __call__(self):
+        # * a forked worker would get the lock as held, by a thread it does not have
+        return _held.acquire(timeout=1)
+
+
+def test_workers_do_not_inherit_held_locks():
+    make_job(b"0,1,2,3\n")
+
+    with _held:
+        runner = ConditionRunner([TakesTheLock()], pool="process")
+        assert runner()
@@ -0,0 +1,105 @@
+import pytest  # type: ignore
+import subprocess
+import tempfile
+import time
+import sys
+import os
+
+from filter.conditions.utils.lazy import LazyModule, startup_report, timed_import
+
+# * seconds that `python -m filter.main` may take, interpreter startup included,
+# * for a job that fails SmallSize. Set STARTUP_BUDGET on slow machines
+DEFAULT_STARTUP_BUDGET = 1.0
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEAVY_MODULES = ["numpy", "pandas", "yaml", "confuse"]
+
+
+def run_python(args, **env):
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env={**os.environ, "PYTHONPATH": ROOT, **env},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+
+@pytest.fixture
+def too_large_outputs():
+    inputs, outputs = tempfile.mkdtemp(), tempfile.mkdtemp()
+    with open(os.path.join(inputs, "in.csv"), "w") as f:
+        f.write("a" * 100)
+    with open(os.path.join(outputs, "out.csv"), "w") as f:
+        f.write("a" * 1000)
+    return {"INPUTS": inputs, "OUTPUTS": outputs}
+
+
+def test_imports_are_lazy():
+    code = (
+        "import sys, filter.main; print(sorted(set(sys.argv[1:]) & set(sys.modules)))"
+    )
+    result = run_python(["-c", code, *HEAVY_MODULES])
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+def test_failing_small_size_imports_nothing_heavy(too_large_outputs):
+    code = (
+        "import sys, filter.main\n"
+        "assert filter.main.main() == {'SmallSize': False}\n"
+        "print(sorted(set(sys.argv[1:]) & set(sys.modules)))"
+    )
+    result = run_python(["-c", code, *HEAVY_MODULES], **too_large_outputs)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+    assert os.listdir(too_large_outputs["OUTPUTS"]) == ["output.txt"]
+
+
+def test_cold_start_budget(too_large_outputs):
+    budget = float(os.getenv("STARTUP_BUDGET", DEFAULT_STARTUP_BUDGET))
+    timings = []
+
+    for _ in range(3):
+        start = time.perf_counter()
+        result = run_python(["-m", "filter.main"], **too_large_outputs)
+        timings.append(time.perf_counter() - start)
+        assert result.returncode == 0, result.stderr
+        assert "startup: " in result.stdout
+
+    assert min(timings) <= budget, f"cold start took {min(timings):.3f}s"
+
+
+def test_lazy_module():
+    json = LazyModule("json")
+
+    assert json.dumps([1]) == "[1]"
+    assert "dumps" in vars(json)
+    assert timed_import("json") is sys.modules["json"]
+    assert "imports_ms" in startup_report()
+
+
+def test_lazy_module_from_several_threads():
+    # * the conditions start on several threads at once, none of them may see a
+    # * half imported numpy
+    code = (
+        "import threading\n"
+        "from filter.conditions.utils.lazy import LazyModule\n"
+        "np = LazyModule('numpy')\n"
+        "errors = []\n"
+        "def use():\n"
+        "    try:\n"
+        "        np.iinfo(np.int64)\n"
+        "    except Exception as e:\n"
+        "        errors.append(e)\n"
+        "threads = [threading.Thread(target=use) for _ in range(8)]\n"
+        "[t.start() for t in threads]\n"
+        "[t.join() for t in threads]\n"
+        "assert not errors, errors\n"
+    )
+    done = run_python(["-c", code])
+
+    assert done.returncode == 0, done.stderr